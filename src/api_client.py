@@ -0,0 +1,63 @@
+# Shared HTTP client for the Streamlit frontends
+import streamlit as st
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Optional
+from config import (
+    API_BASE_URL,
+    API_TIMEOUT,
+    API_CONNECT_TIMEOUT,
+    API_MAX_RETRIES,
+    API_RETRY_BACKOFF,
+    API_POOL_SIZE,
+    API_CACHE_TTL
+)
+
+@st.cache_resource
+def get_api_session() -> requests.Session:
+    """Create one keep-alive session per Streamlit server, shared by all reruns"""
+    retry = Retry(
+        total=API_MAX_RETRIES,
+        backoff_factor=API_RETRY_BACKOFF,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["GET", "POST"]
+    )
+    adapter = HTTPAdapter(
+        pool_connections=API_POOL_SIZE,
+        pool_maxsize=API_POOL_SIZE,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def send_api_request(endpoint: str, method: str = "GET", data: Optional[Dict] = None) -> Dict:
+    """Send a request through the shared session, raising on HTTP errors"""
+    url = f"{API_BASE_URL}{endpoint}"
+    session = get_api_session()
+    if method == "GET":
+        response = session.get(url, timeout=(API_CONNECT_TIMEOUT, API_TIMEOUT))
+    elif method == "POST":
+        response = session.post(url, json=data, timeout=(API_CONNECT_TIMEOUT, API_TIMEOUT))
+    else:
+        raise ValueError(f"Unsupported method: {method}")
+
+    response.raise_for_status()
+    return response.json()
+
+@st.cache_data(ttl=API_CACHE_TTL, show_spinner=False)
+def cached_api_request(endpoint: str, method: str = "GET", data: Optional[Dict] = None) -> Dict:
+    """Memoized variant of send_api_request; failed requests raise and are not cached"""
+    return send_api_request(endpoint, method, data)
+
+def make_api_request(endpoint: str, method: str = "GET", data: Optional[Dict] = None, use_cache: bool = True) -> Optional[Dict]:
+    """Make API request to FastAPI backend"""
+    try:
+        if use_cache:
+            return cached_api_request(endpoint, method, data)
+        return send_api_request(endpoint, method, data)
+    except requests.exceptions.RequestException as e:
+        st.error(f"API Error: {str(e)}")
+        return None
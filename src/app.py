@@ -1,18 +1,83 @@
 import logging 
+import orjson
+from contextlib import asynccontextmanager
 from typing import List, Dict, Optional, Any
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
 from search_engine import SearchEngine
+from pagination import RankingSnapshotStore, encode_cursor, decode_cursor
+from jobs import JobRegistry, JobScheduler, run_tracked
+from ingestion import JOB_TYPES
+from embedding_models import preload_active_encoder
+from schemas import (
+    SearchRequest,
+    PageRequest,
+    StreamRequest,
+    BookResponse,
+    SearchResponse,
+    PageResponse,
+    SuggestResponse,
+    CollectionStats,
+    QueryCacheStats,
+    WriteBufferStats,
+    DiskCacheStats,
+    PartitionStats,
+    FlushResult,
+    DocumentUpdate,
+    BulkUpsertRequest,
+    BulkDeleteRequest,
+    JobStatus,
+    MigrationRequest,
+    JobRequest,
+    ActiveCollection,
+    format_book,
+    format_search_response
+)
+from config import (
+    DEFAULT_RESULTS_COUNT,
+    MAX_API_RESULTS,
+    STREAM_BATCH_SIZE,
+    MAX_PAGE_SIZE,
+    EMBEDDING_MODELS,
+    SERVING_HOST,
+    SERVING_PORT,
+    MMR_LAMBDA,
+    MMR_CANDIDATE_POOL,
+    MAX_MMR_CANDIDATES,
+    QUERY_TIERS,
+    DEFAULT_QUERY_TIER,
+    MAX_PREVIEW_CHARS,
+    SUGGEST_FIELDS,
+    SUGGEST_LIMIT,
+    MAX_SUGGEST_LIMIT
+)
 import uvicorn
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Loaded at import so that with `gunicorn --preload` the master holds the weights and
+# forked workers share them copy-on-write instead of each loading their own copy
+preload_active_encoder("./chroma_db")
+search_engine = None
+
+@asynccontextmanager
+async def lifespan(app:FastAPI):
+    # Chroma's sqlite connections must not cross a fork, so each worker opens its own
+    global search_engine
+    search_engine = SearchEngine()
+    yield
+    job_scheduler.shutdown()
+    search_engine.close()
+
 app = FastAPI(
     title="Vector Store Search API",
     description="API FOR SEARCHING BOOKS IN THE 1002 BOOKS VECTOR STORE",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -21,31 +86,9 @@ app.add_middleware(
     allow_credentials=True,
 )
 
-search_engine = SearchEngine()
-
-class SearchRequest(BaseModel):
-    query:str
-    n_results:int = 5
-    author:Optional[str] = None
-    language:Optional[str] = None
-
-class BookResponse(BaseModel):
-    id:Optional[str] = None
-    title:Optional[str] = None
-    author:Optional[str] = None
-    language:Optional[str] = None
-    similarity_score:Optional[float] = None
-    document_preview:str
-
-class SearchResponse(BaseModel):
-    results:List[BookResponse]
-    total_found:int
-    query:str
-
-class CollectionStats(BaseModel):
-    total_books:int 
-    collection_name:str
-    database_path:str
+ranking_snapshots = RankingSnapshotStore()
+job_registry = JobRegistry()
+job_scheduler = JobScheduler(job_registry)
 
 @app.get("/",tags=["Root"])
 async def root (): 
@@ -55,77 +98,166 @@ async def root ():
         "version": "1.0.0",
         "endpoints":{
             "/search": "Search books by text",
+            "/search/page": "Cursor-paginated search over a stable ranking snapshot",
+            "/search/stream": "Stream search results as NDJSON",
             "/search/author": "Search books by author",
             "/search/language": "Search books by language",
             "/search/advanced": "Advanced search with filters",
+            "/suggest": "Autocomplete titles, authors and languages from a typed prefix",
             "/book/{book_id}": "Get book details by ID",
-            "/stats": "Get collection statistics"
+            "/book/{book_id}/similar": "Books similar to a given book, using its stored embedding",
+            "/stats": "Get collection statistics",
+            "/stats/query-cache": "Semantic query cache hit rate and size",
+            "/stats/write-buffer": "Buffered writes waiting to be merged and flush statistics",
+            "/stats/disk-cache": "Shared on-disk cache of query embeddings and answers",
+            "/stats/partitions": "Filter value counts, per-value partitions and query plans taken",
+            "/documents/{doc_id}": "Update (PUT) or delete (DELETE) one document through the write buffer",
+            "/documents/flush": "Merge buffered writes into the index now",
+            "/documents/bulk": "Bulk upsert (POST) or delete (DELETE) documents as a background job",
+            "/documents/bulk/{job_id}": "Get bulk job status",
+            "/documents/export": "Stream every document as NDJSON",
+            "/collections/active": "Active collection and embedding model",
+            "/collections/migrate": "Re-embed into a new model's collection and switch over",
+            "/jobs": "Submit (POST) or list (GET) ingestion, reindex, query-cache, partition and shared-index jobs",
+            "/jobs/{job_id}": "Job progress and ETA (GET) or cancel it (DELETE)"
             }    
         }
 
+def check_tier(tier:str) -> None:
+    if tier not in QUERY_TIERS:
+        raise HTTPException(status_code=400, detail=f"Unknown tier '{tier}', expected one of {sorted(QUERY_TIERS)}")
+
 @app.post("/search", response_model=SearchResponse, tags=["Search"])
 async def search_books(request:SearchRequest):
 
+    check_tier(request.tier)
     try:
         logger.info(f"Search request: {request.query}")
 
-        if request.author or request.language:
-            results = search_engine.advanced_search(
-                query=request.query,
-                author=request.author,
-                language=request.language,
-                n_results=request.n_results
-            )
-        else:
-            results = search_engine.search_books(request.query, request.n_results)
-
-        book_responses = []
-        for result in results:
-            book_responses.append(BookResponse(
-                id=result.get('id'),
-                title=result.get('title', 'Unknown Title'),
-                author=result.get('author', 'Unknown Author'),
-                language=result.get('language', 'Unknown Language'),
-                similarity_score=result.get('similarity_score'),
-                document_preview=result.get('document_preview', '')
-            ))
-
-        return SearchResponse(
-            results=book_responses,
-            total_found=len(book_responses),
-            query=request.query
+        answer = await run_in_threadpool(
+            search_engine.search_with_budget,
+            request.query,
+            request.n_results,
+            request.tier,
+            author=request.author,
+            language=request.language,
+            preview_chars=request.preview_chars,
+            diversify=request.diversify,
+            mmr_lambda=request.mmr_lambda,
+            candidate_pool=request.candidate_pool
         )
+        results = answer.pop('results')
+
+        return ORJSONResponse(format_search_response(results, request.query, **answer))
 
     except Exception as e:
         logger.error(f"Error in search: {e}")
         raise HTTPException(status_code=500, detail="Search error: {str(e)}")
 
+@app.post("/search/page", response_model=PageResponse, tags=["Search"])
+async def search_books_page(request:PageRequest):
+
+    check_tier(request.tier)
+    try:
+        if request.cursor:
+            snapshot_id, offset = decode_cursor(request.cursor)
+            snapshot = ranking_snapshots.get(snapshot_id)
+            if snapshot is None:
+                raise HTTPException(status_code=410, detail="Cursor expired, restart the search without a cursor")
+            query, ranking = snapshot
+        else:
+            logger.info(f"Paginated search request: {request.query}")
+            offset = 0
+            query = request.query
+            answer = await run_in_threadpool(
+                search_engine.run_with_budget,
+                request.tier,
+                search_engine.rank_books,
+                query,
+                request.max_results,
+                search_ef=QUERY_TIERS[request.tier]['search_ef'],
+                author=request.author,
+                language=request.language
+            )
+            if answer['degraded']:
+                # A ranking cut short is not snapshotted, so later pages never page through it
+                answer.pop('results')
+                return ORJSONResponse(format_search_response([], query, offset=0, next_cursor=None, **answer))
+            ranking = answer['results']
+            snapshot_id = ranking_snapshots.create(query, ranking)
+
+        page = ranking[offset:offset + request.limit]
+        answer = await run_in_threadpool(search_engine.run_with_budget, request.tier, search_engine.get_books_by_ranking, page)
+        results = answer.pop('results')
+        # A page that missed the deadline comes back empty with a cursor to retry it
+        next_offset = offset if answer['degraded'] else offset + len(page)
+
+        return ORJSONResponse(format_search_response(
+            results,
+            query,
+            total_found=len(ranking),
+            offset=offset,
+            next_cursor=encode_cursor(snapshot_id, next_offset) if next_offset < len(ranking) else None,
+            **answer
+        ))
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in paginated search: {e}")
+        raise HTTPException(status_code=500, detail=f"Paginated search error: {str(e)}")
+
+@app.post("/search/stream", tags=["Search"])
+async def search_books_stream(request:StreamRequest):
+
+    check_tier(request.tier)
+    try:
+        logger.info(f"Streaming search request: {request.query}")
+        answer = await run_in_threadpool(
+            search_engine.run_with_budget,
+            request.tier,
+            search_engine.rank_books,
+            request.query,
+            request.n_results,
+            search_ef=QUERY_TIERS[request.tier]['search_ef'],
+            author=request.author,
+            language=request.language
+        )
+    except Exception as e:
+        logger.error(f"Error in streaming search: {e}")
+        raise HTTPException(status_code=500, detail=f"Streaming search error: {str(e)}")
+    # Once streaming starts there is no envelope to flag a partial ranking in
+    if answer['degraded']:
+        raise HTTPException(status_code=504, detail=f"Ranking missed the {request.tier} deadline: {answer['degraded_reasons']}")
+    ranking = answer['results']
+
+    def generate_lines():
+        # Only STREAM_BATCH_SIZE documents are held in memory at a time
+        for result in search_engine.iter_books_by_ranking(ranking, STREAM_BATCH_SIZE):
+            yield orjson.dumps(format_book(result)) + b"\n"
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson")
+
 @app.get("/search/author/{author}", response_model=SearchResponse, tags=["Search"])
 async def search_by_author(
     author:str,
-    n_results:int = Query(default=5, ge=1, le=50)
+    n_results:int = Query(default=DEFAULT_RESULTS_COUNT, ge=1, le=MAX_API_RESULTS),
+    preview_chars:Optional[int] = Query(default=None, ge=0, le=MAX_PREVIEW_CHARS),
+    tier:str = DEFAULT_QUERY_TIER
 ):
+    check_tier(tier)
     try:
         logger.info(f"Author search request:{author}")
-        results = search_engine.search_by_author(author, n_results)
-
-        book_responses = []
-
-        for result in results:
-            book_responses.append(BookResponse(
-                id=result.get('id'),
-                title=result.get('title', 'Unknown Title'),
-                author=result.get('author', 'Unknown Author'),
-                language=result.get('language', 'Unknown Language'),
-                similarity_score=result.get('similarity_score'),
-                document_preview=result.get('document_preview', '')
-            ))
-
-        return SearchResponse(
-            results=book_responses,
-            total_found=len(book_responses),
-            query=f"author:{author}"
-        )
+        # Resolved once here, so the stored spelling can be echoed in the response query
+        resolved = search_engine.resolve_name(author, 'author')
+        answer = await run_in_threadpool(search_engine.run_with_budget, tier, search_engine.search_by_author, resolved, n_results, resolve=False)
+        results = answer.pop('results')
+        if preview_chars is not None:
+            results = search_engine.attach_previews(results, preview_chars)
+
+        return ORJSONResponse(format_search_response(results, f"author:{resolved}", **answer))
 
     except Exception as e:
         logger.error(f"Error in author search: {e}")
@@ -134,30 +266,21 @@ async def search_by_author(
 @app.get("/search/language/{language}", response_model = SearchResponse, tags=["Search"])
 async def search_by_language(
     language:str,
-    n_results:int = Query(default=5, ge=1, le=50)
+    n_results:int = Query(default=DEFAULT_RESULTS_COUNT, ge=1, le=MAX_API_RESULTS),
+    preview_chars:Optional[int] = Query(default=None, ge=0, le=MAX_PREVIEW_CHARS),
+    tier:str = DEFAULT_QUERY_TIER
 ):
 
+    check_tier(tier)
     try:
         logger.info(f"Language search request: {language}")
-        results = search_engine.search_by_language(language, n_results)
-
-        book_responses = []
-
-        for result in results:
-            book_responses.append(BookResponse(
-                id=result.get('id'),
-                title=result.get('title', 'Unknown Title'),
-                author=result.get('author', 'Unknown Author'),
-                language=result.get('language', 'Unknown Language'),
-                similarity_score=result.get('similarity_score'),
-                document_preview=result.get('document_preview', '')
-            ))
-
-        return SearchResponse(
-            results=book_responses,
-            total_found=len(book_responses),
-            query=f"language:{language}"
-        )
+        resolved = search_engine.resolve_name(language, 'language')
+        answer = await run_in_threadpool(search_engine.run_with_budget, tier, search_engine.search_by_language, resolved, n_results, resolve=False)
+        results = answer.pop('results')
+        if preview_chars is not None:
+            results = search_engine.attach_previews(results, preview_chars)
+
+        return ORJSONResponse(format_search_response(results, f"language:{resolved}", **answer))
 
     except Exception as e:
         logger.error(f"Error in language search: {e}")
@@ -168,38 +291,54 @@ async def advanced_search(
     query:str,
     author:Optional[str] = None,
     language:Optional[str] = None,
-    n_results:int = Query(default=5, ge=1, le=50)
+    n_results:int = Query(default=DEFAULT_RESULTS_COUNT, ge=1, le=MAX_API_RESULTS),
+    diversify:bool = False,
+    mmr_lambda:float = Query(default=MMR_LAMBDA, ge=0, le=1),
+    candidate_pool:int = Query(default=MMR_CANDIDATE_POOL, ge=1, le=MAX_MMR_CANDIDATES),
+    tier:str = DEFAULT_QUERY_TIER,
+    preview_chars:Optional[int] = Query(default=None, ge=0, le=MAX_PREVIEW_CHARS)
 ):
 
+    check_tier(tier)
     try:
         logger.info(f"Advanced search request: {query}")
-        results = search_engine.advanced_search(
-            query=query,
+        answer = await run_in_threadpool(
+            search_engine.search_with_budget,
+            query,
+            n_results,
+            tier,
             author=author,
             language=language,
-            n_results=n_results
+            preview_chars=preview_chars,
+            diversify=diversify,
+            mmr_lambda=mmr_lambda,
+            candidate_pool=candidate_pool
         )
+        results = answer.pop('results')
     
-        book_responses = []
-        for result in results:
-            book_responses.append(BookResponse(
-                id=result.get('id'),
-                title=result.get('title', 'Unknown Title'),
-                author=result.get('author', 'Unknown Author'),
-                language=result.get('language', 'Unknown Language'),
-                similarity_score=result.get('similarity_score'),
-                document_preview=result.get('document_preview', '')
-            ))
-
-        return SearchResponse(
-            results=book_responses,
-            total_found=len(book_responses),
-            query=query
-        )
+        return ORJSONResponse(format_search_response(results, query, **answer))
     except Exception as e:
         logger.error(f"Error in advanced search:{e}")
         raise HTTPException(status_code=500, detail=f"Advanced search error: {str(e)}")
 
+@app.get("/suggest", response_model=SuggestResponse, tags=["Search"])
+async def suggest(
+    q:str = Query(min_length=1),
+    field:Optional[str] = None,
+    limit:int = Query(default=SUGGEST_LIMIT, ge=1, le=MAX_SUGGEST_LIMIT)
+):
+
+    if field is not None and field not in SUGGEST_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Unknown field '{field}', expected one of {SUGGEST_FIELDS}")
+    try:
+        # Served from the in-memory index on the event loop; a lookup takes well under a millisecond
+        suggestions = search_engine.suggest(q, field, limit)
+        return ORJSONResponse({"query": q, "field": field, "suggestions": suggestions})
+
+    except Exception as e:
+        logger.error(f"Error in suggest: {e}")
+        raise HTTPException(status_code=500, detail=f"Suggest error: {str(e)}")
+
 @app.get("/book/{book_id}", response_model=BookResponse, tags=["Books"])
 async def get_book_by_id(book_id:str):
     try:
@@ -209,19 +348,36 @@ async def get_book_by_id(book_id:str):
         if not book_details:
             raise HTTPException(status_code=404, detail="Book not found")
 
-        return BookResponse(
-            id=book_details.get('id'),
-            title=book_details.get('title', 'Unknown Title'),
-            author=book_details.get('author', 'Unknown Author'),
-            language=book_details.get('language', 'Unknown Language'),
-            similarity_score=book_details.get('similarity_score'),
-            document_preview=book_details.get('content', '')
-        )
+        book = format_book(book_details)
+        book["document_preview"] = book_details.get('content', '')
+        return ORJSONResponse(book)
 
     except Exception as e:
         logger.error(f"Error getting book details: {e}")
         raise HTTPException(status_code=500, detail=f"Book details error: {str(e)}")    
 
+@app.get("/book/{book_id}/similar", response_model=SearchResponse, tags=["Books"])
+async def get_similar_books(
+    book_id:str,
+    n_results:int = Query(default=DEFAULT_RESULTS_COUNT, ge=1, le=MAX_API_RESULTS),
+    tier:str = DEFAULT_QUERY_TIER
+):
+
+    check_tier(tier)
+    logger.info(f"Similar books request: {book_id}")
+    answer = await run_in_threadpool(
+        search_engine.run_with_budget,
+        tier,
+        search_engine.similar_books,
+        book_id,
+        n_results,
+        search_ef=QUERY_TIERS[tier]['search_ef']
+    )
+    results = answer.pop('results')
+    if results is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return ORJSONResponse(format_search_response(results, f"similar:{book_id}", **answer))
+
 @app.get("/stats", response_model=CollectionStats, tags=["Statistics"])
 async def get_collection_stats():
 
@@ -238,5 +394,133 @@ async def get_collection_stats():
         logger.error(f"Error getting collection stats:{e}")
         raise HTTPException(status_code=500, detail=f"Collection stats error: {str(e)}")
 
+@app.get("/stats/query-cache", response_model=QueryCacheStats, tags=["Statistics"])
+async def get_query_cache_stats():
+
+    stats = search_engine.semantic_cache.stats()
+    return ORJSONResponse({**stats, "logged_queries": len(search_engine.query_log)})
+
+@app.get("/stats/write-buffer", response_model=WriteBufferStats, tags=["Statistics"])
+async def get_write_buffer_stats():
+
+    return ORJSONResponse(search_engine.write_buffer_stats())
+
+@app.get("/stats/disk-cache", response_model=DiskCacheStats, tags=["Statistics"])
+async def get_disk_cache_stats():
+
+    return ORJSONResponse(await run_in_threadpool(search_engine.disk_cache_stats))
+
+@app.get("/stats/partitions", response_model=PartitionStats, tags=["Statistics"])
+async def get_partition_stats():
+
+    return ORJSONResponse(search_engine.partition_stats())
+
+@app.post("/documents/flush", response_model=FlushResult, tags=["Documents"])
+async def flush_documents():
+
+    return ORJSONResponse(await run_in_threadpool(search_engine.flush_writes))
+
+@app.post("/documents/bulk", response_model=JobStatus, status_code=202, tags=["Documents"])
+async def bulk_upsert_documents(request:BulkUpsertRequest, background_tasks:BackgroundTasks):
+
+    books = [document.model_dump() for document in request.documents]
+    job = job_registry.create("bulk_upsert", total=len(books))
+    background_tasks.add_task(run_tracked, job_registry, job["id"], search_engine.upsert_books, books)
+    return ORJSONResponse(job, status_code=202)
+
+@app.delete("/documents/bulk", response_model=JobStatus, status_code=202, tags=["Documents"])
+async def bulk_delete_documents(request:BulkDeleteRequest, background_tasks:BackgroundTasks):
+
+    job = job_registry.create("bulk_delete", total=len(request.ids))
+    background_tasks.add_task(run_tracked, job_registry, job["id"], search_engine.delete_books, request.ids)
+    return ORJSONResponse(job, status_code=202)
+
+@app.get("/documents/bulk/{job_id}", response_model=JobStatus, tags=["Documents"])
+async def get_bulk_job(job_id:str):
+
+    job = job_registry.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ORJSONResponse(job)
+
+@app.get("/documents/export", tags=["Documents"])
+async def export_documents(
+    include_documents:bool = True,
+    include_embeddings:bool = False,
+    batch_size:int = Query(default=STREAM_BATCH_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+
+    logger.info(f"Exporting documents in batches of {batch_size}")
+
+    def generate_lines():
+        # One page of batch_size rows is in memory at a time; the first line goes out after the first page
+        for record in search_engine.iter_documents(batch_size, include_documents, include_embeddings):
+            yield orjson.dumps(record, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n"
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson")
+
+# Registered after the fixed /documents/... paths, which would otherwise match as a doc_id
+@app.put("/documents/{doc_id}", response_model=BookResponse, tags=["Documents"])
+async def update_document(doc_id:str, request:DocumentUpdate):
+
+    logger.info(f"Updating document: {doc_id}")
+    # Embedding the text is CPU-bound, so it stays off the event loop
+    if not await run_in_threadpool(search_engine.update_book, {"id": doc_id, **request.model_dump()}):
+        raise HTTPException(status_code=404, detail="Book not found")
+    book_details = await run_in_threadpool(search_engine.get_book_by_id, doc_id)
+    if not book_details:
+        raise HTTPException(status_code=404, detail="Book not found")
+    book = format_book(book_details)
+    book["document_preview"] = book_details.get('content', '')
+    return ORJSONResponse(book)
+
+@app.delete("/documents/{doc_id}", status_code=204, tags=["Documents"])
+async def delete_document(doc_id:str):
+
+    logger.info(f"Deleting document: {doc_id}")
+    if not await run_in_threadpool(search_engine.delete_book, doc_id):
+        raise HTTPException(status_code=500, detail="Delete failed")
+
+@app.get("/collections/active", response_model=ActiveCollection, tags=["Collections"])
+async def get_active_collection():
+
+    return ORJSONResponse(search_engine.get_active_collection())
+
+@app.post("/collections/migrate", response_model=JobStatus, status_code=202, tags=["Collections"])
+async def migrate_collection(request:MigrationRequest, background_tasks:BackgroundTasks):
+
+    if request.model_key not in EMBEDDING_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unknown embedding model: {request.model_key}")
+    job = job_registry.create("model_migration", total=search_engine.vector_store.get_document_count(), params={"model_key": request.model_key})
+    background_tasks.add_task(run_tracked, job_registry, job["id"], search_engine.migrate_embedding_model, request.model_key)
+    return ORJSONResponse(job, status_code=202)
+
+@app.post("/jobs", response_model=JobStatus, status_code=202, tags=["Jobs"])
+async def submit_job(request:JobRequest):
+
+    job = job_scheduler.submit(request.type, JOB_TYPES[request.type], search_engine, params={"type": request.type})
+    return ORJSONResponse(job, status_code=202)
+
+@app.get("/jobs", response_model=List[JobStatus], tags=["Jobs"])
+async def list_jobs():
+
+    return ORJSONResponse(job_registry.list())
+
+@app.get("/jobs/{job_id}", response_model=JobStatus, tags=["Jobs"])
+async def get_job(job_id:str):
+
+    job = job_registry.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ORJSONResponse(job)
+
+@app.delete("/jobs/{job_id}", response_model=JobStatus, tags=["Jobs"])
+async def cancel_job(job_id:str):
+
+    job = job_scheduler.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ORJSONResponse(job)
+
 if __name__ == "__main__":
-    uvicorn.run(app,host="0.0.0.0", port=8000)
+    uvicorn.run(app,host=SERVING_HOST, port=SERVING_PORT)
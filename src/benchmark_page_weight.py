@@ -0,0 +1,55 @@
+import argparse
+import logging
+import time
+import numpy as np
+import requests
+from typing import Optional
+from config import API_BASE_URL, UI_PREVIEW_CHARS, UI_PAGE_SIZE
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+QUERIES = ["adventure at sea", "a love story", "ghosts in an old house", "war and soldiers", "a detective solves a murder", "life on a farm", "journey to the mountains", "a child lost in the city"]
+
+def measure(session:requests.Session, base_url:str, n_results:int, preview_chars:Optional[int] = None):
+    """Bytes on the wire and time to a parsed response for every benchmark query"""
+    sizes, latencies = [], []
+    for query in QUERIES:
+        payload = {"query": query, "n_results": n_results}
+        if preview_chars is not None:
+            payload["preview_chars"] = preview_chars
+        started = time.perf_counter()
+        response = session.post(f"{base_url}/search", json=payload, timeout=60)
+        response.raise_for_status()
+        response.json()
+        latencies.append(time.perf_counter() - started)
+        sizes.append(len(response.content))
+    return np.mean(sizes) / 1024, np.percentile(latencies, 50) * 1000
+
+def lazy_page_kb(session:requests.Session, base_url:str, n_results:int, opened:int) -> float:
+    """Preview search plus the /book fetches of the cards a reader actually opens"""
+    response = session.post(f"{base_url}/search", json={"query": QUERIES[0], "n_results": n_results, "preview_chars": UI_PREVIEW_CHARS}, timeout=60)
+    response.raise_for_status()
+    total = len(response.content)
+    for book in response.json()['results'][:opened]:
+        total += len(session.get(f"{base_url}/book/{book['id']}", timeout=60).content)
+    return total / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Search response weight with full texts vs. previews, as the Streamlit UI requests them")
+    parser.add_argument("--base-url", default=API_BASE_URL)
+    parser.add_argument("--n-results", default="5,10,20")
+    parser.add_argument("--opened", type=int, default=1, help="cards opened per search in the lazy estimate")
+    args = parser.parse_args()
+
+    session = requests.Session()
+    measure(session, args.base_url, 5, UI_PREVIEW_CHARS)  # warm-up
+    print(f"{'n_results':>9} {'full_kb':>9} {'full_ms':>8} {'preview_kb':>10} {'preview_ms':>10} {'lazy_kb':>8} {'cards':>6}")
+    for n_results in [int(n) for n in args.n_results.split(",")]:
+        full_kb, full_ms = measure(session, args.base_url, n_results)
+        preview_kb, preview_ms = measure(session, args.base_url, n_results, UI_PREVIEW_CHARS)
+        lazy_kb = lazy_page_kb(session, args.base_url, n_results, args.opened)
+        print(f"{n_results:>9} {full_kb:>9.1f} {full_ms:>8.1f} {preview_kb:>10.1f} {preview_ms:>10.1f} {lazy_kb:>8.1f} {min(n_results, UI_PAGE_SIZE):>6}")
+
+if __name__ == "__main__":
+    main()
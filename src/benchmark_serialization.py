@@ -0,0 +1,60 @@
+import json
+import time
+import logging
+import orjson
+from fastapi.encoders import jsonable_encoder
+from schemas import BookResponse, SearchResponse, format_search_response
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+def make_results(n_results:int, preview_chars:int):
+    """Synthetic SearchEngine output shaped like real hits"""
+    preview = ("It was a dark and stormy night; the rain fell in torrents. " * (preview_chars // 60 + 1))[:preview_chars]
+    return [{
+        'id': f"doc_{i}",
+        'title': f"Story number {i}",
+        'author': "Mark Twain",
+        'bookno': str(1000 + i),
+        'language': "English",
+        'similarity_score': 0.1234 + i / 1000,
+        'document_preview': preview
+    } for i in range(n_results)]
+
+def pydantic_path(results, query):
+    """Previous path: one BookResponse per hit, then FastAPI's default JSON encoding"""
+    book_responses = []
+    for result in results:
+        book_responses.append(BookResponse(
+            id=result.get('id'),
+            title=result.get('title', 'Unknown Title'),
+            author=result.get('author', 'Unknown Author'),
+            language=result.get('language', 'Unknown Language'),
+            similarity_score=result.get('similarity_score'),
+            document_preview=result.get('document_preview', '')
+        ))
+    response = SearchResponse(results=book_responses, total_found=len(book_responses), query=query)
+    return json.dumps(jsonable_encoder(response)).encode()
+
+def orjson_path(results, query):
+    return orjson.dumps(format_search_response(results, query))
+
+def time_path(fn, results, repeats:int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(results, "adventure")
+    return (time.perf_counter() - start) / repeats * 1000
+
+def main():
+    logger.info("Serialization benchmark (ms per response)")
+    print(f"{'n_results':>9} {'preview':>8} {'pydantic':>10} {'orjson':>10} {'speedup':>8}")
+    for n_results in (5, 20, 50, 100):
+        for preview_chars in (200, 5000, 50000):
+            results = make_results(n_results, preview_chars)
+            repeats = max(5, 2000 // n_results)
+            slow = time_path(pydantic_path, results, repeats)
+            fast = time_path(orjson_path, results, repeats)
+            print(f"{n_results:>9} {preview_chars:>8} {slow:>10.3f} {fast:>10.3f} {slow / fast:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import itertools
+import logging
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+QUERIES = ["adventure at sea", "a love story", "ghosts in an old house", "war and soldiers", "a detective solves a murder", "life on a farm", "journey to the mountains", "a child lost in the city"]
+
+def wait_until_ready(base_url:str, timeout:float = 300) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base_url}/stats", timeout=2).ok:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(1)
+    raise RuntimeError(f"Server at {base_url} did not become ready")
+
+def drive_load(base_url:str, concurrency:int, duration:float, n_results:int):
+    """Closed-loop load: each client sends its next query as soon as the previous one returns"""
+    stop_at = time.monotonic() + duration
+    queries = itertools.cycle(QUERIES)
+
+    def client():
+        session = requests.Session()
+        latencies = []
+        while time.monotonic() < stop_at:
+            started = time.perf_counter()
+            session.post(f"{base_url}/search", json={"query": next(queries), "n_results": n_results}, timeout=30).raise_for_status()
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(itertools.chain.from_iterable(executor.map(lambda _: client(), range(concurrency))))
+    return len(latencies) / duration, np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="QPS of the API as the number of gunicorn workers grows")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--n-results", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    print(f"{'workers':>7} {'qps':>8} {'p50_ms':>8} {'p99_ms':>8}")
+    for workers in [int(n) for n in args.workers.split(",")]:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-w", str(workers), "-b", f"127.0.0.1:{args.port}", "app:app"],
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        try:
+            wait_until_ready(base_url)
+            drive_load(base_url, args.concurrency, 5, args.n_results)  # warm-up
+            qps, p50, p99 = drive_load(base_url, args.concurrency, args.duration, args.n_results)
+            print(f"{workers:>7} {qps:>8.1f} {p50:>8.1f} {p99:>8.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,85 @@
 CSV_PATH1 = '/home/user/my_env/VectorStore/Vector-Store/Data/db_books.csv'
 CSV_PATH2 = '/home/user/my_env/VectorStore/Vector-Store/Data/stories.csv'
 
+#Near-Duplicate Detection (MinHash LSH over word shingles)
+DEDUP_ENABLED = True
+DEDUP_THRESHOLD = 0.8       # estimated Jaccard similarity at which two books are one text
+DEDUP_NUM_PERM = 128
+DEDUP_SHINGLE_SIZE = 5      # words per shingle
+DEDUP_WORKERS = 4
+DEDUP_CHUNK_SIZE = 100      # books per worker task
+DEDUP_REPORT_PATH = '/home/user/my_env/VectorStore/Vector-Store/Data/dedup_report.json'
+
 #ChromaDB
 Chroma_db_path = '/home/user/my_env/VectorStore/Vector-Store/Data/chroma_db'
 Chroma_collection_name = 'books_story'
 Chroma_embedding_path = '/home/user/my_env/VectorStore/Vector-Store/Data/embeddings.npy'
+# HNSW parameters applied when a collection is created (M and construction_ef are fixed afterwards)
+HNSW_M = 16
+HNSW_CONSTRUCTION_EF = 200
+HNSW_SEARCH_EF = 32         # collection default, used by the 'fast' tier
+
+#Document Store (full texts live in compressed blocks next to the vector index, not in Chroma)
+DOCUMENT_STORE_ENABLED = True
+DOCUMENT_STORE_DIRNAME = 'documents'    # created inside each db_path
+DOCUMENT_BLOCK_CHARS = 65536            # characters per independently compressed block
+DOCUMENT_COMPRESSION_LEVEL = 6
+DOCUMENT_COMPACT_RATIO = 0.5            # rewrite the data file once this share of it is dead blocks
+DOCUMENT_DELTA_MAX_KEYS = 5000          # writes are appended to a delta log; fold it into the tables past this many keys
+
+#Embedding Models (collections record the key they were built with)
+EMBEDDING_MODELS = {
+    'minilm-l6-v2': {'model_name': 'all-MiniLM-L6-v2', 'dimension': 384, 'normalize': True},
+    'mpnet-base-v2': {'model_name': 'all-mpnet-base-v2', 'dimension': 768, 'normalize': True},
+    'multilingual-minilm-l12-v2': {'model_name': 'paraphrase-multilingual-MiniLM-L12-v2', 'dimension': 384, 'normalize': True},
+}
+ACTIVE_EMBEDDING_MODEL = 'minilm-l6-v2'
+LEGACY_EMBEDDING_MODEL = 'minilm-l6-v2'  # assumed for collections created before the registry
+EMBEDDING_BATCH_SIZE = 64
+MIGRATION_BATCH_SIZE = 256
+MIGRATION_ACK_TIMEOUT = 60.0  # seconds every serving worker gets to start mirroring writes into a new collection
+ACTIVE_POINTER_CHECK_INTERVAL = 1.0  # seconds between checks for a switched active collection
+
+#Encoder Backend ('torch' runs SentenceTransformer, 'onnx' runs an exported model on ONNX Runtime)
+ENCODER_BACKEND = 'torch'
+ONNX_MODEL_DIR = './onnx_models'
+ONNX_QUANTIZE = True
+ONNX_INTRA_OP_THREADS = 4
+
+#k-NN Graph
+KNN_GRAPH_DIR = '/home/user/my_env/VectorStore/Vector-Store/Data/knn_graph'
+KNN_K = 20
+KNN_BLOCK_SIZE = 2048
+KNN_WORKERS = 4
+
+#Sharding (None keeps the single 'books_story' collection)
+SHARD_STRATEGY = None  # 'language', 'hash' (of bookno) or 'date' (ingestion month)
+SHARD_COUNT = 4
+SHARD_QUERY_WORKERS = 8
+SHARD_BUILD_WORKERS = 4
+
+#Language Routing (SHARD_STRATEGY = 'language': one collection and model per language)
+LANGUAGE_MODELS = {
+    'english': 'minilm-l6-v2',
+}
+DEFAULT_LANGUAGE_MODEL = 'multilingual-minilm-l12-v2'  # every language not listed above
+LANGUAGE_DETECT_MIN_SCORE = 0.2  # share of query words that must be function words of the detected language
+LANGUAGE_DETECT_MIN_WORDS = 2  # function words of the detected language needed to search only its shard
+LANGUAGE_DETECT_MARGIN = 2.0  # the detected language must score this many times the runner-up
+ROUTE_FALLBACK_LANGUAGES = 2  # likeliest languages searched, with the largest shard, when detection is unsure
+
+#Serving
+SEARCH_BACKEND = 'chroma'  # 'shared_index' answers unfiltered queries from the memory-mapped matrix in SHARED_INDEX_DIR
+SHARED_INDEX_DIR = './shared_index'
+SERVING_HOST = '0.0.0.0'
+SERVING_PORT = 8000
+SERVING_WORKERS = 4
+SHARED_STATE_PATH = './cache/shared_state.sqlite'  # page cursors and job status every worker reads
+SHARED_STATE_BUSY_TIMEOUT = 5.0  # seconds to wait for another worker's write to the shared state
+
+#Snapshots
+SNAPSHOT_DIR = './snapshots'
+SNAPSHOT_BATCH_SIZE = 1000
 
 #Streamlit Ui
 Streamlit_page_title = "Vector Store Book Search"
@@ -17,14 +92,107 @@ Streamlit_initial_sidebar_state = "expanded"
 DEFAULT_RESULTS_COUNT = 5
 MAX_RESULTS_COUNT = 20
 MIN_RESULTS_COUNT = 1
+MAX_PREVIEW_CHARS = 5000  # upper bound of preview_chars on search endpoints; omit it for full texts
+
+#Query Latency Tiers (search_ef None keeps the collection default; hnswlib searches with max(ef, k))
+QUERY_TIERS = {
+    'fast': {'search_ef': None, 'deadline_ms': 150, 'semantic_cache': True},
+    'standard': {'search_ef': 100, 'deadline_ms': 400, 'semantic_cache': True},
+    'exhaustive': {'search_ef': 400, 'deadline_ms': 2000, 'semantic_cache': False},
+}
+DEFAULT_QUERY_TIER = 'standard'
+PRIMARY_BUDGET_SHARE = 0.7  # rest of the budget is kept for the metadata-only fallback
+QUERY_WORKERS = 16
+
+#Semantic Query Cache (answers paraphrases of popular queries from precomputed cluster results)
+SEMANTIC_CACHE_ENABLED = True
+SEMANTIC_CACHE_THRESHOLD = 0.9  # cosine to a cluster centroid; higher is closer to exact results, lower hits more often
+SEMANTIC_CACHE_CLUSTERS = 256
+SEMANTIC_CACHE_TOP_K = 50  # candidates kept per cluster and re-ranked against each query
+SEMANTIC_CACHE_MIN_CLUSTER_SIZE = 3
+SEMANTIC_CACHE_MIN_QUERIES = 100
+SEMANTIC_CACHE_LOG_SIZE = 10000
+KMEANS_BATCH_SIZE = 256
+KMEANS_ITERATIONS = 100
+
+#Diversity (MMR)
+MMR_LAMBDA = 0.5  # 1.0 = pure relevance, 0.0 = pure diversity
+MMR_CANDIDATE_POOL = 25
+MAX_MMR_CANDIDATES = 200
+
+#Autocomplete
+SUGGEST_FIELDS = ['title', 'author', 'language']
+SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 25
+SUGGEST_MIN_SIMILARITY = 0.7  # 1 - edit distance / length, for typo matches
+SUGGEST_RESOLVE_MIN_SIMILARITY = 0.85  # stricter bar for rewriting a typo'd search filter to a stored name
+SUGGEST_FUZZY_CANDIDATES = 50
+SUGGEST_PRECOMPUTED_PREFIX = 3  # prefixes up to this length keep a ready top list
+SUGGEST_REFRESH_INTERVAL = 300  # seconds before the index is rebuilt in the background
+
+#Pagination & Streaming
+MAX_API_RESULTS = 50
+MAX_PAGE_SIZE = 100
+MAX_SNAPSHOT_RESULTS = 1000
+SNAPSHOT_TTL = 600
+SNAPSHOT_CACHE_SIZE = 256
+STREAM_BATCH_SIZE = 50
+
+#Bulk Writes
+BULK_BATCH_SIZE = 500
+MAX_BULK_DOCUMENTS = 50000
+MAX_TRACKED_JOBS = 1000
+
+#Disk Cache (query embeddings and search answers in one sqlite file shared by the workers of a host)
+DISK_CACHE_ENABLED = True
+DISK_CACHE_PATH = './cache/query_cache.sqlite'
+DISK_CACHE_MAX_BYTES = 256 * 1024 * 1024  # values beyond this are evicted least recently used first
+DISK_CACHE_EVICT_EVERY = 100  # writes between eviction checks
+DISK_CACHE_TOUCH_INTERVAL = 60  # seconds before a hit refreshes an entry's access time
+DISK_CACHE_VERSION_TTL = 1.0  # seconds a worker trusts its copy of a collection's write version
+DISK_CACHE_BUSY_TIMEOUT = 0.5  # seconds to wait for another worker's write before skipping the cache
+
+#Write Buffer (single-document writes land in an in-memory delta searched next to Chroma)
+WRITE_BUFFER_ENABLED = True
+WRITE_BUFFER_DIRNAME = 'wal'  # write-ahead log segments under <db_path>/wal/<collection>
+WRITE_BUFFER_FLUSH_INTERVAL = 5.0  # seconds between background merges into Chroma
+WRITE_BUFFER_MAX_SIZE = 1000  # buffered writes that trigger an early merge
+WRITE_BUFFER_OVERFETCH = 50  # extra main-index rows fetched to replace rows the buffer shadows
+
+#Filter Partitions (filtered queries are planned from value counts gathered at ingestion)
+PARTITIONS_ENABLED = True
+PARTITION_FIELDS = ['language', 'author']  # metadata fields counted and eligible for sub-indexes
+PARTITION_DIRNAME = 'partitions'  # manifests under <db_path>/partitions/<collection>.json
+PARTITION_MIN_SIZE = 2000  # smaller values are scored exactly instead; keep it >= EXACT_MAX_CANDIDATES
+PARTITION_MAX_SHARE = 0.3  # values covering more of the collection stay in the global index
+# Together these leave collections under PARTITION_MIN_SIZE / PARTITION_MAX_SHARE rows (~6,700) without partitions
+EXACT_MAX_CANDIDATES = 2000  # filters estimated to keep at most this many rows are brute-forced
+PARTITION_RECOUNT_INTERVAL = 60.0  # seconds between recounts of filter values after writes by any worker
+
+#Background Jobs (ingestion and reindex run in-process next to live queries)
+JOB_WORKERS = 1
+JOB_RATE_LIMIT = 200        # documents per second across all jobs, 0 disables throttling
+JOB_CANCEL_POLL_INTERVAL = 1.0  # seconds between checks for a cancel requested through another worker
+JOB_BATCH_SIZE = 64         # small batches keep each encoder call short so queries interleave
+
+#Offline Evaluation
+EVAL_DATASET_PATH = 'eval/queries.jsonl'
+EVAL_QUERY_KINDS = ['title', 'opening', 'author_topic']
+EVAL_QUERIES_PER_KIND = 200
+EVAL_OPENING_CHARS = 3000  # read from the start of each text to find an opening sentence and topic words
+EVAL_K_VALUES = [1, 5, 10]
+EVAL_WORKERS = 4
 
 #UI Layout Settings
+UI_PAGE_SIZE = 5  # result cards rendered per page; the rest stay in session state
+UI_PREVIEW_CHARS = 300  # searches ask for this much text per card, full texts load when a card is opened
 Card_columns_ratio = [1,3]
 Book_display_columns = ['title', 'author', 'language', 'similarity_score', 'document_preview']
 Display_settings = {
     "show_similarity_score": True,
     "show_preview_expander": True,
     "show_collection_stats": True,
+    "show_render_stats": True,
     "sidebar_width": 300,
     "main_content_padding": 20,
     "card_columns_ratio": [1,3],
@@ -42,6 +210,11 @@ Display_settings = {
 #API Configuration 
 API_BASE_URL= "http://localhost:8000"
 API_TIMEOUT = 30
+API_CONNECT_TIMEOUT = 5
+API_MAX_RETRIES = 3
+API_RETRY_BACKOFF = 0.5
+API_POOL_SIZE = 10
+API_CACHE_TTL = 300
 
 #Data Processing Settings 
 CHUNK_SIZE = 1000
@@ -1,6 +1,21 @@
+import json
 import logging
+import time
+import zlib
+import numpy as np
 import pandas as pd
-from config import CSV_PATH1, CSV_PATH2
+from concurrent.futures import ProcessPoolExecutor
+from config import (
+    CSV_PATH1,
+    CSV_PATH2,
+    DEDUP_ENABLED,
+    DEDUP_THRESHOLD,
+    DEDUP_NUM_PERM,
+    DEDUP_SHINGLE_SIZE,
+    DEDUP_WORKERS,
+    DEDUP_CHUNK_SIZE,
+    DEDUP_REPORT_PATH
+)
 import re
 import psutil
 
@@ -124,6 +139,141 @@ def merge_cleaned_data(cleaned_df, cleaned_stories):
         logging.error(f"Error merging cleaned data: {e}")
         return None
 
+HASH_PRIME = np.uint64(4294967291)  # largest prime below 2**32
+SHINGLE_BASE = np.uint64(1000003)
+SIGNATURE_BLOCK = 8192
+
+def minhash_permutations(num_perm, seed=1):
+    """Coefficients of the universal hashes (a*x + b) mod p standing in for random permutations"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**31, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 2**31, size=num_perm, dtype=np.uint64)
+    return a, b
+
+def shingle_hashes(text, shingle_size):
+    """Distinct hashes of the overlapping word n-grams of a text"""
+    words = text.lower().split()
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    tokens = np.fromiter((zlib.crc32(word.encode()) for word in words), dtype=np.uint64, count=len(words))
+    size = min(shingle_size, len(tokens))
+    hashes = np.zeros(len(tokens) - size + 1, dtype=np.uint64)
+    for j in range(size):
+        hashes = (hashes * SHINGLE_BASE + tokens[j:j + len(hashes)]) % HASH_PRIME
+    return np.unique(hashes)
+
+def minhash_signature(text, num_perm=DEDUP_NUM_PERM, shingle_size=DEDUP_SHINGLE_SIZE):
+    a, b = minhash_permutations(num_perm)
+    hashes = shingle_hashes(text, shingle_size)
+    signature = np.full(num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+    # Blocks keep the shingles x permutations matrix small for book-length texts
+    for start in range(0, len(hashes), SIGNATURE_BLOCK):
+        block = hashes[start:start + SIGNATURE_BLOCK, None]
+        signature = np.minimum(signature, ((block * a + b) % HASH_PRIME).min(axis=0))
+    return signature
+
+def minhash_chunk(task):
+    """Signatures for one chunk of texts; runs in a worker process"""
+    texts, num_perm, shingle_size = task
+    return np.stack([minhash_signature(text, num_perm, shingle_size) for text in texts])
+
+def compute_signatures(texts, num_perm=DEDUP_NUM_PERM, shingle_size=DEDUP_SHINGLE_SIZE, workers=DEDUP_WORKERS, chunk_size=DEDUP_CHUNK_SIZE):
+    if not texts:
+        return np.zeros((0, num_perm), dtype=np.uint64)
+    tasks = [(texts[start:start + chunk_size], num_perm, shingle_size) for start in range(0, len(texts), chunk_size)]
+    if workers <= 1 or len(tasks) == 1:
+        return np.concatenate([minhash_chunk(task) for task in tasks])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return np.concatenate(list(executor.map(minhash_chunk, tasks)))
+
+def lsh_bands(threshold, num_perm):
+    """Bands x rows whose S-curve midpoint (1/b)^(1/r) is the highest one not above the threshold.
+
+    Erring low trades extra candidate pairs, which are verified anyway, for fewer missed duplicates.
+    """
+    options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    below = [option for option in options if (1 / option[0]) ** (1 / option[1]) <= threshold]
+    return max(below, key=lambda option: (1 / option[0]) ** (1 / option[1])) if below else (num_perm, 1)
+
+def find_near_duplicates(signatures, threshold=DEDUP_THRESHOLD):
+    """Group rows whose estimated Jaccard similarity reaches the threshold; returns clusters of row positions"""
+    bands, rows = lsh_bands(threshold, signatures.shape[1])
+    parent = list(range(len(signatures)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    checked = set()
+    for band in range(bands):
+        buckets = {}
+        for i, signature in enumerate(signatures):
+            buckets.setdefault(signature[band * rows:(band + 1) * rows].tobytes(), []).append(i)
+        for members in buckets.values():
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    pair = (members[x], members[y])
+                    if pair in checked:
+                        continue
+                    checked.add(pair)
+                    if np.mean(signatures[pair[0]] == signatures[pair[1]]) >= threshold:
+                        parent[find(pair[1])] = find(pair[0])
+
+    clusters = {}
+    for i in range(len(signatures)):
+        clusters.setdefault(find(i), []).append(i)
+    logging.info(f"LSH with {bands} bands x {rows} rows verified {len(checked)} candidate pairs")
+    return [members for members in clusters.values() if len(members) > 1]
+
+def remove_near_duplicates(df, threshold=DEDUP_THRESHOLD, num_perm=DEDUP_NUM_PERM, shingle_size=DEDUP_SHINGLE_SIZE, workers=DEDUP_WORKERS, report_path=DEDUP_REPORT_PATH):
+    """Collapse near-identical editions to the longest copy and write a report of every cluster"""
+    logging.info(f"Detecting near duplicates among {len(df)} rows (threshold {threshold})")
+    started = time.perf_counter()
+
+    df = df.reset_index(drop=True)
+    texts = df['content'].fillna('').astype(str).tolist()
+    # Empty texts all share the same signature and must not be clustered together
+    candidates = [i for i, text in enumerate(texts) if text.strip()]
+    signatures = compute_signatures([texts[i] for i in candidates], num_perm, shingle_size, workers)
+
+    report = []
+    dropped = []
+    for members in find_near_duplicates(signatures, threshold):
+        keep = max(members, key=lambda member: len(texts[candidates[member]]))
+        kept_row = df.iloc[candidates[keep]]
+        entry = {
+            "kept": {"bookno": str(kept_row.get('bookno')), "title": str(kept_row.get('Title'))},
+            "dropped": []
+        }
+        for member in members:
+            if member == keep:
+                continue
+            row = df.iloc[candidates[member]]
+            entry["dropped"].append({
+                "bookno": str(row.get('bookno')),
+                "title": str(row.get('Title')),
+                "similarity": round(float(np.mean(signatures[member] == signatures[keep])), 3)
+            })
+            dropped.append(candidates[member])
+        report.append(entry)
+
+    deduplicated = df.drop(index=dropped).reset_index(drop=True)
+    summary = {
+        "threshold": threshold,
+        "num_perm": num_perm,
+        "shingle_size": shingle_size,
+        "rows_in": len(df),
+        "rows_out": len(deduplicated),
+        "clusters": report
+    }
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+    logging.info(f"Collapsed {len(report)} near-duplicate clusters, dropped {len(dropped)} rows in {time.perf_counter() - started:.1f}s")
+    return deduplicated
+
 def clean_data(df):
     """Clean the dataframe efficiently"""
     logging.info("Starting data cleaning process")
@@ -138,6 +288,10 @@ def clean_data(df):
         # Step 3: Merge cleaned data
         final_df = merge_cleaned_data(cleaned_df, cleaned_stories)
         
+        # Step 4: Collapse near-identical editions so each text is embedded once
+        if DEDUP_ENABLED:
+            final_df = remove_near_duplicates(final_df)
+        
         logging.info("Data cleaning completed successfully")
         return final_df
     
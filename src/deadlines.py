@@ -0,0 +1,48 @@
+import time
+from typing import List, Optional
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's time budget runs out before a step could start"""
+
+class Deadline:
+    """Per-request time budget passed from the API down to the stores.
+
+    Stores check it before each expensive step and record why a result was degraded,
+    so the endpoint can flag partial answers instead of silently returning less.
+    """
+
+    def __init__(self, budget_seconds:float):
+        self.budget = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds
+        self.reasons:List[str] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self, step:str) -> None:
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline of {self.budget * 1000:.0f}ms exceeded before {step}")
+
+    def reserve(self, seconds:float) -> 'Deadline':
+        """A budget of its own for one step, capped by this one; its degrade reasons are reported here"""
+        step = Deadline(min(seconds, self.remaining()))
+        step.reasons = self.reasons
+        return step
+
+    def cancel(self) -> None:
+        """Expire now, so work still running stops at its next check instead of finishing unseen"""
+        self.expires_at = min(self.expires_at, time.monotonic())
+
+    def degrade(self, reason:str) -> None:
+        self.reasons.append(reason)
+
+    @property
+    def degraded(self) -> bool:
+        return bool(self.reasons)
+
+def check_deadline(deadline:Optional[Deadline], step:str) -> None:
+    if deadline is not None:
+        deadline.check(step)
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Any
+from shared_state import SqliteConnections
+from config import (
+    DISK_CACHE_PATH,
+    DISK_CACHE_MAX_BYTES,
+    DISK_CACHE_EVICT_EVERY,
+    DISK_CACHE_TOUCH_INTERVAL,
+    DISK_CACHE_VERSION_TTL,
+    DISK_CACHE_BUSY_TIMEOUT
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS versions (
+    collection TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+def normalize_query(query:str) -> str:
+    # Only whitespace: case and punctuation can change what a cased model embeds
+    return ' '.join(query.split())
+
+def cache_key(kind:str, *parts:Any) -> str:
+    """Stable key of a kind plus JSON-serializable parts, e.g. a model key and a normalized query"""
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{kind}:{digest}"
+
+class DiskCache:
+    """Size-bounded LRU cache in one sqlite file, shared by every worker process on the host.
+
+    WAL mode lets readers run next to a writer, and each thread of each process opens its own
+    connection. Access times are refreshed at most every DISK_CACHE_TOUCH_INTERVAL seconds so
+    hits stay reads; eviction drops the least recently used entries once the values exceed
+    max_bytes. Collection versions live in the same file, so a write in one worker retires
+    the cached results of every worker. Any sqlite error is logged and treated as a miss.
+    """
+
+    def __init__(self, path:str = DISK_CACHE_PATH, max_bytes:int = DISK_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.counters = {"hits": 0, "misses": 0, "writes": 0, "evicted": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._versions:Dict[str, tuple] = {}
+        self._connection = SqliteConnections(path, SCHEMA, timeout=DISK_CACHE_BUSY_TIMEOUT)
+
+    def _count(self, counter:str, amount:int = 1) -> None:
+        with self._lock:
+            self.counters[counter] += amount
+
+    def get(self, key:str) -> Optional[bytes]:
+
+        try:
+            connection = self._connection()
+            row = connection.execute("SELECT value, accessed FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            now = time.time()
+            if now - row[1] > DISK_CACHE_TOUCH_INTERVAL:
+                connection.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self._count("hits")
+            return row[0]
+        except sqlite3.Error as e:
+            logger.error(f"Error reading disk cache: {e}")
+            self._count("errors")
+            return None
+
+    def set(self, key:str, value:bytes) -> None:
+
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO entries (key, kind, value, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, key.split(':', 1)[0], value, len(value), time.time())
+            )
+            self._count("writes")
+            if self.counters["writes"] % DISK_CACHE_EVICT_EVERY == 0:
+                self.evict()
+        except sqlite3.Error as e:
+            logger.error(f"Error writing disk cache: {e}")
+            self._count("errors")
+
+    def evict(self) -> int:
+        """Drop least recently used entries until the values fit in 90% of max_bytes"""
+        try:
+            connection = self._connection()
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            excess = total - int(self.max_bytes * 0.9)
+            if total <= self.max_bytes or excess <= 0:
+                return 0
+            victims, freed = [], 0
+            for key, size in connection.execute("SELECT key, size FROM entries ORDER BY accessed"):
+                victims.append((key,))
+                freed += size
+                if freed >= excess:
+                    break
+            with self._connection.transaction() as transaction:
+                transaction.executemany("DELETE FROM entries WHERE key = ?", victims)
+            self._count("evicted", len(victims))
+            logger.info(f"Evicted {len(victims)} disk cache entries ({freed / 1e6:.1f} MB)")
+            return len(victims)
+        except sqlite3.Error as e:
+            logger.error(f"Error evicting disk cache entries: {e}")
+            self._count("errors")
+            return 0
+
+    def version(self, collection_name:str) -> int:
+        """Write version of a collection, re-read from disk at most every DISK_CACHE_VERSION_TTL seconds"""
+        now = time.monotonic()
+        cached = self._versions.get(collection_name)
+        if cached is not None and now - cached[1] < DISK_CACHE_VERSION_TTL:
+            return cached[0]
+        try:
+            row = self._connection().execute("SELECT version FROM versions WHERE collection = ?", (collection_name,)).fetchone()
+            version = row[0] if row else 0
+        except sqlite3.Error as e:
+            logger.error(f"Error reading collection version: {e}")
+            self._count("errors")
+            # Unknown version: a fresh one so nothing cached is trusted
+            version = -int(now * 1000)
+        self._versions[collection_name] = (version, now)
+        return version
+
+    def bump(self, collection_name:str) -> None:
+        """Retire every cached result of a collection in all workers after a write"""
+        try:
+            self._connection().execute(
+                "INSERT INTO versions (collection, version) VALUES (?, 1) "
+                "ON CONFLICT (collection) DO UPDATE SET version = version + 1",
+                (collection_name,)
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Error bumping collection version: {e}")
+            self._count("errors")
+        self._versions.pop(collection_name, None)
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM entries")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["hits"] + counters["misses"]
+        try:
+            kinds = {
+                kind: {"entries": entries, "bytes": size}
+                for kind, entries, size in self._connection().execute("SELECT kind, COUNT(*), SUM(size) FROM entries GROUP BY kind")
+            }
+        except sqlite3.Error as e:
+            logger.error(f"Error reading disk cache stats: {e}")
+            kinds = {}
+        return {
+            "path": self.path,
+            "max_bytes": self.max_bytes,
+            "entries": sum(kind["entries"] for kind in kinds.values()),
+            "bytes": sum(kind["bytes"] for kind in kinds.values()),
+            "kinds": kinds,
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+            **counters
+        }
@@ -0,0 +1,530 @@
+import argparse
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+import numpy as np
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Any, Iterator, Tuple
+from config import (
+    DOCUMENT_STORE_DIRNAME,
+    DOCUMENT_BLOCK_CHARS,
+    DOCUMENT_COMPRESSION_LEVEL,
+    DOCUMENT_COMPACT_RATIO,
+    DOCUMENT_DELTA_MAX_KEYS,
+    ACTIVE_POINTER_CHECK_INTERVAL,
+    SNAPSHOT_BATCH_SIZE
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+STORE_FORMAT_VERSION = 1
+MANIFEST_FILE = 'store.json'
+LOCK_FILE = 'store.lock'
+ENTRY_DTYPE = np.dtype([('first_block', '<i8'), ('n_blocks', '<i8'), ('length', '<i8'), ('hash', '<u8')])
+LOAD_ATTEMPTS = 3
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def content_hash(text:str) -> str:
+    """Short digest of a text; also kept in Chroma metadata to tell which rows need re-embedding"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+def text_key(namespace:str, doc_id:str) -> str:
+    """Key of a text in the shared store; each collection keeps its own copy of an id's text"""
+    return f"{namespace}/{doc_id}"
+
+def open_document_store(db_path:str) -> 'DocumentStore':
+    """One DocumentStore per db_path and process, shared by every collection in that database"""
+    path = os.path.abspath(os.path.join(db_path, DOCUMENT_STORE_DIRNAME))
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = DocumentStore(path)
+        return _stores[path]
+
+class DocumentStore:
+    """Full texts keyed by document id, compressed outside the vector index.
+
+    Each text is cut into DOCUMENT_BLOCK_CHARS-character blocks that are compressed on their own
+    and appended to a data file. Memory-mapped tables map a key to its run of blocks, so a whole
+    text is one seek-and-decompress and a passage only decompresses the blocks it overlaps.
+    Writers append changed entries to a delta log and swap the manifest atomically, so a write
+    costs the size of the change; past DOCUMENT_DELTA_MAX_KEYS keys the delta is folded into a
+    new generation of the tables.
+    """
+
+    def __init__(self, path:str, codec:Optional[str] = None, block_chars:int = DOCUMENT_BLOCK_CHARS, level:int = DOCUMENT_COMPRESSION_LEVEL):
+        self.path = path
+        self.level = level
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._data_fd = None
+        self._manifest_mtime = None
+        self._last_check = 0.0
+        os.makedirs(path, exist_ok=True)
+
+        with self._write_lock():
+            if not os.path.exists(self._file(MANIFEST_FILE)):
+                self.manifest = {
+                    "format_version": STORE_FORMAT_VERSION,
+                    "codec": codec or ('zstd' if zstandard is not None else 'zlib'),
+                    "block_chars": block_chars,
+                    "generation": 0,
+                    "data_file": "blocks-0.bin"
+                }
+                open(self._file(self.manifest['data_file']), 'ab').close()
+                self._publish(np.zeros(0, dtype=ENTRY_DTYPE), [], np.zeros((0, 2), dtype=np.int64), self.manifest['data_file'])
+        self._load()
+
+    def _file(self, name:str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        # Thread lock for this process, flock for other processes writing the same store
+        with self._lock:
+            with open(self._file(LOCK_FILE), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self) -> None:
+        with self._lock:
+            for attempt in range(1, LOAD_ATTEMPTS + 1):
+                try:
+                    manifest_path = self._file(MANIFEST_FILE)
+                    mtime = os.path.getmtime(manifest_path)
+                    with open(manifest_path) as f:
+                        manifest = json.load(f)
+                    generation = manifest['generation']
+                    entries = np.load(self._file(f"entries-{generation}.npy"), mmap_mode='r' if manifest.get('table_documents', manifest['documents']) else None)
+                    block_table = np.load(self._file(f"block_table-{generation}.npy"), mmap_mode='r' if manifest.get('table_blocks', manifest['blocks']) else None)
+                    with open(self._file(f"keys-{generation}.json")) as f:
+                        keys = json.load(f)
+                    delta = b''
+                    if manifest.get('delta_bytes'):
+                        with open(self._delta_path(generation), 'rb') as f:
+                            delta = f.read(manifest['delta_bytes'])
+                    data_fd = os.open(self._file(manifest['data_file']), os.O_RDONLY)
+                    break
+                except FileNotFoundError:
+                    # A writer replaced this generation between reading the manifest and its tables
+                    if attempt == LOAD_ATTEMPTS:
+                        raise
+                    time.sleep(0.05)
+
+            if manifest.get('format_version') != STORE_FORMAT_VERSION:
+                os.close(data_fd)
+                raise ValueError(f"Unsupported document store format {manifest.get('format_version')}")
+            if manifest['codec'] == 'zstd' and zstandard is None:
+                os.close(data_fd)
+                raise ImportError("This document store is zstd-compressed: pip install zstandard")
+            if self._data_fd is not None:
+                os.close(self._data_fd)
+            self.manifest = manifest
+            self.entries = entries
+            self.block_table = block_table
+            self.keys = keys
+            self.rows = {key: row for row, key in enumerate(keys)}
+            self._data_fd = data_fd
+            self._manifest_mtime = mtime
+            self.delta_entries:Dict[str, Tuple[int, int, int, int]] = {}
+            self.delta_blocks:List[Tuple[int, int]] = []
+            self.deleted = set()
+            for line in delta.splitlines():
+                self._apply_delta(json.loads(line))
+            self._delta_read = len(delta)
+
+    def _delta_path(self, generation:int) -> str:
+        return self._file(f"delta-{generation}.jsonl")
+
+    def _read_delta(self, upto:int) -> None:
+        """Apply delta records written since the last read, up to the length the manifest commits"""
+        if upto <= self._delta_read:
+            return
+        with open(self._delta_path(self.manifest['generation']), 'rb') as f:
+            f.seek(self._delta_read)
+            data = f.read(upto - self._delta_read)
+        for line in data.splitlines():
+            self._apply_delta(json.loads(line))
+        self._delta_read = upto
+
+    def _apply_delta(self, record:Dict[str, Any]) -> None:
+        self.delta_blocks.extend(tuple(block) for block in record.get('blocks', []))
+        for key, entry in record.get('put', {}).items():
+            self.delta_entries[key] = tuple(entry)
+            self.deleted.discard(key)
+        for key in record.get('delete', []):
+            self.delta_entries.pop(key, None)
+            if key in self.rows:
+                self.deleted.add(key)
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._last_check < ACTIVE_POINTER_CHECK_INTERVAL:
+            return
+        self._last_check = now
+        self._sync()
+
+    def _sync(self) -> None:
+        """Catch up with other writers: read only the new delta records while the generation is unchanged"""
+        manifest_path = self._file(MANIFEST_FILE)
+        mtime = os.path.getmtime(manifest_path)
+        if mtime == self._manifest_mtime:
+            return
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        with self._lock:
+            if manifest['generation'] != self.manifest['generation'] or manifest.get('delta_bytes', 0) < self._delta_read:
+                self._load()
+                return
+            try:
+                self._read_delta(manifest.get('delta_bytes', 0))
+            except FileNotFoundError:
+                # The delta was folded into a new generation after the manifest was read
+                self._load()
+                return
+            self.manifest = manifest
+            self._manifest_mtime = mtime
+
+    def _entry(self, key:str) -> Optional[Tuple[int, int, int, int]]:
+        """(first_block, n_blocks, length, hash) of a key, the delta taking precedence over the tables"""
+        entry = self.delta_entries.get(key)
+        if entry is not None or key in self.deleted:
+            return entry
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        entry = self.entries[row]
+        return int(entry['first_block']), int(entry['n_blocks']), int(entry['length']), int(entry['hash'])
+
+    def _block(self, block:int) -> Tuple[int, int]:
+        if block < len(self.block_table):
+            return int(self.block_table[block][0]), int(self.block_table[block][1])
+        return self.delta_blocks[block - len(self.block_table)]
+
+    def _entry_bytes(self, entry:Optional[Tuple[int, int, int, int]]) -> int:
+        return sum(self._block(block)[1] for block in range(entry[0], entry[0] + entry[1])) if entry else 0
+
+    def live_keys(self) -> List[str]:
+        return [key for key in self.keys if key not in self.deleted and key not in self.delta_entries] + list(self.delta_entries)
+
+    def _compress(self, data:bytes) -> bytes:
+        if self.manifest['codec'] == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        return zlib.compress(data, self.level)
+
+    def _decompress(self, data:bytes) -> bytes:
+        if self.manifest['codec'] == 'zstd':
+            # Decompressor contexts must not be shared between threads
+            if not hasattr(self._local, 'decompressor'):
+                self._local.decompressor = zstandard.ZstdDecompressor()
+            return self._local.decompressor.decompress(data)
+        return zlib.decompress(data)
+
+    def _raw_blocks(self, first:int, count:int) -> List[bytes]:
+        # Callers hold self._lock so the entry, block table and data file belong to one generation
+        return [os.pread(self._data_fd, length, offset) for offset, length in (self._block(block) for block in range(first, first + count))]
+
+    def _decode(self, raw:List[bytes]) -> str:
+        return ''.join(self._decompress(data).decode('utf-8') for data in raw)
+
+    def get(self, key:str) -> Optional[str]:
+        self._refresh()
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                return None
+            raw = self._raw_blocks(entry[0], entry[1])
+        return self._decode(raw)
+
+    def get_many(self, keys:List[str]) -> List[Optional[str]]:
+        return [self.get(key) for key in keys]
+
+    def read_passage(self, key:str, start:int = 0, length:int = DOCUMENT_BLOCK_CHARS) -> Optional[str]:
+        """Characters [start, start + length) of a text, decompressing only the blocks they fall in"""
+        self._refresh()
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                return None
+            block_chars = self.manifest['block_chars']
+            start = max(0, start)
+            end = min(entry[2], start + length)
+            if start >= end:
+                return ''
+            first = start // block_chars
+            last = (end - 1) // block_chars
+            raw = self._raw_blocks(entry[0] + first, last - first + 1)
+        offset = first * block_chars
+        return self._decode(raw)[start - offset:end - offset]
+
+    def text_length(self, key:str) -> Optional[int]:
+        self._refresh()
+        with self._lock:
+            entry = self._entry(key)
+            return None if entry is None else entry[2]
+
+    def __contains__(self, key:str) -> bool:
+        self._refresh()
+        with self._lock:
+            return self._entry(key) is not None
+
+    def __len__(self) -> int:
+        self._refresh()
+        return self.manifest['documents']
+
+    def put_many(self, keys:List[str], texts:List[str]) -> int:
+        """Append new or changed texts; returns how many were written. A key repeated in one call keeps its last text"""
+        latest = dict(zip(keys, texts))
+        with self._write_lock():
+            self._sync()
+            block_chars = self.manifest['block_chars']
+            next_block = len(self.block_table) + len(self.delta_blocks)
+            blocks = []
+            puts = {}
+            documents, characters, live_bytes = 0, 0, 0
+
+            with open(self._file(self.manifest['data_file']), 'ab') as data_file:
+                offset = data_file.tell()
+                for key, text in latest.items():
+                    text = text or ''
+                    digest = int(content_hash(text), 16)
+                    previous = self._entry(key)
+                    if previous is not None and previous[3] == digest:
+                        continue
+                    first_block = next_block + len(blocks)
+                    for start in range(0, len(text), block_chars):
+                        block = self._compress(text[start:start + block_chars].encode('utf-8'))
+                        data_file.write(block)
+                        blocks.append((offset, len(block)))
+                        offset += len(block)
+                        live_bytes += len(block)
+                    puts[key] = (first_block, next_block + len(blocks) - first_block, len(text), digest)
+                    documents += previous is None
+                    characters += len(text) - (previous[2] if previous else 0)
+                    live_bytes -= self._entry_bytes(previous)
+                data_file.flush()
+                os.fsync(data_file.fileno())
+
+            if not puts:
+                return 0
+            self._append_delta({"blocks": blocks, "put": puts}, documents, characters, live_bytes)
+        logger.info(f"Stored {len(puts)} documents in {self.path}")
+        return len(puts)
+
+    def delete_many(self, keys:List[str]) -> int:
+        with self._write_lock():
+            self._sync()
+            doomed = {key: self._entry(key) for key in keys}
+            doomed = {key: entry for key, entry in doomed.items() if entry is not None}
+            if not doomed:
+                return 0
+            self._append_delta(
+                {"delete": list(doomed)},
+                -len(doomed),
+                -sum(entry[2] for entry in doomed.values()),
+                -sum(self._entry_bytes(entry) for entry in doomed.values())
+            )
+        logger.info(f"Deleted {len(doomed)} documents from {self.path}")
+        return len(doomed)
+
+    def delete_namespace(self, namespace:str) -> int:
+        """Drop every text of one collection, e.g. after the collection itself was dropped"""
+        self._refresh()
+        prefix = text_key(namespace, '')
+        with self._lock:
+            keys = [key for key in self.live_keys() if key.startswith(prefix)]
+        return self.delete_many(keys)
+
+    def _append_delta(self, record:Dict[str, Any], documents:int, characters:int, live_bytes:int) -> None:
+        """Commit one change: append it to the delta log, then point the manifest past it. Caller holds the write lock"""
+        path = self._delta_path(self.manifest['generation'])
+        committed = self.manifest.get('delta_bytes', 0)
+        with open(path, 'ab') as delta:
+            # Drop the tail a writer that died before updating the manifest may have left
+            delta.truncate(committed)
+            delta.write(json.dumps(record).encode() + b"\n")
+            delta.flush()
+            os.fsync(delta.fileno())
+            delta_bytes = delta.tell()
+        self._write_manifest(dict(
+            self.manifest,
+            delta_bytes=delta_bytes,
+            documents=self.manifest['documents'] + documents,
+            blocks=self.manifest['blocks'] + len(record.get('blocks', [])),
+            characters=self.manifest['characters'] + characters,
+            data_bytes=os.path.getsize(self._file(self.manifest['data_file'])),
+            live_bytes=self.manifest['live_bytes'] + live_bytes,
+            updated_at=time.time()
+        ))
+        self._sync()
+        if len(self.delta_entries) + len(self.deleted) > DOCUMENT_DELTA_MAX_KEYS:
+            entries, keys, block_table = self._merged()
+            self._publish(entries, keys, block_table, self.manifest['data_file'])
+        self._compact_if_needed()
+
+    def _merged(self) -> Tuple[np.ndarray, List[str], np.ndarray]:
+        """The tables with the delta folded in, for the next generation"""
+        keep = [row for row, key in enumerate(self.keys) if key not in self.deleted and key not in self.delta_entries]
+        entries = np.concatenate([
+            np.array(self.entries, dtype=ENTRY_DTYPE)[keep],
+            np.array(list(self.delta_entries.values()), dtype=ENTRY_DTYPE)
+        ])
+        keys = [self.keys[row] for row in keep] + list(self.delta_entries)
+        block_table = np.concatenate([
+            np.array(self.block_table, dtype=np.int64).reshape(-1, 2),
+            np.array(self.delta_blocks, dtype=np.int64).reshape(-1, 2)
+        ])
+        return entries, keys, block_table
+
+    def _write_manifest(self, manifest:Dict[str, Any]) -> None:
+        tmp_path = self._file(f"{MANIFEST_FILE}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self._file(MANIFEST_FILE))
+
+    def _publish(self, entries:np.ndarray, keys:List[str], block_table:np.ndarray, data_file:str) -> None:
+        """Write the next generation of tables, then switch the manifest to it"""
+        previous = dict(self.manifest)
+        generation = previous['generation'] + 1 if 'documents' in previous else 0
+        np.save(self._file(f"entries-{generation}.npy"), entries)
+        np.save(self._file(f"block_table-{generation}.npy"), block_table)
+        with open(self._file(f"keys-{generation}.json"), 'w') as f:
+            json.dump(keys, f)
+
+        # Bytes of blocks still referenced by a key; the rest of the data file is garbage
+        cumulative = np.concatenate([[0], np.cumsum(block_table[:, 1])])
+        live_bytes = int((cumulative[entries['first_block'] + entries['n_blocks']] - cumulative[entries['first_block']]).sum()) if len(entries) else 0
+        manifest = dict(
+            previous,
+            generation=generation,
+            delta_bytes=0,
+            data_file=data_file,
+            documents=len(keys),
+            blocks=len(block_table),
+            table_documents=len(keys),
+            table_blocks=len(block_table),
+            characters=int(entries['length'].sum()) if len(entries) else 0,
+            data_bytes=os.path.getsize(self._file(data_file)),
+            live_bytes=live_bytes,
+            updated_at=time.time()
+        )
+        self._write_manifest(manifest)
+        self.manifest = manifest
+
+        # Readers that already mapped the old generation keep their open handles
+        if 'documents' in previous:
+            for name in (f"entries-{previous['generation']}.npy", f"block_table-{previous['generation']}.npy", f"keys-{previous['generation']}.json", f"delta-{previous['generation']}.jsonl"):
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+            if previous['data_file'] != data_file and os.path.exists(self._file(previous['data_file'])):
+                os.remove(self._file(previous['data_file']))
+        self._load()
+
+    def _compact_if_needed(self) -> None:
+        data_bytes = self.manifest['data_bytes']
+        if data_bytes and 1 - self.manifest['live_bytes'] / data_bytes >= DOCUMENT_COMPACT_RATIO:
+            self._compact()
+
+    def compact(self) -> Dict[str, Any]:
+        """Copy live blocks into a fresh data file, dropping those of replaced or deleted texts"""
+        with self._write_lock():
+            self._sync()
+            self._compact()
+        return self.stats()
+
+    def _compact(self) -> None:
+        # Caller holds the write lock; blocks are copied as compressed bytes, never recompressed
+        before = self.manifest['data_bytes']
+        data_file = f"blocks-{self.manifest['generation'] + 1}.bin"
+        entries, keys, _ = self._merged()
+        block_table = []
+        offset = 0
+        with open(self._file(data_file), 'wb') as out:
+            for row in range(len(entries)):
+                first, count = int(entries['first_block'][row]), int(entries['n_blocks'][row])
+                entries['first_block'][row] = len(block_table)
+                for block in range(first, first + count):
+                    block_offset, block_length = self._block(block)
+                    out.write(os.pread(self._data_fd, block_length, block_offset))
+                    block_table.append((offset, block_length))
+                    offset += block_length
+            out.flush()
+            os.fsync(out.fileno())
+        self._publish(entries, keys, np.array(block_table, dtype=np.int64).reshape(-1, 2), data_file)
+        logger.info(f"Compacted {self.path}: {before} -> {self.manifest['data_bytes']} bytes")
+
+    def stats(self) -> Dict[str, Any]:
+        self._refresh()
+        manifest = self.manifest
+        return {
+            "path": self.path,
+            "codec": manifest['codec'],
+            "documents": manifest['documents'],
+            "blocks": manifest['blocks'],
+            "characters": manifest['characters'],
+            "data_bytes": manifest['data_bytes'],
+            "live_bytes": manifest['live_bytes'],
+            "compression_ratio": round(manifest['characters'] / manifest['live_bytes'], 2) if manifest['live_bytes'] else None
+        }
+
+def import_collection_documents(db_path:str, collection_name:str, strip:bool = False, batch_size:int = SNAPSHOT_BATCH_SIZE) -> Dict[str, Any]:
+    """Move texts of a collection written before the document store into it.
+
+    With strip, the texts are then blanked in Chroma (re-sending the stored vectors so nothing is re-embedded).
+    """
+    import chromadb
+    collection = chromadb.PersistentClient(path=db_path).get_collection(collection_name)
+    store = open_document_store(db_path)
+    moved = 0
+    offset = 0
+    while True:
+        batch = collection.get(offset=offset, limit=batch_size, include=["documents", "embeddings"])
+        if not batch['ids']:
+            break
+        texts = batch['documents']
+        if any(texts):
+            store.put_many([text_key(collection_name, doc_id) for doc_id in batch['ids']], [text or '' for text in texts])
+            moved += sum(1 for text in texts if text)
+            if strip:
+                collection.update(ids=batch['ids'], embeddings=batch['embeddings'], documents=[''] * len(batch['ids']))
+        offset += len(batch['ids'])
+    logger.info(f"Moved {moved} texts from {collection_name} into {store.path}")
+    return {"collection_name": collection_name, "moved": moved, **store.stats()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compressed document store maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="copy texts of an existing collection into the store")
+    import_parser.add_argument("--db-path", default="./chroma_db")
+    import_parser.add_argument("--collection", default=None, help="defaults to the active collection")
+    import_parser.add_argument("--strip", action="store_true", help="blank the copied texts in Chroma afterwards")
+    for name in ("stats", "compact"):
+        subparsers.add_parser(name).add_argument("--db-path", default="./chroma_db")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        from embedding_models import read_active_collection
+        collection_name = args.collection
+        if collection_name is None:
+            pointer = read_active_collection(args.db_path)
+            collection_name = pointer['collection_name'] if pointer else "books_story"
+        print(import_collection_documents(args.db_path, collection_name, args.strip))
+    elif args.command == "compact":
+        print(open_document_store(args.db_path).compact())
+    else:
+        print(open_document_store(args.db_path).stats())
@@ -1,13 +1,90 @@
-import logging 
-import pandas as pd 
+import logging
+import os
+import datetime
+import pandas as pd
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import chromadb
+from concurrent.futures import ProcessPoolExecutor
 from data_loader import clean_data, load_data
+from vector_store import VectorStore
+from sharding import shard_key, shard_collection_name, shard_db_path, write_shard_manifest
+from embedding_models import encode_texts, versioned_collection_name, set_active_collection
+from language_detection import language_model
+from partitions import build_partitions
+from config import SHARD_STRATEGY, SHARD_COUNT, SHARD_BUILD_WORKERS, ACTIVE_EMBEDDING_MODEL, PARTITIONS_ENABLED
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
+ADD_BATCH_SIZE = 5000
+
+def build_metadatas(df):
+    """Build the Chroma metadata dict for every row"""
+    ingested_at = datetime.date.today().isoformat()
+    metadatas = []
+    for i in range(len(df)):
+        metadata = {
+            "bookno": str(df.iloc[i]['bookno']),
+            "title": str(df.iloc[i]['Title']),
+            "author": str(df.iloc[i]['Author']),
+            "language": str(df.iloc[i]['Language']),
+            "ingested_at": ingested_at
+        }
+        metadatas.append(metadata)
+    return metadatas
+
+def build_shard(task):
+    """Encode and write one shard; runs in a worker process"""
+    key, collection_name, db_path, model_key, indices, texts, metadatas, threads = task
+    import torch
+    torch.set_num_threads(threads)
+
+    embeddings = encode_texts(model_key, texts)
+
+    store = VectorStore(shard_collection_name(collection_name, key), shard_db_path(db_path, key), model_key)
+    ids = [f"doc_{i}" for i in indices]
+    for start in range(0, len(ids), ADD_BATCH_SIZE):
+        end = start + ADD_BATCH_SIZE
+        store.write_records(ids[start:end], embeddings[start:end].tolist(), metadatas[start:end], texts[start:end], method="add")
+    return key, indices, embeddings
+
+def build_shards(texts, metadatas, strategy, collection_name="books_story", db_path="./chroma_db", model_key=ACTIVE_EMBEDDING_MODEL, shard_count=SHARD_COUNT, workers=SHARD_BUILD_WORKERS):
+    """Partition rows by shard key and build every shard in parallel processes.
+
+    Language shards are encoded with their language's model (LANGUAGE_MODELS) instead of model_key.
+    """
+    partitions = {}
+    for i, metadata in enumerate(metadatas):
+        partitions.setdefault(shard_key(metadata, strategy, shard_count), []).append(i)
+    logger.info(f"Building {len(partitions)} shards by {strategy} with {workers} workers")
+
+    # Split the cores between workers so torch does not oversubscribe the machine
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    models = {key: language_model(key) if strategy == 'language' else model_key for key in partitions}
+    tasks = [
+        (key, collection_name, db_path, models[key], indices, [texts[i] for i in indices], [metadatas[i] for i in indices], threads)
+        for key, indices in partitions.items()
+    ]
+
+    embeddings = None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for key, indices, shard_embeddings in executor.map(build_shard, tasks):
+            if embeddings is None:
+                embeddings = np.zeros((len(texts), shard_embeddings.shape[1]), dtype=shard_embeddings.dtype)
+            if embeddings.shape[1] == shard_embeddings.shape[1]:
+                embeddings[indices] = shard_embeddings
+            logger.info(f"Shard {key}: {len(indices)} documents ({models[key]})")
+
+    write_shard_manifest(db_path, {
+        "strategy": strategy,
+        "shard_count": shard_count,
+        "collection_name": collection_name,
+        "embedding_model": model_key,
+        "models": models,
+        "shards": {key: len(indices) for key, indices in partitions.items()}
+    })
+    # One backup matrix only makes sense when every shard shares an embedding space
+    return embeddings if len(set(models.values())) == 1 else None
+
 def main():
 
     # Step 1: Load and clean data
@@ -16,79 +93,76 @@ def main():
     if df1 is None:
         logger.error("Data loading failed")
         return False
-    
+
     df3 = clean_data(df1)
     if df3 is None:
         logger.error("Data cleaning failed")
         return False
-    
-    logger.info(f"Loaded {len(df3)} books")
 
-    # Step 2: Initialize ChromaDB
-    logger.info("Initializing ChromaDB...")
-    client = chromadb.PersistentClient(path="./chroma_db")
-    
-    try:
-        collection = client.get_collection("books_story")
-        logger.info("Using existing collection")
-    except:
-        collection = client.create_collection("books_story")
-        logger.info("Created new collection")
-
-    # Step 3: Create embeddings
-    logger.info("Creating embeddings...")
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    logger.info(f"Loaded {len(df3)} books")
     texts = df3['content'].tolist()
 
     if not texts:
         logger.error("No text content available")
         return False
 
-    embeddings = model.encode(texts, show_progress_bar=True)
-    logger.info(f"Generated embeddings: {embeddings.shape}")
-
-    # Step 4: Prepare metadata
+    # Step 2: Prepare metadata
     logger.info("Preparing metadata...")
-    metadatas = []
-    for i in range(len(df3)):
-        metadata = {
-            "bookno": str(df3.iloc[i]['bookno']),
-            "title": str(df3.iloc[i]['Title']),
-            "author": str(df3.iloc[i]['Author']),
-            "language": str(df3.iloc[i]['Language'])
-        }
-        metadatas.append(metadata)
+    metadatas = build_metadatas(df3)
 
-    # Step 5: Generate document IDs
-    logger.info("Generating document IDs...")
-    ids = [f"doc_{i}" for i in range(len(texts))]
-
-    # Step 6: Add to collection
-    logger.info("Adding documents to collection...")
-    try:
-        collection.add(
-            documents=texts,
-            embeddings=embeddings.tolist(),
-            metadatas=metadatas,
-            ids=ids
-        )
-        logger.info(f"Successfully added {len(df3)} documents to collection")
-    except Exception as e:
-        logger.error(f"Error adding documents to collection: {e}")
-        return False
+    if SHARD_STRATEGY:
+        # Steps 3-6 run per shard in worker processes
+        try:
+            embeddings = build_shards(texts, metadatas, SHARD_STRATEGY)
+        except Exception as e:
+            logger.error(f"Error building shards: {e}")
+            return False
+        if embeddings is None:
+            logger.info("Shards use per-language models; skipping the embeddings backup")
+            logger.info("Embedding generation completed successfully")
+            return True
+        logger.info(f"Generated embeddings: {embeddings.shape}")
+    else:
+        # Step 3: Initialize ChromaDB
+        logger.info("Initializing ChromaDB...")
+        collection_name = versioned_collection_name("books_story", ACTIVE_EMBEDDING_MODEL)
+        store = VectorStore(collection_name, "./chroma_db", ACTIVE_EMBEDDING_MODEL)
+
+        # Step 4: Create embeddings
+        logger.info(f"Creating embeddings with {ACTIVE_EMBEDDING_MODEL}...")
+        embeddings = encode_texts(ACTIVE_EMBEDDING_MODEL, texts, show_progress_bar=True)
+        logger.info(f"Generated embeddings: {embeddings.shape}")
+
+        # Step 5: Generate document IDs
+        logger.info("Generating document IDs...")
+        ids = [f"doc_{i}" for i in range(len(texts))]
 
-    # Step 7: Verification
-    final_count = collection.count()
-    logger.info(f"Final collection count: {final_count}")
+        # Step 6: Add to collection (texts go to the compressed document store)
+        logger.info("Adding documents to collection...")
+        try:
+            for start in range(0, len(ids), ADD_BATCH_SIZE):
+                end = start + ADD_BATCH_SIZE
+                store.write_records(ids[start:end], embeddings[start:end].tolist(), metadatas[start:end], texts[start:end], method="add")
+            logger.info(f"Successfully added {len(df3)} documents to collection")
+        except Exception as e:
+            logger.error(f"Error adding documents to collection: {e}")
+            return False
+
+        # Step 7: Verification
+        final_count = store.get_document_count()
+        logger.info(f"Final collection count: {final_count}")
+        if PARTITIONS_ENABLED:
+            # Step 7b: Filter value counts and per-value partitions for the query planner
+            build_partitions(store)
+        set_active_collection("./chroma_db", collection_name, ACTIVE_EMBEDDING_MODEL)
 
     # Step 8: Save embeddings backup
     np.save('embeddings.npy', embeddings)
     logger.info("Embeddings saved as backup")
     logger.info("Embedding generation completed successfully")
     return True
-    
+
 if __name__ == "__main__":
     success = main()
     if not success:
         exit(1)
-
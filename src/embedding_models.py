@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+from typing import List, Dict, Optional, Any
+from config import (
+    EMBEDDING_MODELS,
+    EMBEDDING_BATCH_SIZE,
+    ENCODER_BACKEND,
+    LEGACY_EMBEDDING_MODEL,
+    HNSW_M,
+    HNSW_CONSTRUCTION_EF,
+    HNSW_SEARCH_EF,
+    SHARD_STRATEGY
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ACTIVE_COLLECTION_FILE = 'active_collection.json'
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+def get_model_spec(model_key:str) -> Dict[str, Any]:
+    if model_key not in EMBEDDING_MODELS:
+        raise ValueError(f"Unknown embedding model '{model_key}', expected one of {sorted(EMBEDDING_MODELS)}")
+    return EMBEDDING_MODELS[model_key]
+
+def load_encoder(model_key:str):
+    """Load each registered model once per process"""
+    with _encoders_lock:
+        if model_key not in _encoders:
+            spec = get_model_spec(model_key)
+            logger.info(f"Loading embedding model {model_key} ({spec['model_name']}) on {ENCODER_BACKEND}")
+            if ENCODER_BACKEND == 'onnx':
+                from onnx_encoder import load_onnx_encoder
+                try:
+                    _encoders[model_key] = load_onnx_encoder(model_key)
+                except FileNotFoundError as e:
+                    logger.error(f"{e}; falling back to the PyTorch encoder")
+            if model_key not in _encoders:
+                from sentence_transformers import SentenceTransformer
+                _encoders[model_key] = SentenceTransformer(spec['model_name'])
+        return _encoders[model_key]
+
+def encode_texts(model_key:str, texts:List[str], batch_size:int = EMBEDDING_BATCH_SIZE, show_progress_bar:bool = False) -> np.ndarray:
+    spec = get_model_spec(model_key)
+    embeddings = load_encoder(model_key).encode(
+        texts,
+        batch_size=batch_size,
+        normalize_embeddings=spec['normalize'],
+        show_progress_bar=show_progress_bar
+    )
+    if embeddings.shape[1] != spec['dimension']:
+        raise ValueError(f"Model {model_key} produced {embeddings.shape[1]}-d vectors, registry says {spec['dimension']}")
+    return embeddings
+
+def collection_metadata(model_key:str) -> Dict[str, Any]:
+    """Metadata stored on a collection so readers can pick the matching encoder, plus its HNSW build parameters"""
+    spec = get_model_spec(model_key)
+    return {
+        "embedding_model": model_key,
+        "model_name": spec['model_name'],
+        "dimension": spec['dimension'],
+        "normalize": spec['normalize'],
+        "hnsw:M": HNSW_M,
+        "hnsw:construction_ef": HNSW_CONSTRUCTION_EF,
+        "hnsw:search_ef": HNSW_SEARCH_EF
+    }
+
+def versioned_collection_name(collection_name:str, model_key:str) -> str:
+    return f"{collection_name}__{model_key}"
+
+def active_collection_path(db_path:str) -> str:
+    return os.path.join(db_path, ACTIVE_COLLECTION_FILE)
+
+def read_active_collection(db_path:str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(active_collection_path(db_path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def write_active_collection(db_path:str, pointer:Dict[str, Any]) -> None:
+    """Replace the pointer file atomically so readers never see a partial switch"""
+    os.makedirs(db_path, exist_ok=True)
+    path = active_collection_path(db_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(pointer, f, indent=2)
+    os.replace(tmp_path, path)
+
+def set_active_collection(db_path:str, collection_name:str, model_key:str) -> None:
+    write_active_collection(db_path, {
+        "collection_name": collection_name,
+        "embedding_model": model_key,
+        "switched_at": time.time()
+    })
+    logger.info(f"Active collection is now {collection_name} ({model_key})")
+
+def preload_active_encoder(db_path:str) -> str:
+    """Load the active collection's encoder without running it, so forked workers share its weights"""
+    pointer = read_active_collection(db_path)
+    model_key = pointer['embedding_model'] if pointer else LEGACY_EMBEDDING_MODEL
+    load_encoder(model_key)
+    if SHARD_STRATEGY == 'language':
+        # Language shards each bring their own model; load them all before the first routed query
+        from sharding import read_shard_manifest
+        for shard_model in set(read_shard_manifest(db_path).get('models', {}).values()):
+            load_encoder(shard_model)
+    return model_key
@@ -0,0 +1,237 @@
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import re
+import time
+import numpy as np
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Any, Tuple
+from config import (
+    EVAL_DATASET_PATH,
+    EVAL_QUERY_KINDS,
+    EVAL_QUERIES_PER_KIND,
+    EVAL_OPENING_CHARS,
+    EVAL_K_VALUES,
+    EVAL_WORKERS
+)
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+STOPWORDS = set("""a about above after again against all am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers herself him himself
+his how i if in into is it its itself just me more most my myself no nor not now of off on once only or other our ours ourselves
+out over own said same shall she should so some such than that the their theirs them themselves then there these they this those
+through to too under until up upon very was we were what when where which while who whom why will with would you your yours
+yourself yourselves thee thou thy unto""".split())
+
+ENGINE_KEYS = {"collection_name", "db_path", "shard_keys"}
+SEARCH_DEFAULTS = {"use_cache": False}
+
+_sentence_end = re.compile(r'(?<=[.!?])\s+')
+_word = re.compile(r"[A-Za-z]{4,}")
+
+def _opening_text(store:Any, doc_id:str) -> str:
+    """Start of a text, read from the document store's first blocks when there is one"""
+    return store.read_previews([doc_id], EVAL_OPENING_CHARS)[0] or ''
+
+def opening_sentence(text:str, min_words:int = 8, max_words:int = 60) -> Optional[str]:
+    """First sentence long enough to be a query, skipping headings and front matter"""
+    for sentence in _sentence_end.split(' '.join(text.split())):
+        if min_words <= len(sentence.split()) <= max_words:
+            return sentence
+    return None
+
+def topic_words(text:str, title:str, n_words:int = 3) -> List[str]:
+    """Most frequent content words of a passage, leaving out the title's own words"""
+    excluded = STOPWORDS | {word.lower() for word in _word.findall(title)}
+    counts = Counter(word.lower() for word in _word.findall(text) if word.lower() not in excluded)
+    return [word for word, _ in counts.most_common(n_words)]
+
+def build_eval_queries(search_engine, per_kind:int = EVAL_QUERIES_PER_KIND, kinds:List[str] = EVAL_QUERY_KINDS, seed:int = 0) -> List[Dict[str, Any]]:
+    """Pseudo-labelled queries derived from the corpus, each mapped to the booknos that should rank first"""
+    books = {}
+    titles = defaultdict(set)
+    for record in search_engine.iter_documents(include_documents=False):
+        bookno = record['bookno']
+        if not bookno or bookno in books:
+            continue
+        books[bookno] = record
+        titles[' '.join(record['title'].lower().split())].add(bookno)
+
+    rng = random.Random(seed)
+    booknos = sorted(books)
+    store = search_engine.vector_store
+    queries = []
+    for kind in kinds:
+        sample = rng.sample(booknos, min(per_kind, len(booknos)))
+        for bookno in sample:
+            book = books[bookno]
+            if kind == 'title':
+                if book['title'] == 'Unknown Title':
+                    continue
+                # Editions share a title, so any of them is a correct answer
+                relevant = sorted(titles[' '.join(book['title'].lower().split())])
+                queries.append({"query": book['title'], "kind": kind, "relevant": relevant, "source_id": book['id']})
+                continue
+
+            text = _opening_text(store, book['id'])
+            if kind == 'opening':
+                sentence = opening_sentence(text)
+                if sentence:
+                    queries.append({"query": sentence, "kind": kind, "relevant": [bookno], "source_id": book['id']})
+            elif kind == 'author_topic':
+                topics = topic_words(text, book['title'])
+                if book['author'] != 'Unknown Author' and topics:
+                    template = rng.choice(["{author} {topic}", "a book by {author} about {topic}", "{topic} by {author}"])
+                    query = template.format(author=book['author'], topic=' '.join(topics))
+                    queries.append({"query": query, "kind": kind, "relevant": [bookno], "source_id": book['id']})
+            else:
+                raise ValueError(f"Unknown query kind '{kind}', expected one of {EVAL_QUERY_KINDS}")
+
+    logger.info(f"Built {len(queries)} evaluation queries from {len(books)} books")
+    return queries
+
+def save_queries(queries:List[Dict[str, Any]], path:str = EVAL_DATASET_PATH) -> None:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        for query in queries:
+            f.write(json.dumps(query) + "\n")
+
+def load_queries(path:str = EVAL_DATASET_PATH) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def ranking_metrics(ranked:List[str], relevant:List[str], k_values:List[int] = EVAL_K_VALUES) -> Dict[str, float]:
+    """Reciprocal rank, nDCG@k and recall@k with binary relevance over a bookno ranking"""
+    relevant = set(relevant)
+    hits = [bookno in relevant for bookno in ranked]
+    metrics = {"mrr": next((1.0 / (i + 1) for i, hit in enumerate(hits) if hit), 0.0)}
+    for k in k_values:
+        dcg = sum(1.0 / math.log2(i + 2) for i, hit in enumerate(hits[:k]) if hit)
+        ideal = sum(1.0 / math.log2(i + 2) for i in range(min(k, len(relevant))))
+        metrics[f"ndcg@{k}"] = dcg / ideal if ideal else 0.0
+        metrics[f"recall@{k}"] = sum(hits[:k]) / len(relevant) if relevant else 0.0
+    return metrics
+
+def parse_engine_config(spec:str) -> Dict[str, Any]:
+    """'name:key=value,key=value' -> config; values are read as JSON when they parse, else as strings"""
+    name, _, pairs = spec.partition(':')
+    config = {"name": name}
+    for pair in filter(None, pairs.split(',')):
+        key, _, value = pair.partition('=')
+        try:
+            config[key.strip()] = json.loads(value)
+        except json.JSONDecodeError:
+            config[key.strip()] = value.strip()
+    return config
+
+_engine = None
+_search_kwargs = {}
+
+def _init_worker(config:Dict[str, Any]) -> None:
+    # Each process opens its own engine; Chroma's sqlite connections must not be shared
+    global _engine, _search_kwargs
+    from search_engine import SearchEngine
+    engine_kwargs = {key: value for key, value in config.items() if key in ENGINE_KEYS}
+    _engine = SearchEngine(**engine_kwargs, follow_pointer='collection_name' not in engine_kwargs)
+    _search_kwargs = {**SEARCH_DEFAULTS, **{key: value for key, value in config.items() if key not in ENGINE_KEYS | {"name"}}}
+
+def _run_query(task:Tuple[str, int]) -> Tuple[List[str], float]:
+    query, n_results = task
+    started = time.perf_counter()
+    results = _engine.search_books(query, n_results, **_search_kwargs)
+    elapsed = time.perf_counter() - started
+    # Chunks of one book collapse to its first position
+    ranked = list(dict.fromkeys(result.get('bookno') for result in results))
+    return ranked, elapsed
+
+def _summarize(rows:List[Dict[str, float]]) -> Dict[str, float]:
+    summary = {key: float(np.mean([row[key] for row in rows])) for key in rows[0] if key != 'latency_ms'}
+    latencies = [row['latency_ms'] for row in rows]
+    summary.update({
+        "latency_mean_ms": float(np.mean(latencies)),
+        "latency_p50_ms": float(np.percentile(latencies, 50)),
+        "latency_p95_ms": float(np.percentile(latencies, 95)),
+        "queries": len(rows)
+    })
+    return summary
+
+def evaluate(config:Dict[str, Any], queries:List[Dict[str, Any]], k_values:List[int] = EVAL_K_VALUES, workers:int = EVAL_WORKERS) -> Dict[str, Any]:
+    """Run every query through a SearchEngine built from config in a process pool and score the rankings"""
+    n_results = max(k_values)
+    tasks = [(query['query'], n_results) for query in queries]
+    # spawn, not fork: the parent may already hold Chroma connections from building the dataset
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(config,)) as executor:
+        # Warm every worker's encoder before timing
+        list(executor.map(_run_query, tasks[:workers]))
+        started = time.perf_counter()
+        outcomes = list(executor.map(_run_query, tasks, chunksize=4))
+        wall = time.perf_counter() - started
+
+    rows = defaultdict(list)
+    for query, (ranked, elapsed) in zip(queries, outcomes):
+        row = {**ranking_metrics(ranked, query['relevant'], k_values), "latency_ms": elapsed * 1000}
+        rows["all"].append(row)
+        rows[query['kind']].append(row)
+    report = {"config": config, "qps": len(tasks) / wall if wall else 0.0}
+    report.update({group: _summarize(group_rows) for group, group_rows in rows.items()})
+    return report
+
+def print_comparison(reports:List[Dict[str, Any]]) -> None:
+    names = [report['config']['name'] for report in reports]
+    header = f"{'group':<14} {'metric':<16}" + ''.join(f" {name[:12]:>12}" for name in names)
+    if len(reports) == 2:
+        header += f" {'delta':>10}"
+    print(header)
+    groups = [group for group in reports[0] if group not in ("config", "qps")]
+    for group in groups:
+        for metric in reports[0][group]:
+            values = [report.get(group, {}).get(metric, float('nan')) for report in reports]
+            line = f"{group:<14} {metric:<16}" + ''.join(f" {value:>12.4f}" for value in values)
+            if len(reports) == 2:
+                line += f" {values[1] - values[0]:>+10.4f}"
+            print(line)
+    print(f"{'all':<14} {'qps':<16}" + ''.join(f" {report['qps']:>12.1f}" for report in reports))
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval evaluation with pseudo-labelled queries derived from the corpus")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="derive a query set from the collection")
+    build_parser.add_argument("--db-path", default="./chroma_db")
+    build_parser.add_argument("--per-kind", type=int, default=EVAL_QUERIES_PER_KIND)
+    build_parser.add_argument("--kinds", default=','.join(EVAL_QUERY_KINDS))
+    build_parser.add_argument("--seed", type=int, default=0)
+    build_parser.add_argument("--output", default=EVAL_DATASET_PATH)
+    run_parser = subparsers.add_parser("run", help="score one or two engine configurations on a query set")
+    run_parser.add_argument("--queries", default=EVAL_DATASET_PATH)
+    run_parser.add_argument("--config", action="append", default=None, help="name:key=value,... e.g. e5:collection_name=books_story__e5_small,search_ef=100")
+    run_parser.add_argument("--k", default=','.join(str(k) for k in EVAL_K_VALUES))
+    run_parser.add_argument("--workers", type=int, default=EVAL_WORKERS)
+    run_parser.add_argument("--report", default=None, help="write the full report as JSON")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from search_engine import SearchEngine
+        queries = build_eval_queries(SearchEngine(db_path=args.db_path), args.per_kind, args.kinds.split(','), args.seed)
+        save_queries(queries, args.output)
+        print(f"Wrote {len(queries)} queries to {args.output}: {dict(Counter(query['kind'] for query in queries))}")
+        return
+
+    queries = load_queries(args.queries)
+    k_values = [int(k) for k in args.k.split(',')]
+    configs = [parse_engine_config(spec) for spec in (args.config or ["active:"])]
+    reports = [evaluate(config, queries, k_values, args.workers) for config in configs]
+    print_comparison(reports)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == "__main__":
+    main()
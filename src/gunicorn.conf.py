@@ -0,0 +1,9 @@
+# Multi-worker serving: gunicorn -c gunicorn.conf.py app:app
+from config import SERVING_HOST, SERVING_PORT, SERVING_WORKERS
+
+bind = f"{SERVING_HOST}:{SERVING_PORT}"
+workers = SERVING_WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+# Import app.py once in the master (loading the encoder) before forking workers
+preload_app = True
+timeout = 120
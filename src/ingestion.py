@@ -0,0 +1,133 @@
+import logging
+import time
+from typing import List, Dict, Any, Tuple
+from data_loader import load_data, clean_data
+from embedding_generation import build_metadatas
+from embedding_models import versioned_collection_name, read_active_collection, write_active_collection, set_active_collection
+from vector_store import VectorStore
+from shared_state import WorkerRegistry
+from jobs import JobContext
+from query_cache import build_query_cache
+from partitions import build_partitions, partition_job
+from shared_index import shared_index_job
+from config import JOB_BATCH_SIZE, MIGRATION_ACK_TIMEOUT, PARTITIONS_ENABLED
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def load_corpus(job:JobContext) -> Tuple[List[str], List[str], List[Dict[str, str]]]:
+    """Load and clean the CSV corpus; returns ids, texts and metadatas like embedding_generation"""
+    job.stage("cleaning")
+    df1, _ = load_data()
+    if df1 is None:
+        raise RuntimeError("Data loading failed")
+    df = clean_data(df1)
+    if df is None:
+        raise RuntimeError("Data cleaning failed")
+    job.check_cancelled()
+
+    texts = df['content'].tolist()
+    job.registry.count(job.job_id, cleaned=len(texts))
+    return [f"doc_{i}" for i in range(len(texts))], texts, build_metadatas(df)
+
+def ingest_corpus(search_engine, job:JobContext, batch_size:int = JOB_BATCH_SIZE) -> Dict[str, Any]:
+    """Upsert the cleaned corpus into the live collection; unchanged texts are not re-encoded"""
+    started = time.perf_counter()
+    ids, texts, metadatas = load_corpus(job)
+    job.stage("writing", total=len(ids))
+
+    encoded = written = 0
+    for start in range(0, len(ids), batch_size):
+        job.throttle(min(batch_size, len(ids) - start))
+        books = [
+            {"id": doc_id, "content": text, **metadata}
+            for doc_id, text, metadata in zip(ids[start:start + batch_size], texts[start:start + batch_size], metadatas[start:start + batch_size])
+        ]
+        stats = search_engine.upsert_books(books)
+        encoded += stats["embedded"]
+        written += len(books)
+        job.progress(written, encoded=encoded, written=written)
+
+    # Value counts and partitions follow the new corpus; language shards are already partitioned
+    partitions = build_partitions(search_engine.vector_store, job)["partitions"] if PARTITIONS_ENABLED and not search_engine.sharded else 0
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Ingested {written} documents ({encoded} encoded) in {elapsed:.1f}s")
+    return {"collection_name": search_engine.vector_store.collection_name, "written": written, "encoded": encoded, "partitions": partitions, "seconds": round(elapsed, 2)}
+
+def reindex_corpus(search_engine, job:JobContext, batch_size:int = JOB_BATCH_SIZE) -> Dict[str, Any]:
+    """Rebuild the corpus into a fresh collection while the old one serves, then switch atomically.
+
+    The new collection is announced as a migration target so API writes made during the
+    rebuild are mirrored into it; on failure or cancellation it is dropped again.
+    """
+    if search_engine.sharded:
+        raise ValueError("Reindex is only supported for unsharded collections; rebuild shards instead")
+    active = search_engine.vector_store
+    pointer = read_active_collection(search_engine.db_path) or {
+        "collection_name": active.collection_name,
+        "embedding_model": active.model_key
+    }
+    if pointer.get("migration"):
+        raise ValueError(f"A migration to {pointer['migration']['collection_name']} is in progress")
+
+    started = time.perf_counter()
+    ids, texts, metadatas = load_corpus(job)
+
+    base_name = active.collection_name.split('__')[0]
+    target_name = f"{versioned_collection_name(base_name, active.model_key)}__{time.strftime('%Y%m%d%H%M%S')}"
+    target = VectorStore(target_name, search_engine.db_path, model_key=active.model_key)
+    pointer["migration"] = {
+        "collection_name": target_name,
+        "embedding_model": active.model_key,
+        "started_at": time.time()
+    }
+    write_active_collection(search_engine.db_path, pointer)
+
+    try:
+        # Every serving worker must mirror its writes into the target before the copy starts
+        job.stage("waiting for workers")
+        WorkerRegistry().wait_for(target_name, MIGRATION_ACK_TIMEOUT)
+        job.stage("writing", total=len(ids))
+        written = 0
+        for start in range(0, len(ids), batch_size):
+            job.throttle(min(batch_size, len(ids) - start))
+            batch_texts = texts[start:start + batch_size]
+            embeddings = target.embed_texts(batch_texts)
+            job.registry.count(job.job_id, encoded=written + len(batch_texts))
+            target.write_records(ids[start:start + batch_size], embeddings, metadatas[start:start + batch_size], batch_texts)
+            written += len(batch_texts)
+            job.progress(written, written=written)
+
+        # Built before the switch so the first filtered query on the new collection is planned
+        partitions = build_partitions(target, job)["partitions"] if PARTITIONS_ENABLED else 0
+        job.stage("switching")
+        set_active_collection(search_engine.db_path, target_name, active.model_key)
+        search_engine._last_pointer_check = 0.0
+    except Exception:
+        pointer.pop("migration", None)
+        write_active_collection(search_engine.db_path, pointer)
+        try:
+            target.drop_collection(target_name)
+        except Exception as e:
+            logger.error(f"Error dropping unfinished collection {target_name}: {e}")
+        raise
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Reindexed {written} documents into {target_name} in {elapsed:.1f}s")
+    return {
+        "source_collection": active.collection_name,
+        "target_collection": target_name,
+        "written": written,
+        "target_count": target.get_document_count(),
+        "partitions": partitions,
+        "seconds": round(elapsed, 2)
+    }
+
+JOB_TYPES = {
+    "ingest": ingest_corpus,
+    "reindex": reindex_corpus,
+    "query_cache": build_query_cache,
+    "partitions": partition_job,
+    "shared_index": shared_index_job
+}
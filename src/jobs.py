@@ -0,0 +1,261 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Any, Callable
+from shared_state import SqliteConnections, pid_alive
+from config import MAX_TRACKED_JOBS, JOB_WORKERS, JOB_RATE_LIMIT, JOB_CANCEL_POLL_INTERVAL, SHARED_STATE_PATH
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+"""
+
+class JobCancelled(Exception):
+    """Raised inside a running job once cancellation was requested"""
+
+class JobRegistry:
+    """Status table for background jobs in a sqlite file shared by the workers of a host.
+
+    Any worker can report on or cancel a job another worker runs. Jobs of a worker that exited
+    are reported as failed. The oldest finished jobs are evicted first.
+    """
+
+    def __init__(self, path:str = SHARED_STATE_PATH, max_jobs:int = MAX_TRACKED_JOBS):
+        self.max_jobs = max_jobs
+        self._connection = SqliteConnections(path, SCHEMA)
+
+    def create(self, job_type:str, total:int = 0, params:Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        job = {
+            "id": uuid.uuid4().hex,
+            "type": job_type,
+            "status": "queued",
+            "params": params or {},
+            "total": total,
+            "processed": 0,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "stage": None,
+            "counters": {},
+            "cancel_requested": False,
+            "pid": os.getpid()
+        }
+        with self._connection.transaction() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, created_at, status, data) VALUES (?, ?, ?, ?)",
+                (job["id"], job["created_at"], job["status"], json.dumps(job, default=str))
+            )
+            self._evict(connection)
+        logger.info(f"Created {job_type} job {job['id']} ({total} items)")
+        return self._snapshot(job)
+
+    def _modify(self, job_id:str, modify:Callable[[Dict[str, Any]], None]) -> None:
+        with self._connection.transaction() as connection:
+            row = connection.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            job = json.loads(row[0])
+            modify(job)
+            connection.execute("UPDATE jobs SET status = ?, data = ? WHERE id = ?", (job["status"], json.dumps(job, default=str), job_id))
+
+    def update(self, job_id:str, **fields:Any) -> None:
+        self._modify(job_id, lambda job: job.update(fields))
+
+    def start(self, job_id:str) -> None:
+        self.update(job_id, status="running", started_at=time.time(), pid=os.getpid())
+
+    def finish(self, job_id:str, result:Any = None) -> None:
+        self.update(job_id, status="completed", finished_at=time.time(), result=result)
+
+    def fail(self, job_id:str, error:str) -> None:
+        logger.error(f"Job {job_id} failed: {error}")
+        self.update(job_id, status="failed", finished_at=time.time(), error=error)
+
+    def cancelled(self, job_id:str) -> None:
+        logger.info(f"Job {job_id} cancelled")
+        self.update(job_id, status="cancelled", finished_at=time.time())
+
+    def count(self, job_id:str, **counters:int) -> None:
+        """Set named progress counters, e.g. cleaned/encoded/written rows"""
+        self._modify(job_id, lambda job: job.update(counters={**job["counters"], **counters}))
+
+    def cancel_requested(self, job_id:str) -> bool:
+        row = self._connection().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and json.loads(row[0])["cancel_requested"])
+
+    def get(self, job_id:str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._snapshot(json.loads(row[0])) if row else None
+
+    def list(self) -> List[Dict[str, Any]]:
+        rows = self._connection().execute("SELECT data FROM jobs ORDER BY created_at").fetchall()
+        return [self._snapshot(json.loads(row[0])) for row in rows]
+
+    def _snapshot(self, job:Dict[str, Any]) -> Dict[str, Any]:
+        snapshot = dict(job, counters=dict(job["counters"]), eta_seconds=None)
+        pid = snapshot.pop("pid", None)
+        if job["status"] not in FINISHED_STATUSES and pid and not pid_alive(pid):
+            snapshot.update(status="failed", error=f"Worker {pid} exited before the job finished")
+        # Linear extrapolation from the rate seen so far
+        elif job["status"] == "running" and job["started_at"] and 0 < job["processed"] < job["total"]:
+            elapsed = time.time() - job["started_at"]
+            snapshot["eta_seconds"] = round(elapsed / job["processed"] * (job["total"] - job["processed"]), 1)
+        return snapshot
+
+    def _evict(self, connection:sqlite3.Connection) -> None:
+        connection.execute(
+            f"DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))}) "
+            "ORDER BY created_at LIMIT max(0, (SELECT COUNT(*) FROM jobs) - ?))",
+            (*FINISHED_STATUSES, self.max_jobs)
+        )
+
+def run_tracked(registry:JobRegistry, job_id:str, fn, *args, **kwargs) -> None:
+    """Run fn as job_id, passing a progress callback that records processed items"""
+    registry.start(job_id)
+    try:
+        result = fn(*args, progress_callback=lambda processed: registry.update(job_id, processed=processed), **kwargs)
+        registry.finish(job_id, result)
+    except Exception as e:
+        registry.fail(job_id, str(e))
+
+class RateLimiter:
+    """Token bucket shared by background jobs so they cannot starve the CPU that serves queries"""
+
+    def __init__(self, rate:float, burst:Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount:float = 1) -> None:
+        if not self.rate:
+            return
+        needed = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= needed:
+                    # Requests larger than the bucket leave it in debt instead of never fitting
+                    self.tokens -= amount
+                    return
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+class JobContext:
+    """Handle a scheduled job uses to report progress, honour cancellation and throttle itself"""
+
+    def __init__(self, registry:JobRegistry, job_id:str, limiter:RateLimiter, cancel_event:threading.Event):
+        self.registry = registry
+        self.job_id = job_id
+        self.limiter = limiter
+        self.cancel_event = cancel_event
+        self._last_poll = time.monotonic()
+
+    def check_cancelled(self) -> None:
+        # A cancel sent to another worker only reaches this one through the registry
+        now = time.monotonic()
+        if not self.cancel_event.is_set() and now - self._last_poll >= JOB_CANCEL_POLL_INTERVAL:
+            self._last_poll = now
+            if self.registry.cancel_requested(self.job_id):
+                self.cancel_event.set()
+        if self.cancel_event.is_set():
+            raise JobCancelled(self.job_id)
+
+    def throttle(self, amount:int) -> None:
+        self.check_cancelled()
+        self.limiter.acquire(amount)
+        self.check_cancelled()
+
+    def stage(self, name:str, total:Optional[int] = None) -> None:
+        fields = {"stage": name}
+        if total is not None:
+            fields["total"] = total
+        self.registry.update(self.job_id, **fields)
+
+    def progress(self, processed:int, **counters:int) -> None:
+        self.registry.update(self.job_id, processed=processed)
+        if counters:
+            self.registry.count(self.job_id, **counters)
+
+class JobScheduler:
+    """Runs jobs on a small thread pool in the serving process; fn receives a JobContext as job="""
+
+    def __init__(self, registry:JobRegistry, workers:int = JOB_WORKERS, rate_limit:float = JOB_RATE_LIMIT):
+        self.registry = registry
+        self.limiter = RateLimiter(rate_limit)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._cancel_events = {}
+        self._futures = {}
+        # Held while a job is registered, so _run's cleanup cannot run before its future is stored
+        self._lock = threading.Lock()
+
+    def submit(self, job_type:str, fn:Callable[..., Any], *args:Any, total:int = 0, params:Optional[Dict[str, Any]] = None, **kwargs:Any) -> Dict[str, Any]:
+        job = self.registry.create(job_type, total=total, params=params)
+        with self._lock:
+            self._cancel_events[job["id"]] = threading.Event()
+            self._futures[job["id"]] = self._executor.submit(self._run, job["id"], fn, args, kwargs)
+        return job
+
+    def _run(self, job_id:str, fn:Callable[..., Any], args:tuple, kwargs:Dict[str, Any]) -> None:
+        with self._lock:
+            context = JobContext(self.registry, job_id, self.limiter, self._cancel_events[job_id])
+        try:
+            # Cancelled through another worker while it was queued here
+            if self.registry.cancel_requested(job_id):
+                raise JobCancelled(job_id)
+            self.registry.start(job_id)
+            self.registry.finish(job_id, fn(*args, job=context, **kwargs))
+        except JobCancelled:
+            self.registry.cancelled(job_id)
+        except Exception as e:
+            self.registry.fail(job_id, str(e))
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+                self._futures.pop(job_id, None)
+
+    def cancel(self, job_id:str) -> Optional[Dict[str, Any]]:
+        """Ask a job to stop; queued jobs are dropped, running ones stop at their next checkpoint"""
+        job = self.registry.get(job_id)
+        if job is None or job["status"] in FINISHED_STATUSES:
+            return job
+        self.registry.update(job_id, cancel_requested=True)
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+            if event:
+                event.set()
+            future = self._futures.get(job_id)
+            dropped = bool(future and future.cancel())
+            if dropped:
+                self._cancel_events.pop(job_id, None)
+                self._futures.pop(job_id, None)
+        if dropped:
+            self.registry.cancelled(job_id)
+        return self.registry.get(job_id)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            events = list(self._cancel_events.values())
+        for event in events:
+            event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
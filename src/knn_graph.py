@@ -0,0 +1,167 @@
+import argparse
+import json
+import logging
+import os
+import re
+import time
+import numpy as np
+from multiprocessing import Pool
+from typing import List, Optional, Tuple
+from config import Chroma_embedding_path, Chroma_collection_name, ACTIVE_EMBEDDING_MODEL, KNN_GRAPH_DIR, KNN_K, KNN_BLOCK_SIZE, KNN_WORKERS
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+NEIGHBOURS_FILE = 'knn_neighbours.npy'
+SCORES_FILE = 'knn_scores.npy'
+MANIFEST_FILE = 'knn_manifest.json'
+
+_corpus = None
+
+def _normalize(block:np.ndarray) -> np.ndarray:
+    block = np.asarray(block, dtype=np.float32)
+    norms = np.linalg.norm(block, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return block / norms
+
+def _init_worker(embeddings_path:str) -> None:
+    # Every worker maps the same file, so the OS page cache is shared instead of copied
+    global _corpus
+    _corpus = np.load(embeddings_path, mmap_mode='r')
+
+def _knn_block(task:Tuple[int, int, int, int]) -> Tuple[int, np.ndarray, np.ndarray]:
+    """Exact top-k cosine neighbours for rows [start, end) against the whole corpus"""
+    start, end, k, block_size = task
+    n_rows = len(_corpus)
+    queries = _normalize(_corpus[start:end])
+    best_scores = np.full((end - start, k), -np.inf, dtype=np.float32)
+    best_ids = np.full((end - start, k), -1, dtype=np.int32)
+    rows = np.arange(end - start)
+
+    for corpus_start in range(0, n_rows, block_size):
+        corpus_end = min(corpus_start + block_size, n_rows)
+        scores = queries @ _normalize(_corpus[corpus_start:corpus_end]).T
+
+        # A book is not its own neighbour
+        overlap_start, overlap_end = max(start, corpus_start), min(end, corpus_end)
+        if overlap_start < overlap_end:
+            own = np.arange(overlap_start, overlap_end)
+            scores[own - start, own - corpus_start] = -np.inf
+
+        candidate_scores = np.concatenate([best_scores, scores], axis=1)
+        candidate_ids = np.concatenate([
+            best_ids,
+            np.broadcast_to(np.arange(corpus_start, corpus_end, dtype=np.int32), scores.shape)
+        ], axis=1)
+        top = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+        best_scores = candidate_scores[rows[:, None], top]
+        best_ids = candidate_ids[rows[:, None], top]
+
+    order = np.argsort(-best_scores, axis=1)
+    return start, best_ids[rows[:, None], order], best_scores[rows[:, None], order]
+
+def build_knn_graph(embeddings_path:str = Chroma_embedding_path, output_dir:str = KNN_GRAPH_DIR, k:int = KNN_K, block_size:int = KNN_BLOCK_SIZE, workers:int = KNN_WORKERS, collection_name:str = Chroma_collection_name, embedding_model:str = ACTIVE_EMBEDDING_MODEL) -> bool:
+    """Write the exact k-NN graph of embeddings.npy as memory-mappable neighbour/score tables.
+
+    A manifest records the collection and model the embeddings came from, so a search engine
+    only serves the tables for that collection and until it is written to.
+    """
+    try:
+        # The graph is as old as the exported embeddings, not as the build
+        snapshot_at = os.path.getmtime(embeddings_path)
+        corpus = np.load(embeddings_path, mmap_mode='r')
+        n_rows, dim = corpus.shape
+        k = min(k, n_rows - 1)
+        logger.info(f"Building {k}-NN graph for {n_rows} x {dim} embeddings with {workers} workers")
+
+        os.makedirs(output_dir, exist_ok=True)
+        # Tables are rewritten in place, so readers must not trust them until the new manifest exists
+        manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        # Outputs are written through memmaps so neither table has to fit in RAM
+        neighbours = np.lib.format.open_memmap(os.path.join(output_dir, NEIGHBOURS_FILE), mode='w+', dtype=np.int32, shape=(n_rows, k))
+        scores = np.lib.format.open_memmap(os.path.join(output_dir, SCORES_FILE), mode='w+', dtype=np.float32, shape=(n_rows, k))
+
+        tasks = [(start, min(start + block_size, n_rows), k, block_size) for start in range(0, n_rows, block_size)]
+        started = time.perf_counter()
+        done = 0
+        with Pool(processes=workers, initializer=_init_worker, initargs=(embeddings_path,)) as pool:
+            for start, block_ids, block_scores in pool.imap_unordered(_knn_block, tasks):
+                neighbours[start:start + len(block_ids)] = block_ids
+                scores[start:start + len(block_ids)] = block_scores
+                done += len(block_ids)
+                elapsed = time.perf_counter() - started
+                logger.info(f"{done}/{n_rows} rows, {done / elapsed:.1f} rows/s, {done * n_rows / elapsed / 1e6:.1f}M pairs/s")
+
+        neighbours.flush()
+        scores.flush()
+        manifest = {
+            "collection_name": collection_name,
+            "embedding_model": embedding_model,
+            "rows": n_rows,
+            "k": k,
+            "snapshot_at": snapshot_at,
+            "built_at": time.time()
+        }
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+        logger.info(f"k-NN graph written to {output_dir} in {time.perf_counter() - started:.1f}s")
+        return True
+
+    except Exception as e:
+        logger.error(f"Error building k-NN graph: {e}")
+        return False
+
+class NeighbourTable:
+    """Read-only, memory-mapped view of a precomputed k-NN graph; rows follow the doc_{i} ids"""
+
+    def __init__(self, graph_dir:str = KNN_GRAPH_DIR):
+        self.neighbours = np.load(os.path.join(graph_dir, NEIGHBOURS_FILE), mmap_mode='r')
+        self.scores = np.load(os.path.join(graph_dir, SCORES_FILE), mmap_mode='r')
+        self.k = self.neighbours.shape[1]
+        with open(os.path.join(graph_dir, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        logger.info(f"Loaded {self.k}-NN table of {self.manifest['collection_name']} for {len(self.neighbours)} books from {graph_dir}")
+
+    @staticmethod
+    def exists(graph_dir:str = KNN_GRAPH_DIR) -> bool:
+        # Tables without a manifest are from an older or unfinished build and cannot be matched to a collection
+        return all(os.path.exists(os.path.join(graph_dir, name)) for name in (NEIGHBOURS_FILE, SCORES_FILE, MANIFEST_FILE))
+
+    def matches(self, collection_name:str, model_key:Optional[str], last_write:float) -> bool:
+        """Whether the tables were built from this collection and model, and it was not written to since"""
+        return (
+            self.manifest['collection_name'] == collection_name
+            and self.manifest['embedding_model'] == model_key
+            and last_write <= self.manifest['snapshot_at']
+        )
+
+    def lookup(self, doc_id:str) -> Optional[List[Tuple[str, float]]]:
+        """Return [(neighbour_id, cosine_similarity)] or None if doc_id is not in the table"""
+        match = re.fullmatch(r'doc_(\d+)', doc_id)
+        if not match or int(match.group(1)) >= len(self.neighbours):
+            return None
+        row = int(match.group(1))
+        return [
+            (f"doc_{neighbour}", float(score))
+            for neighbour, score in zip(self.neighbours[row], self.scores[row])
+            if neighbour >= 0
+        ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the exact k-NN graph of the catalogue")
+    parser.add_argument("--embeddings", default=Chroma_embedding_path)
+    parser.add_argument("--output-dir", default=KNN_GRAPH_DIR)
+    parser.add_argument("--k", type=int, default=KNN_K)
+    parser.add_argument("--block-size", type=int, default=KNN_BLOCK_SIZE)
+    parser.add_argument("--workers", type=int, default=KNN_WORKERS)
+    parser.add_argument("--collection", default=Chroma_collection_name, help="Collection the embeddings were exported from")
+    parser.add_argument("--model", default=ACTIVE_EMBEDDING_MODEL, help="Embedding model key of that collection")
+    args = parser.parse_args()
+
+    success = build_knn_graph(args.embeddings, args.output_dir, args.k, args.block_size, args.workers, args.collection, args.model)
+    if not success:
+        exit(1)
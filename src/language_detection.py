@@ -0,0 +1,91 @@
+import re
+from typing import List, Dict, Optional, Iterable, Tuple
+from config import LANGUAGE_MODELS, DEFAULT_LANGUAGE_MODEL, LANGUAGE_DETECT_MIN_SCORE, LANGUAGE_DETECT_MIN_WORDS, LANGUAGE_DETECT_MARGIN
+
+# Function words that rarely appear in other languages' text; keys match the language shard keys
+STOPWORD_PROFILES = {
+    'english': "a an the and of to in is that it was for with as his he on be at by had not but from they this which you were her she what when there all would their will".split(),
+    'french': "le la les de et des du un une est dans que qui pour pas sur au avec il elle ne se ce son sont mais nous vous leur cette aux".split(),
+    'german': "der die das und ist nicht ein eine den dem des zu mit sich auf für von im auch es ich sie wie wir aber noch nach bei oder".split(),
+    'spanish': "el la los las y de que en un una es por con para no se lo del al como pero su sus más muy ya este esta".split(),
+    'italian': "il lo la gli le di che e un una è per con non si del della dei nel alla sono ma come anche più questo questa".split(),
+    'portuguese': "o a os as e de que em um uma do da dos das no na para com não se por mais mas como ao foi são seu sua".split(),
+    'dutch': "de het een en van in is dat op te zijn met voor niet aan er maar om ook als bij nog wel uit hij zij".split(),
+    'finnish': "ja on ei se että hän oli ovat mutta kun niin myös tai jos sen kuin olla mitä minä sinä me te he".split(),
+    'swedish': "och att det som en på är av för med till den har inte om ett var jag han hon men så från de".split(),
+    'danish': "og at det som en på er af for med til den har ikke om et var jeg han hun men så fra de".split(),
+    'latin': "et in est non ad cum quod qui quae sed ut ab ex per esse sunt enim autem atque etiam nec vel hoc".split(),
+    'esperanto': "la kaj de en estas al ne mi vi li ŝi ni ili kiu kio por kun sed tiu tio estis ankaŭ".split(),
+}
+STOPWORD_SETS = {language: set(words) for language, words in STOPWORD_PROFILES.items()}
+# A word shared by several languages ('de', 'la', 'in') is split between them
+WORD_LANGUAGES = {}
+for _language, _stopwords in STOPWORD_SETS.items():
+    for _stopword in _stopwords:
+        WORD_LANGUAGES.setdefault(_stopword, []).append(_language)
+
+# Scripts that identify a language on their own
+SCRIPT_RANGES = {
+    'chinese': re.compile(r'[一-鿿]'),
+    'greek': re.compile(r'[Ͱ-Ͽἀ-῿]'),
+    'russian': re.compile(r'[Ѐ-ӿ]'),
+}
+
+_word = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+def language_model(language_key:str) -> str:
+    """Embedding model a language shard is built with"""
+    return LANGUAGE_MODELS.get(language_key, DEFAULT_LANGUAGE_MODEL)
+
+def _word_evidence(text:str, allowed:Optional[set]) -> Tuple[Dict[str, float], Dict[str, int], float]:
+    """Per language: function-word score (shared words split), count of its function words, and the matched share"""
+    words = [word.lower() for word in _word.findall(text)]
+    scores:Dict[str, float] = {}
+    hits:Dict[str, int] = {}
+    matched = 0
+    for word in words:
+        languages = [language for language in WORD_LANGUAGES.get(word, ()) if allowed is None or language in allowed]
+        matched += bool(languages)
+        for language in languages:
+            scores[language] = scores.get(language, 0.0) + 1.0 / len(languages)
+            hits[language] = hits.get(language, 0) + 1
+    return scores, hits, matched / len(words) if words else 0.0
+
+def _script_language(text:str, allowed:Optional[set]) -> Optional[str]:
+    letters = [char for char in text if char.isalpha()]
+    for language, pattern in SCRIPT_RANGES.items():
+        if (allowed is None or language in allowed) and letters and len(pattern.findall(text)) / len(letters) > 0.3:
+            return language
+    return None
+
+def rank_languages(text:str, candidates:Optional[Iterable[str]] = None, priors:Optional[Dict[str, float]] = None) -> List[str]:
+    """Languages with any evidence in text, likeliest first; equal scores go to the larger prior"""
+    allowed = set(candidates) if candidates is not None else None
+    script = _script_language(text, allowed)
+    if script:
+        return [script]
+    scores, _, _ = _word_evidence(text, allowed)
+    priors = priors or {}
+    return sorted(scores, key=lambda language: (-round(scores[language], 6), -priors.get(language, 0)))
+
+def detect_language(text:str, candidates:Optional[Iterable[str]] = None, priors:Optional[Dict[str, float]] = None) -> Optional[str]:
+    """Language key of a query when the evidence is clear, else None.
+
+    Uses the script for non-Latin alphabets. Otherwise the winner needs LANGUAGE_DETECT_MIN_WORDS
+    of its function words and LANGUAGE_DETECT_MARGIN times the runner-up's score, so titles such
+    as "Don Quijote de la Mancha" or "Les misérables" are not pinned to one language.
+    """
+    allowed = set(candidates) if candidates is not None else None
+    script = _script_language(text, allowed)
+    if script:
+        return script
+
+    scores, hits, matched = _word_evidence(text, allowed)
+    if not scores or matched < LANGUAGE_DETECT_MIN_SCORE:
+        return None
+    ranked = rank_languages(text, candidates, priors)
+    best = ranked[0]
+    runner_up = scores[ranked[1]] if len(ranked) > 1 else 0.0
+    if hits[best] < LANGUAGE_DETECT_MIN_WORDS or scores[best] < LANGUAGE_DETECT_MARGIN * runner_up:
+        return None
+    return best
@@ -0,0 +1,101 @@
+import logging
+import time
+from typing import List, Dict, Optional, Any, Callable
+from vector_store import VectorStore
+from shared_state import WorkerRegistry
+from embedding_models import (
+    versioned_collection_name,
+    read_active_collection,
+    write_active_collection,
+    set_active_collection
+)
+from config import MIGRATION_BATCH_SIZE, MIGRATION_ACK_TIMEOUT
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def copy_rows(source:VectorStore, target:VectorStore, doc_ids:List[str], rounds:int = 3) -> int:
+    """Re-embed rows of source into target, then re-read them and redo rows a concurrent write changed.
+
+    Writers update the source before its mirror, so a row still unchanged at the re-read either
+    was copied current or gets its new version through the mirror afterwards.
+    """
+    copied = 0
+    for _ in range(rounds):
+        rows = source.get_documents_by_ids(doc_ids, include=["documents", "metadatas"])
+        if not rows:
+            raise RuntimeError(f"Could not read {len(doc_ids)} rows of {source.collection_name}")
+        written = dict(zip(rows['ids'], rows['metadatas']))
+        if rows['ids']:
+            # Texts go to the target's own keys in the document store along with the new vectors
+            target.write_records(rows['ids'], target.embed_texts(rows['documents']), rows['metadatas'], rows['documents'])
+        gone = [doc_id for doc_id in doc_ids if doc_id not in written]
+        if gone:
+            target.delete_documents(gone)
+        copied = copied or len(written)
+        current = source.get_documents_by_ids(list(written), include=["metadatas"])
+        now = dict(zip(current.get('ids', []), current.get('metadatas', [])))
+        doc_ids = [doc_id for doc_id, metadata in written.items() if now.get(doc_id) != metadata]
+        if not doc_ids:
+            break
+    return copied
+
+def migrate_collection(db_path:str, source_collection:str, target_model_key:str, batch_size:int = MIGRATION_BATCH_SIZE, progress_callback:Optional[Callable[[int], None]] = None) -> Dict[str, Any]:
+    """Re-embed source_collection with another model into a new collection, then switch readers to it.
+
+    The source keeps serving queries during the copy. While the pointer file carries a
+    'migration' entry, SearchEngine mirrors writes into the target so no edit is lost.
+    """
+    source = VectorStore(source_collection, db_path)
+    if source.model_key == target_model_key:
+        raise ValueError(f"{source_collection} already uses {target_model_key}")
+
+    base_name = source_collection.split('__')[0]
+    target_name = versioned_collection_name(base_name, target_model_key)
+    try:
+        # Start clean so rows left by an interrupted migration are not kept
+        source.drop_collection(target_name)
+    except Exception:
+        pass
+    target = VectorStore(target_name, db_path, model_key=target_model_key)
+
+    pointer = read_active_collection(db_path) or {
+        "collection_name": source_collection,
+        "embedding_model": source.model_key
+    }
+    pointer["migration"] = {
+        "collection_name": target_name,
+        "embedding_model": target_model_key,
+        "started_at": time.time()
+    }
+    write_active_collection(db_path, pointer)
+
+    try:
+        # Every serving worker must mirror its writes into the target before the copy starts
+        WorkerRegistry().wait_for(target_name, MIGRATION_ACK_TIMEOUT)
+        started = time.perf_counter()
+        copied = 0
+        logger.info(f"Migrating {source_collection} ({source.model_key}) -> {target_name} ({target_model_key})")
+        # A fixed id list, since deletes mirrored during the copy would shift offset-based pages
+        doc_ids = source.get_ids()
+        for start in range(0, len(doc_ids), batch_size):
+            copied += copy_rows(source, target, doc_ids[start:start + batch_size])
+            if progress_callback:
+                progress_callback(start + len(doc_ids[start:start + batch_size]))
+
+        set_active_collection(db_path, target_name, target_model_key)
+        elapsed = time.perf_counter() - started
+        logger.info(f"Migration finished: {copied} documents in {elapsed:.1f}s")
+        return {
+            "source_collection": source_collection,
+            "target_collection": target_name,
+            "embedding_model": target_model_key,
+            "copied": copied,
+            "target_count": target.get_document_count(),
+            "seconds": round(elapsed, 2)
+        }
+
+    except Exception:
+        pointer.pop("migration", None)
+        write_active_collection(db_path, pointer)
+        raise
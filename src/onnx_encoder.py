@@ -0,0 +1,184 @@
+import argparse
+import json
+import logging
+import os
+import time
+import numpy as np
+from typing import List, Dict, Any
+from config import EMBEDDING_MODELS, ACTIVE_EMBEDDING_MODEL, ONNX_MODEL_DIR, ONNX_QUANTIZE, ONNX_INTRA_OP_THREADS
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+ONNX_CONFIG_FILE = 'encoder_config.json'
+
+def onnx_model_dir(model_key:str, quantize:bool = ONNX_QUANTIZE, base_dir:str = ONNX_MODEL_DIR) -> str:
+    return os.path.join(base_dir, f"{model_key}-int8" if quantize else model_key)
+
+def export_onnx_model(model_key:str, quantize:bool = ONNX_QUANTIZE, base_dir:str = ONNX_MODEL_DIR) -> str:
+    """Export the transformer behind a registered SentenceTransformer to ONNX, optionally int8-quantized"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    spec = EMBEDDING_MODELS[model_key]
+    output_dir = onnx_model_dir(model_key, quantize, base_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    st_model = SentenceTransformer(spec['model_name'], device='cpu')
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+    input_names = [name for name in tokenizer.model_input_names if name in ('input_ids', 'attention_mask', 'token_type_ids')]
+
+    sample = tokenizer(["export sample"], padding=True, return_tensors='pt')
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+    fp32_path = os.path.join(output_dir, 'model_fp32.onnx')
+    logger.info(f"Exporting {spec['model_name']} to {fp32_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=14
+        )
+
+    model_path = fp32_path
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        model_path = os.path.join(output_dir, 'model_int8.onnx')
+        quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+        logger.info(f"Quantized model written to {model_path}")
+
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILE), 'w') as f:
+        json.dump({
+            "model_key": model_key,
+            "model_file": os.path.basename(model_path),
+            "input_names": input_names,
+            "max_seq_length": st_model.max_seq_length
+        }, f, indent=2)
+    return output_dir
+
+class OnnxSentenceEncoder:
+    """Mean-pooled sentence embeddings from an exported model; encode() mirrors SentenceTransformer.encode"""
+
+    def __init__(self, model_dir:str, intra_op_threads:int = ONNX_INTRA_OP_THREADS):
+        if ort is None:
+            raise ImportError("ENCODER_BACKEND='onnx' requires onnxruntime: pip install onnxruntime")
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, ONNX_CONFIG_FILE)) as f:
+            self.config = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, self.config['model_file']),
+            options,
+            providers=['CPUExecutionProvider']
+        )
+        logger.info(f"Loaded ONNX encoder from {model_dir} with {intra_op_threads} threads")
+
+    def encode(self, texts:List[str], batch_size:int = 64, normalize_embeddings:bool = False, show_progress_bar:bool = False) -> np.ndarray:
+        # Batch texts of similar length together to minimise padding
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            batch = [texts[i] for i in order[start:start + batch_size]]
+            tokens = self.tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=self.config['max_seq_length'],
+                return_tensors='np'
+            )
+            feeds = {name: tokens[name].astype(np.int64) for name in self.config['input_names']}
+            hidden = self.session.run(None, feeds)[0]
+            mask = tokens['attention_mask'][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            outputs.append(pooled.astype(np.float32))
+            if show_progress_bar:
+                logger.info(f"Encoded {min(start + batch_size, len(texts))}/{len(texts)}")
+
+        embeddings = np.zeros((len(texts), outputs[0].shape[1]) if outputs else (0, 0), dtype=np.float32)
+        if outputs:
+            embeddings[order] = np.concatenate(outputs)
+        if normalize_embeddings and len(embeddings):
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings
+
+def load_onnx_encoder(model_key:str, quantize:bool = ONNX_QUANTIZE) -> OnnxSentenceEncoder:
+    """Load an already exported model; exporting needs torch, so it is never done implicitly in a serving process"""
+    model_dir = onnx_model_dir(model_key, quantize)
+    if not os.path.exists(os.path.join(model_dir, ONNX_CONFIG_FILE)):
+        flag = "" if quantize else " --no-quantize"
+        raise FileNotFoundError(f"No ONNX export of {model_key} in {model_dir}; run `python onnx_encoder.py export --model {model_key}{flag}` first")
+    return OnnxSentenceEncoder(model_dir)
+
+def check_parity(model_key:str, texts:List[str], quantize:bool = ONNX_QUANTIZE) -> Dict[str, float]:
+    """Cosine similarity between PyTorch and ONNX embeddings of the same texts"""
+    from sentence_transformers import SentenceTransformer
+    reference = SentenceTransformer(EMBEDDING_MODELS[model_key]['model_name'], device='cpu').encode(texts, normalize_embeddings=True)
+    candidate = load_onnx_encoder(model_key, quantize).encode(texts, normalize_embeddings=True)
+    cosine = (reference * candidate).sum(axis=1)
+    return {"min_cosine": float(cosine.min()), "mean_cosine": float(cosine.mean())}
+
+def benchmark_backends(model_key:str, texts:List[str], batch_size:int = 64) -> List[Dict[str, Any]]:
+    """Throughput and resident memory of each backend encoding the same texts"""
+    import psutil
+    from sentence_transformers import SentenceTransformer
+
+    process = psutil.Process()
+    rows = []
+    backends = [
+        ("torch", lambda: SentenceTransformer(EMBEDDING_MODELS[model_key]['model_name'], device='cpu')),
+        ("onnx-fp32", lambda: load_onnx_encoder(model_key, quantize=False)),
+        ("onnx-int8", lambda: load_onnx_encoder(model_key, quantize=True))
+    ]
+    for name, load in backends:
+        rss_before = process.memory_info().rss
+        encoder = load()
+        encoder.encode(texts[:batch_size], batch_size=batch_size)
+        started = time.perf_counter()
+        encoder.encode(texts, batch_size=batch_size)
+        elapsed = time.perf_counter() - started
+        rows.append({
+            "backend": name,
+            "texts_per_second": len(texts) / elapsed,
+            "model_rss_mb": (process.memory_info().rss - rss_before) / (1024 * 1024)
+        })
+        del encoder
+    return rows
+
+def sample_texts(n_texts:int) -> List[str]:
+    words = "the old captain watched the storm roll over the harbour while the village slept".split()
+    rng = np.random.default_rng(0)
+    return [" ".join(rng.choice(words, size=rng.integers(8, 200))) for _ in range(n_texts)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ONNX Runtime encoder: export, parity check and benchmark")
+    parser.add_argument("command", choices=["export", "parity", "benchmark"])
+    parser.add_argument("--model", default=ACTIVE_EMBEDDING_MODEL, choices=sorted(EMBEDDING_MODELS))
+    parser.add_argument("--no-quantize", action="store_true")
+    parser.add_argument("--n-texts", type=int, default=512)
+    args = parser.parse_args()
+
+    quantize = not args.no_quantize
+    if args.command == "export":
+        print(export_onnx_model(args.model, quantize))
+    elif args.command == "parity":
+        print(check_parity(args.model, sample_texts(args.n_texts), quantize))
+    else:
+        for row in benchmark_backends(args.model, sample_texts(args.n_texts)):
+            print(f"{row['backend']:>10} {row['texts_per_second']:>10.1f} texts/s {row['model_rss_mb']:>8.1f} MB")
@@ -0,0 +1,75 @@
+import base64
+import json
+import logging
+import time
+import uuid
+from typing import List, Optional, Tuple
+from shared_state import SqliteConnections
+from config import SNAPSHOT_TTL, SNAPSHOT_CACHE_SIZE, SHARED_STATE_PATH
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+Ranking = List[Tuple[str, float]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ranking_snapshots (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    query TEXT NOT NULL,
+    ranking TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ranking_snapshots_created ON ranking_snapshots (created_at);
+"""
+
+class RankingSnapshotStore:
+    """Keeps the (id, distance) ranking of a query so later pages read from the same order.
+
+    Snapshots live in a sqlite file shared by the workers of a host, so the next page may be
+    served by any worker.
+    """
+
+    def __init__(self, path:str = SHARED_STATE_PATH, max_snapshots:int = SNAPSHOT_CACHE_SIZE, ttl:float = SNAPSHOT_TTL):
+        self.max_snapshots = max_snapshots
+        self.ttl = ttl
+        self._connection = SqliteConnections(path, SCHEMA)
+
+    def create(self, query:str, ranking:Ranking) -> str:
+        snapshot_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connection.transaction() as connection:
+            connection.execute(
+                "INSERT INTO ranking_snapshots (id, created_at, query, ranking) VALUES (?, ?, ?, ?)",
+                (snapshot_id, now, query, json.dumps(ranking))
+            )
+            connection.execute("DELETE FROM ranking_snapshots WHERE created_at < ?", (now - self.ttl,))
+            connection.execute(
+                "DELETE FROM ranking_snapshots WHERE id NOT IN (SELECT id FROM ranking_snapshots ORDER BY created_at DESC LIMIT ?)",
+                (self.max_snapshots,)
+            )
+        logger.info(f"Created ranking snapshot {snapshot_id} with {len(ranking)} results")
+        return snapshot_id
+
+    def get(self, snapshot_id:str) -> Optional[Tuple[str, Ranking]]:
+        row = self._connection().execute(
+            "SELECT created_at, query, ranking FROM ranking_snapshots WHERE id = ?", (snapshot_id,)
+        ).fetchone()
+        if row is None or time.time() - row[0] > self.ttl:
+            return None
+        return row[1], [tuple(item) for item in json.loads(row[2])]
+
+def encode_cursor(snapshot_id:str, offset:int) -> str:
+    raw = f"{snapshot_id}:{offset}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor:str) -> Tuple[str, int]:
+    """Return (snapshot_id, offset); raises ValueError for malformed cursors"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        snapshot_id, offset = base64.urlsafe_b64decode(padded).decode().split(":")
+        offset = int(offset)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if offset < 0:
+        raise ValueError(f"Invalid cursor offset: {offset}")
+    return snapshot_id, offset
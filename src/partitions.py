@@ -0,0 +1,475 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+from collections import Counter, defaultdict
+from typing import List, Dict, Optional, Any, Tuple
+from vector_store import VectorStore
+from deadlines import Deadline, DeadlineExceeded, check_deadline
+from jobs import JobContext
+from embedding_models import read_active_collection
+from shared_state import WriteClock
+from config import (
+    PARTITION_FIELDS,
+    PARTITION_DIRNAME,
+    PARTITION_MIN_SIZE,
+    PARTITION_MAX_SHARE,
+    PARTITION_RECOUNT_INTERVAL,
+    EXACT_MAX_CANDIDATES,
+    ACTIVE_POINTER_CHECK_INTERVAL,
+    BULK_BATCH_SIZE
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def manifest_path(db_path:str, collection_name:str) -> str:
+    return os.path.join(db_path, PARTITION_DIRNAME, f"{collection_name}.json")
+
+def read_partition_manifest(db_path:str, collection_name:str) -> Optional[Dict[str, Any]]:
+    path = manifest_path(db_path, collection_name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def write_partition_manifest(db_path:str, collection_name:str, manifest:Dict[str, Any]) -> None:
+    path = manifest_path(db_path, collection_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+def partition_collection_name(collection_name:str, field:str, value:str, build_id:str) -> str:
+    # Chroma names are limited to 63 safe characters, and values are arbitrary author names
+    digest = hashlib.sha1(f"{collection_name}|{field}|{value}|{build_id}".encode()).hexdigest()[:16]
+    return f"partition_{digest}"
+
+class FilterStats:
+    """Row counts per value of the partition fields, used to estimate how many rows a where filter keeps"""
+
+    def __init__(self, counts:Optional[Dict[str, Dict[str, int]]] = None, total:int = 0):
+        self.counts = defaultdict(Counter, {field: Counter(values) for field, values in (counts or {}).items()})
+        self.total = total
+
+    def add(self, metadatas:List[Optional[Dict[str, Any]]], sign:int = 1) -> None:
+        for metadata in metadatas:
+            self.total += sign
+            for field in PARTITION_FIELDS:
+                value = (metadata or {}).get(field)
+                if value is not None:
+                    self.counts[field][str(value)] += sign
+
+    def count(self, field:str, value:Any) -> int:
+        if field not in PARTITION_FIELDS:
+            # No statistics for this field: assume it keeps everything
+            return self.total
+        return max(0, self.counts[field].get(str(value), 0))
+
+    def estimate(self, where:Optional[Dict[str, Any]]) -> int:
+        """Upper bound on the rows a Chroma where filter matches"""
+        if not where:
+            return self.total
+        bounds = []
+        for key, condition in where.items():
+            if key == '$and':
+                bounds.append(min(self.estimate(clause) for clause in condition))
+            elif key == '$or':
+                bounds.append(min(self.total, sum(self.estimate(clause) for clause in condition)))
+            elif isinstance(condition, dict):
+                for operator, operand in condition.items():
+                    if operator == '$eq':
+                        bounds.append(self.count(key, operand))
+                    elif operator == '$in':
+                        bounds.append(min(self.total, sum(self.count(key, value) for value in operand)))
+                    else:
+                        bounds.append(self.total)
+            else:
+                bounds.append(self.count(key, condition))
+        return min(bounds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"total": self.total, "counts": {field: dict(values) for field, values in self.counts.items()}}
+
+def equality_terms(where:Dict[str, Any]) -> List[Tuple[str, str]]:
+    """(field, value) pairs every matching row must have, which a partition can serve on its own"""
+    terms = []
+    for key, condition in where.items():
+        if key == '$and':
+            for clause in condition:
+                terms.extend(equality_terms(clause))
+        elif isinstance(condition, dict):
+            if '$eq' in condition:
+                terms.append((key, str(condition['$eq'])))
+        elif not key.startswith('$'):
+            terms.append((key, str(condition)))
+    return terms
+
+def count_filter_values(store:Any, job:Optional[JobContext] = None, batch_size:int = BULK_BATCH_SIZE) -> FilterStats:
+    stats = FilterStats()
+    for batch in store.iter_documents(batch_size, ["metadatas"]):
+        stats.add(batch['metadatas'])
+        if job:
+            job.throttle(0)
+    return stats
+
+def build_partitions(store:Any, job:Optional[JobContext] = None, batch_size:int = BULK_BATCH_SIZE) -> Dict[str, Any]:
+    """Count filter values over a collection and copy the vectors of large, selective values into sub-collections.
+
+    Values with fewer than PARTITION_MIN_SIZE rows are cheaper to score exactly, and values covering
+    more than PARTITION_MAX_SHARE of the collection gain little from a graph of their own, so small
+    collections get no partitions and their filters are planned from the counts alone. Vectors and
+    metadata are copied without re-embedding; partitions read the texts of the collection they were cut from.
+    """
+    started = time.perf_counter()
+    if hasattr(store, 'flush'):
+        store.flush()
+    db_path, collection_name = store.db_path, store.collection_name
+    if job:
+        job.stage("counting")
+    # Writes after this moment may be missing from the counts, so they trigger a recount
+    counted_at = time.time()
+    stats = count_filter_values(store, job, batch_size)
+
+    chosen = {
+        (field, value): count
+        for field, values in stats.counts.items()
+        for value, count in values.items()
+        if count >= PARTITION_MIN_SIZE and count <= PARTITION_MAX_SHARE * stats.total
+    }
+    build_id = time.strftime('%Y%m%d%H%M%S')
+    partitions = {
+        key: VectorStore(partition_collection_name(collection_name, *key, build_id), db_path, store.model_key, text_namespace=store.text_namespace)
+        for key in chosen
+    }
+    logger.info(f"Partitioning {collection_name}: {len(partitions)} of {sum(len(values) for values in stats.counts.values())} filter values")
+    if stats.total < PARTITION_MIN_SIZE / PARTITION_MAX_SHARE:
+        logger.info(f"{collection_name} has {stats.total} rows, fewer than the {PARTITION_MIN_SIZE / PARTITION_MAX_SHARE:.0f} partitions need; filters use exact scoring or the index")
+
+    if partitions:
+        if job:
+            job.stage("copying", total=stats.total)
+        pending = defaultdict(lambda: ([], [], []))
+        copied = 0
+        for batch in store.iter_documents(batch_size, ["metadatas", "embeddings"]):
+            if job:
+                job.throttle(len(batch['ids']))
+            for doc_id, embedding, metadata in zip(batch['ids'], batch['embeddings'], batch['metadatas']):
+                for field in PARTITION_FIELDS:
+                    key = (field, str((metadata or {}).get(field)))
+                    if key in partitions:
+                        ids, embeddings, metadatas = pending[key]
+                        ids.append(doc_id)
+                        embeddings.append(list(embedding))
+                        metadatas.append(metadata)
+            for key, (ids, embeddings, metadatas) in list(pending.items()):
+                if len(ids) >= batch_size:
+                    partitions[key].collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas)
+                    del pending[key]
+            copied += len(batch['ids'])
+            if job:
+                job.progress(copied)
+        for key, (ids, embeddings, metadatas) in pending.items():
+            partitions[key].collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas)
+
+    previous = read_partition_manifest(db_path, collection_name)
+    write_partition_manifest(db_path, collection_name, {
+        "collection_name": collection_name,
+        "built_at": time.time(),
+        "counted_at": counted_at,
+        **stats.to_dict(),
+        "partitions": [
+            {"field": field, "value": value, "collection_name": partitions[(field, value)].collection_name, "count": count}
+            for (field, value), count in sorted(chosen.items())
+        ]
+    })
+    # Readers switch to the new manifest within ACTIVE_POINTER_CHECK_INTERVAL and fall back to the index meanwhile
+    for partition in (previous or {}).get('partitions', []):
+        try:
+            store.client.delete_collection(partition['collection_name'])
+        except Exception as e:
+            logger.error(f"Error dropping old partition {partition['collection_name']}: {e}")
+    if hasattr(store, 'reload_partitions'):
+        store.reload_partitions()
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Built {len(partitions)} partitions for {collection_name} in {elapsed:.1f}s")
+    return {
+        "collection_name": collection_name,
+        "rows": stats.total,
+        "partitions": len(partitions),
+        "partitioned_rows": sum(chosen.values()),
+        "seconds": round(elapsed, 2)
+    }
+
+def partition_job(search_engine, job:JobContext) -> Dict[str, Any]:
+    if search_engine.sharded:
+        raise ValueError("Filter partitions are built for unsharded collections; language shards already partition by language")
+    return build_partitions(search_engine.vector_store, job)
+
+class PartitionedStore:
+    """Plans filtered queries: exact scoring, a per-value partition, or the global index.
+
+    The planner estimates how many rows a where filter keeps from value counts gathered when the
+    partitions were built, adjusted by this process's writes and recounted in the background once
+    another worker wrote the collection. A few thousand candidates are
+    scored exactly, which is faster and has full recall; a large but selective value is searched in
+    its own HNSW graph; anything else goes to the global index with the filter pushed down.
+    Writes are mirrored into the partitions; if mirroring fails the partitions are set aside
+    until the next build so no stale rows are served.
+    """
+
+    def __init__(self, store:Any):
+        self.store = store
+        self.counters = {"index": 0, "partition": 0, "exact": 0, "fallbacks": 0}
+        self._lock = threading.Lock()
+        self._manifest_mtime = None
+        self._last_check = 0.0
+        self._last_recount = 0.0
+        self._recounting = False
+        self.write_clock = WriteClock()
+        self.reload_partitions()
+
+    def __getattr__(self, name:str) -> Any:
+        return getattr(self.store, name)
+
+    def reload_partitions(self) -> None:
+        path = manifest_path(self.store.db_path, self.store.collection_name)
+        manifest = read_partition_manifest(self.store.db_path, self.store.collection_name)
+        self.manifest = manifest
+        self.stats = FilterStats(manifest['counts'], manifest['total']) if manifest else None
+        self.counted_at = manifest.get('counted_at', manifest['built_at']) if manifest else 0.0
+        self.partitions = {}
+        for partition in (manifest or {}).get('partitions', []):
+            try:
+                self.partitions[(partition['field'], partition['value'])] = VectorStore(partition['collection_name'], self.store.db_path, self.store.model_key, text_namespace=self.store.text_namespace)
+            except Exception as e:
+                logger.error(f"Error opening partition {partition['collection_name']}: {e}")
+        self._manifest_mtime = os.path.getmtime(path) if manifest else None
+        self._last_check = time.monotonic()
+        if manifest:
+            logger.info(f"Loaded filter statistics for {self.store.collection_name}: {len(self.partitions)} partitions")
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._last_check < ACTIVE_POINTER_CHECK_INTERVAL:
+            return
+        self._last_check = now
+        path = manifest_path(self.store.db_path, self.store.collection_name)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if mtime != self._manifest_mtime:
+            self.reload_partitions()
+        # Writes of other workers never reach this process's counts
+        if self.stats is not None and not self._recounting and now - self._last_recount >= PARTITION_RECOUNT_INTERVAL:
+            if self.write_clock.last(self.store.collection_name) > self.counted_at:
+                self._recounting = True
+                self._last_recount = now
+                threading.Thread(target=self._recount, name="partition-recount", daemon=True).start()
+
+    def _recount(self) -> None:
+        try:
+            counted_at = time.time()
+            stats = count_filter_values(self.store)
+            with self._lock:
+                self.stats, self.counted_at = stats, counted_at
+            logger.info(f"Recounted filter values of {self.store.collection_name}: {stats.total} rows")
+        except Exception as e:
+            logger.error(f"Error recounting filter values: {e}")
+        finally:
+            self._recounting = False
+
+    def plan(self, where:Optional[Dict[str, Any]]) -> Tuple[str, Optional[VectorStore], Optional[int]]:
+        """('exact' | 'partition' | 'index', partition store, estimated matches) for a where filter"""
+        self._refresh()
+        stats = self.stats
+        if not where or stats is None:
+            return "index", None, None
+        # Counts change under writes from request threads and the buffer's flush thread
+        with self._lock:
+            estimate = stats.estimate(where)
+            candidates = [(stats.count(*term), term) for term in equality_terms(where) if term in self.partitions]
+        if estimate <= EXACT_MAX_CANDIDATES:
+            return "exact", None, estimate
+        if candidates:
+            # The smallest partition that every match must belong to
+            return "partition", self.partitions[min(candidates)[1]], estimate
+        return "index", None, estimate
+
+    def _count(self, plan:str) -> None:
+        with self._lock:
+            self.counters[plan] += 1
+
+    def search_by_embedding(self, query_embedding:List[float], n_results:int = 5, where:Optional[Dict[str, Any]] = None, include:Optional[List[str]] = None, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None) -> Dict[str, Any]:
+
+        plan, partition, estimate = self.plan(where)
+        self._count(plan)
+        if plan == "exact":
+            try:
+                return self._search_exact(query_embedding, n_results, where, include or ["metadatas", "documents", "distances"], deadline)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                logger.error(f"Error scoring filtered candidates exactly: {e}")
+                self._count("fallbacks")
+        elif plan == "partition":
+            result = partition.search_by_embedding(query_embedding, n_results, where=where, include=include, search_ef=search_ef, deadline=deadline)
+            if result:
+                return result
+            self._count("fallbacks")
+        return self.store.search_by_embedding(query_embedding, n_results, where=where, include=include, search_ef=search_ef, deadline=deadline)
+
+    def _search_exact(self, query_embedding:List[float], n_results:int, where:Dict[str, Any], include:List[str], deadline:Optional[Deadline]) -> Dict[str, Any]:
+        check_deadline(deadline, "fetching filtered candidates")
+        candidates = self.store.get_embeddings(where=where)
+        if not candidates or not candidates.get('ids'):
+            return {'ids': [[]], 'distances': [[]], 'metadatas': [[]], 'documents': [[]] if "documents" in include else None, 'embeddings': None}
+        matrix = np.asarray(candidates['embeddings'], dtype=np.float32)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        # Squared L2 like Chroma, so exact and index answers rank on the same scale
+        distances = np.sum((matrix - query) ** 2, axis=1)
+        n_results = min(n_results, len(distances))
+        top = np.argpartition(distances, n_results - 1)[:n_results]
+        top = top[np.argsort(distances[top])]
+        ids = [candidates['ids'][i] for i in top]
+        documents = None
+        if "documents" in include:
+            check_deadline(deadline, "fetching documents")
+            fetched = self.store.get_documents_by_ids(ids, include=["documents"])
+            by_id = dict(zip(fetched.get('ids', []), fetched.get('documents') or []))
+            documents = [[by_id.get(doc_id, '') for doc_id in ids]]
+        return {
+            'ids': [ids],
+            'distances': [distances[top].tolist()],
+            'metadatas': [[candidates['metadatas'][i] for i in top]],
+            'documents': documents,
+            'embeddings': [matrix[top]] if "embeddings" in include else None
+        }
+
+    def search_by_text(self, query_text:str, n_results:int = 5, include:Optional[List[str]] = None, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None) -> Dict[str, Any]:
+        return self.store.search_by_text(query_text, n_results, include=include, search_ef=search_ef, deadline=deadline)
+
+    def search_by_metadata(self, metadata_filter:Dict[str, str], n_results:int = 5) -> Dict[str, Any]:
+
+        try:
+            logger.info(f"Searching with metadata filter: {metadata_filter}")
+            return self.search_by_embedding(self.store.embed_texts([""])[0], n_results, where=metadata_filter)
+        except Exception as e:
+            logger.error(f"Error searching by metadata: {e}")
+            return {}
+
+    # Writes
+
+    def _previous_metadatas(self, doc_ids:List[str]) -> List[Dict[str, Any]]:
+        if self.stats is None:
+            return []
+        result = self.store.get_documents_by_ids(doc_ids, include=["metadatas"])
+        return (result or {}).get('metadatas') or []
+
+    def _mirror(self, doc_ids:List[str], embeddings:Any, metadatas:List[Dict[str, Any]], previous:List[Dict[str, Any]]) -> None:
+        """Apply written rows to the counts and to every partition; rows may have moved between values"""
+        stats = self.stats
+        if stats is not None:
+            with self._lock:
+                stats.add(previous, sign=-1)
+                stats.add(metadatas)
+        if not self.partitions:
+            return
+        try:
+            for key, partition in self.partitions.items():
+                partition.collection.delete(ids=doc_ids)
+                rows = [i for i, metadata in enumerate(metadatas) if str((metadata or {}).get(key[0])) == key[1]]
+                if rows:
+                    partition.collection.upsert(
+                        ids=[doc_ids[i] for i in rows],
+                        embeddings=[list(embeddings[i]) for i in rows],
+                        metadatas=[metadatas[i] for i in rows]
+                    )
+        except Exception as e:
+            logger.error(f"Error mirroring writes into partitions, serving filters from the index until the next build: {e}")
+            self.partitions = {}
+
+    def _mirror_from_store(self, doc_ids:List[str], previous:List[Dict[str, Any]]) -> None:
+        # Vectors were computed inside the wrapped store, so read them back for the partitions
+        if self.stats is None:
+            return
+        written = self.store.get_embeddings(doc_ids)
+        if written and written.get('ids'):
+            self._mirror(written['ids'], written['embeddings'], written['metadatas'], previous)
+
+    def _drop(self, doc_ids:List[str], previous:List[Dict[str, Any]]) -> None:
+        stats = self.stats
+        if stats is not None:
+            with self._lock:
+                stats.add(previous, sign=-1)
+        try:
+            for partition in self.partitions.values():
+                partition.collection.delete(ids=doc_ids)
+        except Exception as e:
+            logger.error(f"Error deleting from partitions, serving filters from the index until the next build: {e}")
+            self.partitions = {}
+
+    def write_records(self, doc_ids:List[str], embeddings:Any, metadatas:List[Dict[str, Any]], documents:List[str], method:str = "upsert") -> None:
+        previous = self._previous_metadatas(doc_ids)
+        self.store.write_records(doc_ids, embeddings, metadatas, documents, method=method)
+        self._mirror(doc_ids, embeddings, metadatas, previous)
+
+    def upsert_documents(self, doc_ids:List[str], documents:List[str], metadatas:List[Dict[str, str]], *args:Any, **kwargs:Any) -> Dict[str, int]:
+        previous = self._previous_metadatas(doc_ids)
+        stats = self.store.upsert_documents(doc_ids, documents, metadatas, *args, **kwargs)
+        self._mirror_from_store(doc_ids, previous)
+        return stats
+
+    def update_document(self, doc_id:str, document:str, metadata:Dict[str, str]) -> bool:
+        previous = self._previous_metadatas([doc_id])
+        updated = self.store.update_document(doc_id, document, metadata)
+        if updated:
+            self._mirror_from_store([doc_id], previous)
+        return updated
+
+    def delete_documents(self, doc_ids:List[str], *args:Any, **kwargs:Any) -> int:
+        previous = self._previous_metadatas(doc_ids)
+        deleted = self.store.delete_documents(doc_ids, *args, **kwargs)
+        self._drop(doc_ids, previous)
+        return deleted
+
+    def delete_document(self, doc_id:str) -> bool:
+        previous = self._previous_metadatas([doc_id])
+        deleted = self.store.delete_document(doc_id)
+        if deleted:
+            self._drop([doc_id], previous)
+        return deleted
+
+    def partition_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+            rows = self.stats.total if self.stats else None
+        manifest = self.manifest or {}
+        return {
+            "collection_name": self.store.collection_name,
+            "built_at": manifest.get('built_at'),
+            "counted_at": self.counted_at,
+            "rows": rows,
+            "partitions": [
+                {**partition, "active": (partition['field'], partition['value']) in self.partitions}
+                for partition in manifest.get('partitions', [])
+            ],
+            "exact_max_candidates": EXACT_MAX_CANDIDATES,
+            "plans": counters
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count filter values and build per-value partitions of a collection")
+    parser.add_argument("--db-path", default="./chroma_db")
+    parser.add_argument("--collection", default=None, help="defaults to the active collection")
+    args = parser.parse_args()
+
+    collection_name = args.collection
+    if collection_name is None:
+        pointer = read_active_collection(args.db_path)
+        collection_name = pointer['collection_name'] if pointer else "books_story"
+    print(json.dumps(build_partitions(VectorStore(collection_name, args.db_path)), indent=2))
@@ -0,0 +1,220 @@
+import logging
+import threading
+import time
+import numpy as np
+from typing import List, Dict, Optional, Any, Tuple
+from jobs import JobContext
+from config import (
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_CLUSTERS,
+    SEMANTIC_CACHE_TOP_K,
+    SEMANTIC_CACHE_MIN_CLUSTER_SIZE,
+    SEMANTIC_CACHE_MIN_QUERIES,
+    SEMANTIC_CACHE_LOG_SIZE,
+    KMEANS_BATCH_SIZE,
+    KMEANS_ITERATIONS
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _unit(vectors:np.ndarray) -> np.ndarray:
+    return vectors / np.clip(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12, None)
+
+def mini_batch_kmeans(vectors:np.ndarray, k:int, batch_size:int = KMEANS_BATCH_SIZE, iterations:int = KMEANS_ITERATIONS, seed:int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Spherical mini-batch k-means (Sculley 2010) on unit vectors; returns unit centroids and labels.
+
+    Centroids start on randomly drawn queries, so frequent intents are the likeliest seeds.
+    Each centroid moves towards its batch members with a step of 1/(points seen so far).
+    """
+    rng = np.random.default_rng(seed)
+    points = _unit(np.asarray(vectors, dtype=np.float32))
+    k = min(k, len(points))
+    centroids = points[rng.choice(len(points), k, replace=False)].copy()
+    seen = np.zeros(k, dtype=np.float64)
+
+    for _ in range(iterations):
+        batch = points[rng.integers(0, len(points), min(batch_size, len(points)))]
+        nearest = np.argmax(batch @ centroids.T, axis=1)
+        members = np.bincount(nearest, minlength=k).astype(np.float64)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, nearest, batch)
+        moved = members > 0
+        seen[moved] += members[moved]
+        step = (members[moved] / seen[moved])[:, None].astype(np.float32)
+        centroids[moved] = _unit((1 - step) * centroids[moved] + step * sums[moved] / members[moved][:, None].astype(np.float32))
+
+    return centroids, np.argmax(points @ centroids.T, axis=1)
+
+class QueryLog:
+    """Ring buffer of recent query embeddings fed from the search path"""
+
+    def __init__(self, capacity:int = SEMANTIC_CACHE_LOG_SIZE):
+        self.capacity = capacity
+        self._vectors = None
+        self._next = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def record(self, embedding:List[float]) -> None:
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(embedding):
+                # The model changed (or this is the first query); older vectors are not comparable
+                self._vectors = np.zeros((self.capacity, len(embedding)), dtype=np.float32)
+                self._next = self._size = 0
+            self._vectors[self._next] = embedding
+            self._next = (self._next + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def snapshot(self) -> np.ndarray:
+        with self._lock:
+            if self._vectors is None:
+                return np.zeros((0, 0), dtype=np.float32)
+            return self._vectors[:self._size].copy()
+
+    def __len__(self) -> int:
+        return self._size
+
+class SemanticQueryCache:
+    """Precomputed top-k candidates for the centroids of popular query clusters.
+
+    A query whose cosine similarity to the nearest centroid reaches the threshold is answered by
+    re-ranking that cluster's stored candidates against the query itself, skipping the index.
+    invalidate() and discard() only reach this process; writes by other workers are caught by
+    comparing snapshot_at with the shared write clock on every lookup.
+    """
+
+    def __init__(self, threshold:float = SEMANTIC_CACHE_THRESHOLD):
+        self.threshold = threshold
+        self.centroids = None
+        self.tables:List[Dict[str, Any]] = []
+        self.collection_name = None
+        self.built_at = None
+        self.snapshot_at = 0.0
+        self.generation = 0
+        self.counters = {"lookups": 0, "hits": 0, "misses": 0, "bypassed": 0, "stale": 0, "invalidations": 0}
+        self._lock = threading.Lock()
+
+    def install(self, centroids:np.ndarray, tables:List[Dict[str, Any]], collection_name:str, generation:int, snapshot_at:float) -> bool:
+        """Swap in a freshly built table unless a write invalidated the cache while it was being built"""
+        with self._lock:
+            if generation != self.generation:
+                return False
+            self.centroids, self.tables = centroids, tables
+            self.collection_name = collection_name
+            self.snapshot_at = snapshot_at
+            self.built_at = time.time()
+            return True
+
+    def invalidate(self) -> None:
+        """Drop precomputed results after writes, so deleted or changed books are never served from it"""
+        with self._lock:
+            if self.centroids is not None:
+                self.counters["invalidations"] += 1
+            self.centroids, self.tables = None, []
+            self.generation += 1
+
+    def discard(self, doc_ids:List[str]) -> None:
+        """Drop single written rows from the candidate tables without throwing the whole cache away"""
+        removed = set(doc_ids)
+        with self._lock:
+            tables = []
+            for table in self.tables:
+                keep = [i for i, doc_id in enumerate(table['ids']) if doc_id not in removed]
+                tables.append(table if len(keep) == len(table['ids']) else {
+                    'ids': [table['ids'][i] for i in keep],
+                    'embeddings': table['embeddings'][keep]
+                })
+            self.tables = tables
+            # A table being built right now may still hold the old rows
+            self.generation += 1
+
+    def _count(self, outcome:str) -> None:
+        with self._lock:
+            self.counters["lookups"] += 1
+            self.counters[outcome] += 1
+
+    def lookup(self, query_embedding:List[float], n_results:int, collection_name:str, last_write:float = 0.0) -> Optional[List[Tuple[str, float]]]:
+        """(id, distance) ranking for the query from the nearest cluster, or None on a miss.
+
+        last_write is when any worker last wrote the collection; a cache built before it is skipped.
+        """
+        centroids, tables = self.centroids, self.tables
+        if centroids is None or self.collection_name != collection_name or n_results > SEMANTIC_CACHE_TOP_K:
+            self._count("bypassed")
+            return None
+        if self.snapshot_at < last_write:
+            self._count("stale")
+            return None
+        query = np.asarray(query_embedding, dtype=np.float32)
+        similarities = centroids @ _unit(query)
+        nearest = int(np.argmax(similarities))
+        if similarities[nearest] < self.threshold:
+            self._count("misses")
+            return None
+
+        table = tables[nearest]
+        # Squared L2 like Chroma, so scores match what the index would have returned
+        distances = np.sum((table['embeddings'] - query) ** 2, axis=1)
+        order = np.argsort(distances)[:n_results]
+        self._count("hits")
+        return [(table['ids'][i], float(distances[i])) for i in order]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+            clusters = 0 if self.centroids is None else len(self.centroids)
+        answered = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "hit_rate": round(counters["hits"] / counters["lookups"], 4) if counters["lookups"] else 0.0,
+            "hit_rate_when_built": round(counters["hits"] / answered, 4) if answered else 0.0,
+            "clusters": clusters,
+            "threshold": self.threshold,
+            "collection_name": self.collection_name,
+            "built_at": self.built_at,
+            "snapshot_at": self.snapshot_at
+        }
+
+def build_query_cache(search_engine, job:JobContext, clusters:int = SEMANTIC_CACHE_CLUSTERS, top_k:int = SEMANTIC_CACHE_TOP_K) -> Dict[str, Any]:
+    """Cluster logged query embeddings and precompute top-k candidates for every popular centroid"""
+    started = time.perf_counter()
+    generation = search_engine.semantic_cache.generation
+    # Taken before the first search, so a write racing the build marks the cache stale
+    snapshot_at = time.time()
+    job.stage("clustering")
+    vectors = search_engine.query_log.snapshot()
+    if len(vectors) < SEMANTIC_CACHE_MIN_QUERIES:
+        raise ValueError(f"Only {len(vectors)} queries logged, need {SEMANTIC_CACHE_MIN_QUERIES} to cluster")
+    centroids, labels = mini_batch_kmeans(vectors, clusters)
+    sizes = np.bincount(labels, minlength=len(centroids))
+    popular = np.flatnonzero(sizes >= SEMANTIC_CACHE_MIN_CLUSTER_SIZE)
+    job.registry.count(job.job_id, queries=len(vectors), clusters=len(popular))
+
+    store = search_engine.vector_store
+    job.stage("precomputing", total=len(popular))
+    kept, tables = [], []
+    for done, cluster in enumerate(popular, 1):
+        job.throttle(1)
+        # Search from the members' mean in embedding space; the unit centroid only routes lookups
+        probe = vectors[labels == cluster].mean(axis=0)
+        result = store.search_by_embedding(probe.tolist(), top_k, include=["distances", "embeddings"])
+        if result and result.get('ids') and result['ids'][0]:
+            kept.append(cluster)
+            tables.append({
+                'ids': list(result['ids'][0]),
+                'embeddings': np.asarray(result['embeddings'][0], dtype=np.float32)
+            })
+        job.progress(done, precomputed=len(tables))
+
+    if not search_engine.semantic_cache.install(centroids[kept], tables, store.collection_name, generation, snapshot_at):
+        raise RuntimeError("Collection was written to while the cache was being built; run the job again")
+    elapsed = time.perf_counter() - started
+    logger.info(f"Semantic cache built: {len(tables)} clusters from {len(vectors)} queries in {elapsed:.1f}s")
+    return {
+        "collection_name": store.collection_name,
+        "queries": len(vectors),
+        "clusters": len(tables),
+        "largest_cluster": int(sizes.max()),
+        "seconds": round(elapsed, 2)
+    }
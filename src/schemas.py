@@ -0,0 +1,234 @@
+from typing import List, Dict, Optional, Any, Literal
+from pydantic import BaseModel, Field
+from config import (
+    DEFAULT_RESULTS_COUNT,
+    MAX_API_RESULTS,
+    MAX_PAGE_SIZE,
+    MAX_SNAPSHOT_RESULTS,
+    MAX_BULK_DOCUMENTS,
+    MAX_PREVIEW_CHARS,
+    MMR_LAMBDA,
+    MMR_CANDIDATE_POOL,
+    MAX_MMR_CANDIDATES,
+    DEFAULT_QUERY_TIER
+)
+
+class SearchRequest(BaseModel):
+    query:str
+    n_results:int = Field(default=DEFAULT_RESULTS_COUNT, ge=1, le=MAX_API_RESULTS)
+    author:Optional[str] = None
+    language:Optional[str] = None
+    diversify:bool = False
+    mmr_lambda:float = Field(default=MMR_LAMBDA, ge=0, le=1)
+    candidate_pool:int = Field(default=MMR_CANDIDATE_POOL, ge=1, le=MAX_MMR_CANDIDATES)
+    tier:str = DEFAULT_QUERY_TIER
+    # Only the first preview_chars of each text; None returns full texts
+    preview_chars:Optional[int] = Field(default=None, ge=0, le=MAX_PREVIEW_CHARS)
+
+class PageRequest(BaseModel):
+    query:str
+    limit:int = Field(default=DEFAULT_RESULTS_COUNT, ge=1, le=MAX_PAGE_SIZE)
+    cursor:Optional[str] = None
+    max_results:int = Field(default=MAX_SNAPSHOT_RESULTS, ge=1, le=MAX_SNAPSHOT_RESULTS)
+    # Applied when the ranking is snapshotted; later pages follow the cursor's snapshot
+    author:Optional[str] = None
+    language:Optional[str] = None
+    tier:str = DEFAULT_QUERY_TIER
+
+class StreamRequest(BaseModel):
+    query:str
+    n_results:int = Field(default=MAX_SNAPSHOT_RESULTS, ge=1, le=MAX_SNAPSHOT_RESULTS)
+    author:Optional[str] = None
+    language:Optional[str] = None
+    tier:str = DEFAULT_QUERY_TIER
+
+class DocumentRecord(BaseModel):
+    id:str
+    content:str
+    bookno:Optional[str] = None
+    title:Optional[str] = None
+    author:Optional[str] = None
+    language:Optional[str] = None
+
+class DocumentUpdate(BaseModel):
+    content:str
+    bookno:Optional[str] = None
+    title:Optional[str] = None
+    author:Optional[str] = None
+    language:Optional[str] = None
+
+class BulkUpsertRequest(BaseModel):
+    documents:List[DocumentRecord] = Field(min_length=1, max_length=MAX_BULK_DOCUMENTS)
+
+class BulkDeleteRequest(BaseModel):
+    ids:List[str] = Field(min_length=1, max_length=MAX_BULK_DOCUMENTS)
+
+class MigrationRequest(BaseModel):
+    model_key:str
+
+class JobRequest(BaseModel):
+    type:Literal["ingest", "reindex", "query_cache", "partitions", "shared_index"]
+
+class ActiveCollection(BaseModel):
+    collection_name:str
+    embedding_model:Optional[str] = None
+    migration:Optional[Dict[str, Any]] = None
+
+class JobStatus(BaseModel):
+    id:str
+    type:str
+    status:str
+    total:int
+    processed:int
+    created_at:float
+    started_at:Optional[float] = None
+    finished_at:Optional[float] = None
+    result:Optional[Any] = None
+    error:Optional[str] = None
+    stage:Optional[str] = None
+    counters:Dict[str, int] = {}
+    eta_seconds:Optional[float] = None
+    cancel_requested:bool = False
+
+class BookResponse(BaseModel):
+    id:Optional[str] = None
+    title:Optional[str] = None
+    author:Optional[str] = None
+    bookno:Optional[str] = None
+    language:Optional[str] = None
+    similarity_score:Optional[float] = None
+    document_preview:str
+
+class SearchResponse(BaseModel):
+    results:List[BookResponse]
+    total_found:int
+    query:str
+    tier:Optional[str] = None
+    degraded:bool = False
+    degraded_reasons:List[str] = []
+    elapsed_ms:Optional[float] = None
+
+class Suggestion(BaseModel):
+    value:str
+    field:str
+    count:int
+    match:Literal["prefix", "reordered", "fuzzy"]
+    score:float
+
+class SuggestResponse(BaseModel):
+    query:str
+    field:Optional[str] = None
+    suggestions:List[Suggestion]
+
+class PageResponse(BaseModel):
+    results:List[BookResponse]
+    total_found:int
+    query:str
+    offset:int
+    next_cursor:Optional[str] = None
+    tier:Optional[str] = None
+    degraded:bool = False
+    degraded_reasons:List[str] = []
+    elapsed_ms:Optional[float] = None
+
+class CollectionStats(BaseModel):
+    total_books:int 
+    collection_name:str
+    database_path:str
+
+class QueryCacheStats(BaseModel):
+    lookups:int
+    hits:int
+    misses:int
+    bypassed:int
+    invalidations:int
+    hit_rate:float
+    hit_rate_when_built:float
+    clusters:int
+    threshold:float
+    collection_name:Optional[str] = None
+    built_at:Optional[float] = None
+    logged_queries:int
+
+class LastFlush(BaseModel):
+    at:float
+    rows:int
+    upserted:int
+    deleted:int
+    seconds:float
+
+class WriteBufferStats(BaseModel):
+    enabled:bool
+    collection_name:Optional[str] = None
+    pending:int = 0
+    pending_deletes:int = 0
+    flushing:int = 0
+    oldest_pending_seconds:Optional[float] = None
+    wal_segments:int = 0
+    wal_bytes:int = 0
+    flush_interval:Optional[float] = None
+    max_size:Optional[int] = None
+    last_flush:Optional[LastFlush] = None
+    buffered_writes:int = 0
+    flushes:int = 0
+    flushed_rows:int = 0
+    failed_flushes:int = 0
+    replayed:int = 0
+
+class DiskCacheKind(BaseModel):
+    entries:int
+    bytes:int
+
+class DiskCacheStats(BaseModel):
+    enabled:bool
+    path:Optional[str] = None
+    max_bytes:int = 0
+    entries:int = 0
+    bytes:int = 0
+    kinds:Dict[str, DiskCacheKind] = {}
+    hit_rate:float = 0.0
+    hits:int = 0
+    misses:int = 0
+    writes:int = 0
+    evicted:int = 0
+    errors:int = 0
+
+class PartitionInfo(BaseModel):
+    field:str
+    value:str
+    collection_name:str
+    count:int
+    active:bool
+
+class PartitionStats(BaseModel):
+    enabled:bool
+    collection_name:Optional[str] = None
+    built_at:Optional[float] = None
+    rows:Optional[int] = None
+    partitions:List[PartitionInfo] = []
+    exact_max_candidates:int = 0
+    plans:Dict[str, int] = {}
+
+class FlushResult(BaseModel):
+    flushed:int
+    upserted:int = 0
+    deleted:int = 0
+    seconds:float = 0.0
+    error:Optional[str] = None
+
+def format_book(result:Dict[str, Any]) -> Dict[str, Any]:
+    """Shape one SearchEngine result like BookResponse without building a pydantic model"""
+    return {
+        "id": result.get('id'),
+        "title": result.get('title', 'Unknown Title'),
+        "author": result.get('author', 'Unknown Author'),
+        "bookno": result.get('bookno'),
+        "language": result.get('language', 'Unknown Language'),
+        "similarity_score": result.get('similarity_score'),
+        "document_preview": result.get('document_preview', '')
+    }
+
+def format_search_response(results:List[Dict[str, Any]], query:str, **extra:Any) -> Dict[str, Any]:
+    """Shared SearchResponse-shaped payload; endpoints return it through ORJSONResponse"""
+    books = [format_book(result) for result in results]
+    return {"results": books, "total_found": len(books), "query": query, **extra}
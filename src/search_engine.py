@@ -1,64 +1,388 @@
 import logging 
-from typing import List, Dict, Any, Optional
+import os
+import threading
+import time
+import numpy as np
+import orjson
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Callable
 from vector_store import VectorStore
+from sharding import ShardedVectorStore
+from knn_graph import NeighbourTable
+from embedding_models import read_active_collection, active_collection_path
+from model_migration import migrate_collection
+from shared_index import SharedIndexStore
+from deadlines import Deadline, DeadlineExceeded, check_deadline
+from suggestions import SuggestionIndex
+from query_cache import QueryLog, SemanticQueryCache
+from write_buffer import BufferedVectorStore
+from disk_cache import DiskCache, cache_key, normalize_query
+from partitions import PartitionedStore
+from shared_state import WorkerRegistry, WriteClock
+from config import (
+    SHARD_STRATEGY,
+    KNN_GRAPH_DIR,
+    ACTIVE_POINTER_CHECK_INTERVAL,
+    SEARCH_BACKEND,
+    SHARED_INDEX_DIR,
+    MMR_LAMBDA,
+    MMR_CANDIDATE_POOL,
+    QUERY_TIERS,
+    DEFAULT_QUERY_TIER,
+    PRIMARY_BUDGET_SHARE,
+    QUERY_WORKERS,
+    SUGGEST_LIMIT,
+    SUGGEST_REFRESH_INTERVAL,
+    SEMANTIC_CACHE_ENABLED,
+    WRITE_BUFFER_ENABLED,
+    DISK_CACHE_ENABLED,
+    PARTITIONS_ENABLED
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def maximal_marginal_relevance(query_embedding:np.ndarray, candidate_embeddings:np.ndarray, k:int, lambda_mult:float = MMR_LAMBDA) -> List[int]:
+    """Greedy MMR selection over cosine similarities; returns candidate indices in pick order"""
+    candidates = candidate_embeddings / np.clip(np.linalg.norm(candidate_embeddings, axis=1, keepdims=True), 1e-12, None)
+    query = query_embedding / max(np.linalg.norm(query_embedding), 1e-12)
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    # Highest similarity of every candidate to anything already selected
+    max_similarity = similarity[selected[0]].copy()
+    while len(selected) < min(k, len(candidates)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    return selected
+
 class SearchEngine:
-    def __init__(self, collection_name:str = "books_story", db_path:str = "./chroma.db"):
-        self.vector_store = VectorStore(collection_name)
+    def __init__(self, collection_name:str = "books_story", db_path:str = "./chroma_db", shard_keys:Optional[List[str]] = None, follow_pointer:bool = True):
+        self.collection_name = collection_name
+        self.db_path = db_path
+        self.sharded = bool(SHARD_STRATEGY or shard_keys)
+        # Pinned engines (offline evaluation of a specific collection) ignore the active pointer
+        self.follow_pointer = follow_pointer
+        self._pointer = None
+        self._pointer_mtime = None
+        self._last_pointer_check = 0.0
+        self._migration_target = None
+        # Writes in flight per pointer epoch, so a migration is acknowledged only once no write skips its mirror
+        self._write_epoch = 0
+        self._writes_in_flight = Counter()
+        self._writes_done = threading.Condition()
+        self._closed = threading.Event()
+        self.query_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="query")
+        self.query_log = QueryLog()
+        self.semantic_cache = SemanticQueryCache()
+        self.disk_cache = self._open_disk_cache() if DISK_CACHE_ENABLED else None
+        self.write_clock = WriteClock()
+        if self.sharded:
+            self._vector_store = ShardedVectorStore(collection_name, db_path, shard_keys)
+        elif not follow_pointer:
+            self._vector_store = self._open_store(collection_name)
+        else:
+            self._pointer = read_active_collection(db_path)
+            self._vector_store = self._open_store(self._pointer['collection_name'] if self._pointer else collection_name)
+        self.neighbour_table = NeighbourTable(KNN_GRAPH_DIR) if NeighbourTable.exists(KNN_GRAPH_DIR) else None
+        self._suggestions_building = False
+        self._suggestions_lock = threading.Lock()
+        self._suggestions = self._build_suggestions()
+        self.workers = None
+        if follow_pointer and not self.sharded:
+            self.workers = WorkerRegistry()
+            self._acknowledge_pointer()
+            threading.Thread(target=self._watch_pointer, name="pointer-watch", daemon=True).start()
         logger.info("Search engine initialized")
 
-    def search_books(self, query:str, n_results: int = 5) -> List[Dict[str, Any]]:
+    @property
+    def vector_store(self):
+        """The store readers should use; follows atomic switches of the active collection pointer"""
+        now = time.monotonic()
+        if self.sharded or not self.follow_pointer or now - self._last_pointer_check < ACTIVE_POINTER_CHECK_INTERVAL:
+            return self._vector_store
+        self._last_pointer_check = now
+
+        path = active_collection_path(self.db_path)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if mtime != self._pointer_mtime:
+            pointer = read_active_collection(self.db_path)
+            with self._writes_done:
+                self._pointer_mtime = mtime
+                self._pointer = pointer
+                self._write_epoch += 1
+            if self._pointer and self._pointer['collection_name'] != self._vector_store.collection_name:
+                logger.info(f"Switching reads to collection {self._pointer['collection_name']}")
+                previous = self._vector_store
+                self._vector_store = self._open_store(self._pointer['collection_name'])
+                if isinstance(previous, BufferedVectorStore):
+                    # Writes still buffered for the old collection are merged off the request path
+                    threading.Thread(target=previous.close, name="flush-previous", daemon=True).start()
+        return self._vector_store
+
+    def _open_store(self, collection_name:str) -> Any:
+        store = VectorStore(collection_name, self.db_path)
+        if SEARCH_BACKEND == 'shared_index':
+            store = SharedIndexStore(store, SHARED_INDEX_DIR)
+        if PARTITIONS_ENABLED:
+            # Below the write buffer, so merged writes reach the partitions and filters see the delta
+            store = PartitionedStore(store)
+        if WRITE_BUFFER_ENABLED:
+            store = BufferedVectorStore(store, on_flush=self._written)
+        return store
+
+    def _open_disk_cache(self) -> Optional[DiskCache]:
+
+        try:
+            return DiskCache()
+        except Exception as e:
+            logger.error(f"Error opening disk cache, continuing without it: {e}")
+            return None
+
+    def _written(self, collection_name:str) -> None:
+        """Record a write for every worker: retires cached answers and dates the suggestion index"""
+        self.write_clock.mark(collection_name)
+        # Cached answers of every worker are keyed by this version, so one bump retires them all
+        if self.disk_cache is not None:
+            self.disk_cache.bump(collection_name)
+
+    def _embed_query(self, store:Any, query:str, use_cache:bool = True) -> List[float]:
+        """Query embedding, read from the disk cache when any worker or an earlier run already computed it"""
+        model_key = getattr(store, 'model_key', None)
+        if self.disk_cache is None or not use_cache or not model_key:
+            return store.embed_texts([query])[0]
+        key = cache_key("embedding", model_key, normalize_query(query))
+        cached = self.disk_cache.get(key)
+        if cached is not None:
+            return np.frombuffer(cached, dtype=np.float32).tolist()
+        embedding = store.embed_texts([query])[0]
+        self.disk_cache.set(key, np.asarray(embedding, dtype=np.float32).tobytes())
+        return embedding
+
+    def _answer_key(self, query:str, n_results:int, tier:str, author:Optional[str], language:Optional[str], preview_chars:Optional[int], search_kwargs:Dict[str, Any]) -> Optional[str]:
+        """Disk cache key of a full answer, or None while this worker holds writes others cannot see"""
+        store = self.vector_store
+        if self.disk_cache is None or (isinstance(store, BufferedVectorStore) and store.pending):
+            return None
+        version = self.disk_cache.version(store.collection_name)
+        return cache_key("answer", store.collection_name, version, tier, normalize_query(query), n_results, author, language, preview_chars, search_kwargs)
+
+    def _store_answer(self, key:str, results:List[Dict[str, Any]]) -> None:
+
+        try:
+            self.disk_cache.set(key, orjson.dumps(results, option=orjson.OPT_SERIALIZE_NUMPY))
+        except Exception as e:
+            logger.error(f"Error caching answer: {e}")
+
+    def disk_cache_stats(self) -> Dict[str, Any]:
+        return {"enabled": True, **self.disk_cache.stats()} if self.disk_cache is not None else {"enabled": False}
+
+    @property
+    def suggestion_index(self) -> SuggestionIndex:
+        """Autocomplete index of the active collection; rebuilt in the background once stale or after a switch"""
+        index = self._suggestions
+        if index.collection_name != self.vector_store.collection_name or time.monotonic() - index.built_at > SUGGEST_REFRESH_INTERVAL:
+            with self._suggestions_lock:
+                start = not self._suggestions_building
+                self._suggestions_building = True
+            if start:
+                threading.Thread(target=self._refresh_suggestions, name="suggest-index", daemon=True).start()
+        return index
+
+    def _build_suggestions(self) -> SuggestionIndex:
+
+        try:
+            return SuggestionIndex.from_store(self.vector_store)
+        except Exception as e:
+            logger.error(f"Error building suggestion index: {e}")
+            # An empty index keeps /suggest answering and is retried after the refresh interval
+            return SuggestionIndex({}, self.vector_store.collection_name)
+
+    def _refresh_suggestions(self) -> None:
+        self._suggestions = self._build_suggestions()
+        with self._suggestions_lock:
+            self._suggestions_building = False
+
+    def suggest(self, prefix:str, field:Optional[str] = None, limit:int = SUGGEST_LIMIT) -> List[Dict[str, Any]]:
+        return self.suggestion_index.suggest(prefix, field, limit)
+
+    def resolve_name(self, name:str, field:str) -> str:
+        """Stored spelling of a typed author or language, or the input unchanged when nothing is close"""
+        return self.suggestion_index.resolve(name, field) or name
+
+    def _write_stores(self) -> List[Any]:
+        """Active store plus, during a model migration, the collection being built"""
+        active = self.vector_store
+        stores = [active]
+        migration = (self._pointer or {}).get('migration')
+        if isinstance(active, BufferedVectorStore):
+            # The migration copies from Chroma, so a write still buffered when it reads the row would be lost
+            active.write_through = bool(migration)
+        if not migration:
+            self._migration_target = None
+            return stores
+        if self._migration_target is None or self._migration_target.collection_name != migration['collection_name']:
+            self._migration_target = VectorStore(migration['collection_name'], self.db_path, migration['embedding_model'])
+        return stores + [self._migration_target]
+
+    @contextmanager
+    def _writing(self) -> Iterator[List[Any]]:
+        """Stores one write goes to, the active one first; the write counts as in flight until the block ends"""
+        with self._writes_done:
+            stores = self._write_stores()
+            epoch = self._write_epoch
+            self._writes_in_flight[epoch] += 1
+        try:
+            yield stores
+        finally:
+            with self._writes_done:
+                self._writes_in_flight[epoch] -= 1
+                if not self._writes_in_flight[epoch]:
+                    del self._writes_in_flight[epoch]
+                self._writes_done.notify_all()
+
+    def _acknowledge_pointer(self) -> None:
+        """Tell a running migration this worker mirrors into its target.
+
+        Waits for writes that picked their stores under an older pointer, then merges buffered
+        writes so the migration's copy reads them from Chroma.
+        """
+        self._last_pointer_check = 0.0
+        store = self.vector_store
+        with self._writes_done:
+            epoch = self._write_epoch
+            migration = (self._pointer or {}).get('migration')
+            self._writes_done.wait_for(lambda: all(started >= epoch for started in self._writes_in_flight))
+        if isinstance(store, BufferedVectorStore):
+            store.write_through = bool(migration)
+            if migration:
+                store.flush()
+        self.workers.acknowledge(migration['collection_name'] if migration else None)
+
+    def _watch_pointer(self) -> None:
+        # Idle workers must acknowledge a migration too, not only those that happen to get a request
+        while not self._closed.wait(ACTIVE_POINTER_CHECK_INTERVAL):
+            try:
+                self._acknowledge_pointer()
+            except Exception as e:
+                logger.error(f"Error acknowledging the active collection pointer: {e}")
+
+    def _route(self, query:str, language:Optional[str] = None) -> Any:
+        """Store a query should search: on language shards only its language's shard, else the active store"""
+        store = self.vector_store
+        return store.route(query, language) if self.sharded else store
+
+    def _mixed_models(self, store:Any) -> bool:
+        # A fan-out over shards with different models cannot share one query embedding
+        return isinstance(store, ShardedVectorStore) and not store.single_model
+
+    def search_books(self, query:str, n_results: int = 5, diversify:bool = False, mmr_lambda:float = MMR_LAMBDA, candidate_pool:int = MMR_CANDIDATE_POOL, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None, include_documents:bool = True, use_cache:bool = True, language:Optional[str] = None, where:Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         
         try:
             logger.info(f"Searching for books with query: '{query}'")
-            result = self.vector_store.search_by_text(query, n_results)
-        
-            if not result or 'metadatas' not in result:
-                return []
-        
-            formatted_results = []
-            # ChromaDB returns metadatas as a list with one element containing all metadata objects
-            metadata_list = result['metadatas'][0] if result['metadatas'] else []
-            for i, metadata in enumerate(metadata_list):
-                if metadata:
-                    formatted_results.append({
-                        'id': result.get('ids', [[]])[0][i] if result.get('ids') else f"doc_{i}",
-                        'title': metadata.get('title', 'Unknown Title'),
-                        'author': metadata.get('author', 'Unknown Author'),
-                        'language': metadata.get('language', 'Unknown Language'),
-                        'similarity_score': result.get('distances', [[]])[0][i] if result.get('distances') else None,
-                        'document_preview': self._get_document_preview(result['documents'][0][i]) if result.get('documents') else ''
-                    })
+            store = self._route(query, language)
+            if diversify and self._mixed_models(store):
+                logger.warning("Diversification needs one embedding space; returning plain results across languages")
+            elif diversify:
+                return self._search_books_diverse(query, n_results, mmr_lambda, max(candidate_pool, n_results), deadline, store, include_documents, use_cache, where)
+            include = ["metadatas", "documents", "distances"] if include_documents else ["metadatas", "distances"]
+            if self._mixed_models(store):
+                # No filter push-down across embedding spaces; callers still post-filter
+                result = store.search_by_text(query, n_results, include=include, search_ef=search_ef, deadline=deadline)
+                return self._format_search_results(result)
+
+            check_deadline(deadline, "embedding the query")
+            query_embedding = self._embed_query(store, query, use_cache)
+            # The query cache and its log hold unfiltered embeddings of the active store's model only
+            if SEMANTIC_CACHE_ENABLED and store is self.vector_store and where is None:
+                self.query_log.record(query_embedding)
+                ranking = self.semantic_cache.lookup(query_embedding, n_results, store.collection_name, self.write_clock.last(store.collection_name)) if use_cache else None
+                if ranking is not None:
+                    logger.info(f"Answered '{query}' from the semantic cache")
+                    return self.get_books_by_ranking(ranking, include_documents, deadline=deadline)
+            result = store.search_by_embedding(query_embedding, n_results, where=where, include=include, search_ef=search_ef, deadline=deadline)
+            formatted_results = self._format_search_results(result)
             logger.info(f"Found {len(formatted_results)}")
             return formatted_results
         
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error searching books: {e}")
             return []
 
-    def search_by_author(self, author:str, n_results:int = 5) -> List[Dict[str, Any]]:
+    def _search_books_diverse(self, query:str, n_results:int, mmr_lambda:float, candidate_pool:int, deadline:Optional[Deadline] = None, store:Optional[Any] = None, include_documents:bool = True, use_cache:bool = True, where:Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+
+        store = store or self.vector_store
+        check_deadline(deadline, "embedding the query")
+        query_embedding = np.asarray(self._embed_query(store, query, use_cache), dtype=np.float32)
+        result = store.search_by_embedding(
+            query_embedding.tolist(),
+            candidate_pool,
+            where=where,
+            include=["metadatas", "distances", "embeddings"] + (["documents"] if include_documents else []),
+            deadline=deadline
+        )
+        if not result or not result.get('ids') or not result['ids'][0]:
+            return []
+
+        # Keep only the best-ranked row of each book before diversifying
+        seen_books = set()
+        keep = []
+        for i, metadata in enumerate(result['metadatas'][0]):
+            book_key = (metadata or {}).get('bookno') or result['ids'][0][i]
+            if book_key not in seen_books:
+                seen_books.add(book_key)
+                keep.append(i)
+
+        embeddings = np.asarray(result['embeddings'][0], dtype=np.float32)[keep]
+        picked = [keep[i] for i in maximal_marginal_relevance(query_embedding, embeddings, n_results, mmr_lambda)]
+        logger.info(f"MMR picked {len(picked)} of {len(result['ids'][0])} candidates ({len(keep)} distinct books)")
+        documents = result['documents'][0] if result.get('documents') else None
+        return [
+            self._format_book(
+                result['ids'][0][i],
+                result['metadatas'][0][i] or {},
+                result['distances'][0][i],
+                documents[i] if documents else ''
+            )
+            for i in picked
+        ]
+
+    def search_by_author(self, author:str, n_results:int = 5, deadline:Optional[Deadline] = None, resolve:bool = True) -> List[Dict[str, Any]]:
+        """Books whose stored author equals author; pass resolve=False when it already is the stored spelling"""
 
         try:
             logger.info(f"Searching for books by author: '{author}'")
-            metadata_filter = {'author' : author}
+            check_deadline(deadline, "the author filter")
+            # The filter is an exact match, so send the stored spelling rather than what was typed
+            metadata_filter = {'author' : self.resolve_name(author, 'author') if resolve else author}
             results = self.vector_store.search_by_metadata(metadata_filter, n_results)
             return self._format_search_results(results)
-        
+
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error searching by author: {e}")
             return []
         
-    def search_by_language(self, language:str, n_results:int = 5) -> List[Dict[str,Any]]:
+    def search_by_language(self, language:str, n_results:int = 5, deadline:Optional[Deadline] = None, resolve:bool = True) -> List[Dict[str,Any]]:
 
         try:
             logger.info(f"Searching for books by language: '{language}'")
-            metadata_filter = {'language' : language}
+            check_deadline(deadline, "the language filter")
+            metadata_filter = {'language' : self.resolve_name(language, 'language') if resolve else language}
             results = self.vector_store.search_by_metadata(metadata_filter, n_results)
             return self._format_search_results(results)
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error searching by language: {e}")
             return []
@@ -83,6 +407,69 @@ class SearchEngine:
             logger.error(f"Error getting book by ID: {e}")
             return None
 
+    def similar_books(self, book_id:str, n_results:int = 5, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None) -> Optional[List[Dict[str, Any]]]:
+
+        try:
+            logger.info(f"Finding books similar to: '{book_id}'")
+            if self.neighbour_table and n_results <= self.neighbour_table.k and self._neighbour_table_current():
+                precomputed = self._similar_books_from_table(book_id, n_results, deadline)
+                if precomputed is not None:
+                    return precomputed
+
+            store = search_store = self.vector_store
+            if self.sharded:
+                # The centroid is in the source shard's embedding space; shards of other models cannot be searched with it
+                store = search_store.shard_of(book_id)
+                if store is None:
+                    return None
+                search_store = search_store.with_model(store.model_key)
+            source = store.get_embeddings([book_id])
+            if not source or not source.get('ids'):
+                return None
+
+            bookno = source['metadatas'][0].get('bookno')
+            embeddings = np.asarray(source['embeddings'], dtype=np.float32)
+            if bookno:
+                # A chunked book has several rows; query with the centroid of all its passages
+                passages = search_store.get_embeddings(where={'bookno': bookno})
+                if passages and len(passages.get('ids', [])) > 1:
+                    embeddings = np.asarray(passages['embeddings'], dtype=np.float32)
+                where = {'bookno': {'$ne': bookno}}
+            else:
+                where = None
+
+            centroid = embeddings.mean(axis=0)
+            check_deadline(deadline, "searching for neighbours")
+            results = search_store.search_by_embedding(centroid.tolist(), n_results, where=where, search_ef=search_ef, deadline=deadline)
+            return [book for book in self._format_search_results(results) if book['id'] != book_id]
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error finding similar books: {e}")
+            return []
+
+    def _neighbour_table_current(self) -> bool:
+        # Another collection, another model or a write since the embeddings were exported: search live instead
+        store = self.vector_store
+        return self.neighbour_table.matches(store.collection_name, getattr(store, 'model_key', None), self.write_clock.last(store.collection_name))
+
+    def _similar_books_from_table(self, book_id:str, n_results:int, deadline:Optional[Deadline] = None) -> Optional[List[Dict[str, Any]]]:
+
+        neighbours = self.neighbour_table.lookup(book_id)
+        if neighbours is None:
+            return None
+        check_deadline(deadline, "reading the source book")
+        source = self.vector_store.get_documents_by_ids([book_id], include=["metadatas"])
+        if not source or not source.get('ids'):
+            return None
+
+        # Report squared L2 like Chroma does: for unit vectors it equals 2 - 2 * cosine
+        bookno = source['metadatas'][0].get('bookno')
+        ranking = [(doc_id, 2.0 - 2.0 * score) for doc_id, score in neighbours]
+        books = [book for book in self.get_books_by_ranking(ranking, deadline=deadline) if not bookno or book['bookno'] != bookno]
+        return books[:n_results]
+
     def get_collection_stats(self) -> Dict[str,Any]:
         
         try:
@@ -99,6 +486,181 @@ class SearchEngine:
             logger.error(f"Error getting collection stats: {e}")
             return {}
     
+    def upsert_books(self, books:List[Dict[str, Any]], progress_callback:Optional[Callable[[int], None]] = None) -> Dict[str, int]:
+
+        logger.info(f"Bulk upserting {len(books)} books")
+        ids = [book['id'] for book in books]
+        documents = [book['content'] for book in books]
+        metadatas = [self._book_metadata(book) for book in books]
+        self.semantic_cache.invalidate()
+        # The active collection is written first, so a migration re-checking a row it copied sees the change
+        with self._writing() as (active, *mirrors):
+            stats = active.upsert_documents(ids, documents, metadatas, progress_callback=progress_callback)
+            for store in mirrors:
+                store.upsert_documents(ids, documents, metadatas)
+        self._written(active.collection_name)
+        return stats
+
+    def delete_books(self, book_ids:List[str], progress_callback:Optional[Callable[[int], None]] = None) -> int:
+
+        logger.info(f"Bulk deleting {len(book_ids)} books")
+        self.semantic_cache.invalidate()
+        with self._writing() as (active, *mirrors):
+            deleted = active.delete_documents(book_ids, progress_callback=progress_callback)
+            for store in mirrors:
+                store.delete_documents(book_ids)
+        self._written(active.collection_name)
+        return deleted
+
+    def _book_metadata(self, book:Dict[str, Any]) -> Dict[str, str]:
+        """Chroma metadata of an API book; unset fields of a model_dump() arrive as None, not missing"""
+        def field(key:str, default:str) -> str:
+            return str(book.get(key) or '').strip() or default
+        return {
+            'bookno': field('bookno', ''),
+            'title': field('title', 'Unknown Title'),
+            'author': field('author', 'Unknown Author'),
+            'language': field('language', 'Unknown Language')
+        }
+
+    def update_book(self, book:Dict[str, Any]) -> bool:
+        """Re-embed one existing book; with the write buffer on it is searchable at once and merged into Chroma later"""
+        metadata = self._book_metadata(book)
+        # An updated book drops out of cached candidates until the next cache build instead of serving its old text
+        self.semantic_cache.discard([book['id']])
+        with self._writing() as (active, *mirrors):
+            updated = active.update_document(book['id'], book['content'], metadata)
+            for store in mirrors:
+                store.update_document(book['id'], book['content'], metadata)
+        self._written(active.collection_name)
+        return updated
+
+    def delete_book(self, book_id:str) -> bool:
+
+        self.semantic_cache.discard([book_id])
+        with self._writing() as (active, *mirrors):
+            deleted = active.delete_document(book_id)
+            for store in mirrors:
+                store.delete_document(book_id)
+        self._written(active.collection_name)
+        return deleted
+
+    def flush_writes(self) -> Dict[str, Any]:
+        """Merge buffered single-book writes into Chroma now instead of at the next flush interval"""
+        store = self.vector_store
+        return store.flush() if isinstance(store, BufferedVectorStore) else {"flushed": 0}
+
+    def write_buffer_stats(self) -> Dict[str, Any]:
+        store = self.vector_store
+        return store.stats() if isinstance(store, BufferedVectorStore) else {"enabled": False}
+
+    def partition_stats(self) -> Dict[str, Any]:
+        store = self.vector_store
+        if isinstance(store, BufferedVectorStore):
+            store = store.store
+        return {"enabled": True, **store.partition_stats()} if isinstance(store, PartitionedStore) else {"enabled": False}
+
+    def close(self) -> None:
+        """Merge pending buffered writes before shutdown; the write-ahead log covers a crash instead"""
+        self._closed.set()
+        if self.workers is not None:
+            self.workers.leave()
+        if isinstance(self._vector_store, BufferedVectorStore):
+            self._vector_store.close()
+        self.query_executor.shutdown(wait=False)
+
+    def migrate_embedding_model(self, model_key:str, progress_callback:Optional[Callable[[int], None]] = None) -> Dict[str, Any]:
+
+        if self.sharded:
+            raise ValueError("Model migration is only supported for unsharded collections; rebuild shards instead")
+        result = migrate_collection(self.db_path, self.vector_store.collection_name, model_key, progress_callback=progress_callback)
+        self._last_pointer_check = 0.0
+        return result
+
+    def get_active_collection(self) -> Dict[str, Any]:
+
+        store = self.vector_store
+        return {
+            'collection_name': store.collection_name,
+            'embedding_model': getattr(store, 'model_key', None),
+            'migration': (self._pointer or {}).get('migration')
+        }
+
+    def rank_books(self, query:str, n_results:int, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None, author:Optional[str] = None, language:Optional[str] = None) -> List[Tuple[str, float]]:
+
+        try:
+            logger.info(f"Ranking books for query: '{query}'")
+            if author or language:
+                # Same filter rules as /search/advanced, without reading the texts
+                books = self.advanced_search(query, author, language, n_results, search_ef=search_ef, deadline=deadline, include_documents=False)
+                return [(book['id'], book['similarity_score']) for book in books]
+            result = self.vector_store.search_by_text(query, n_results, include=["distances"], search_ef=search_ef, deadline=deadline)
+            if not result or not result.get('ids'):
+                return []
+            return list(zip(result['ids'][0], result['distances'][0]))
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error ranking books: {e}")
+            return []
+
+    def get_books_by_ranking(self, ranking:List[Tuple[str, float]], include_documents:bool = True, deadline:Optional[Deadline] = None) -> List[Dict[str, Any]]:
+
+        try:
+            if not ranking:
+                return []
+            check_deadline(deadline, "reading the ranked books")
+            include = ["metadatas", "documents"] if include_documents else ["metadatas"]
+            result = self.vector_store.get_documents_by_ids([doc_id for doc_id, _ in ranking], include=include)
+            check_deadline(deadline, "formatting the ranked books")
+            if not result or not result.get('ids'):
+                return []
+
+            # Chroma does not return rows in the requested order, so restore the ranking order
+            documents = result.get('documents') or [None] * len(result['ids'])
+            rows = {
+                doc_id: (metadata, document)
+                for doc_id, metadata, document in zip(result['ids'], result['metadatas'], documents)
+            }
+            formatted_results = []
+            for doc_id, distance in ranking:
+                if doc_id not in rows:
+                    continue
+                metadata, document = rows[doc_id]
+                formatted_results.append(self._format_book(doc_id, metadata, distance, document))
+            return formatted_results
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error getting books by ranking: {e}")
+            return []
+
+    def iter_books_by_ranking(self, ranking:List[Tuple[str, float]], batch_size:int = 50) -> Iterator[Dict[str, Any]]:
+
+        for start in range(0, len(ranking), batch_size):
+            yield from self.get_books_by_ranking(ranking[start:start + batch_size])
+
+    def iter_documents(self, batch_size:int = 50, include_documents:bool = True, include_embeddings:bool = False) -> Iterator[Dict[str, Any]]:
+
+        include = ["metadatas"] + (["documents"] if include_documents else []) + (["embeddings"] if include_embeddings else [])
+        for batch in self.vector_store.iter_documents(batch_size, include):
+            for i, doc_id in enumerate(batch['ids']):
+                metadata = batch['metadatas'][i] or {}
+                record = {
+                    'id': doc_id,
+                    'bookno': metadata.get('bookno', 'Unknown ID'),
+                    'title': metadata.get('title', 'Unknown Title'),
+                    'author': metadata.get('author', 'Unknown Author'),
+                    'language': metadata.get('language', 'Unknown Language')
+                }
+                if include_documents:
+                    record['content'] = batch['documents'][i]
+                if include_embeddings:
+                    record['embedding'] = batch['embeddings'][i]
+                yield record
+
     def _format_search_results(self, results:Dict[str,Any]) -> List[Dict[str,Any]]:
 
         formatted_results = []
@@ -106,22 +668,34 @@ class SearchEngine:
         if not results or 'metadatas' not in results:
             return formatted_results
         
-        # ChromaDB returns metadatas as a list with one element containing all metadata objects
+        # ChromaDB returns one inner list per query; we always send a single query
         metadata_list = results['metadatas'][0] if results['metadatas'] else []
+        ids = results['ids'][0] if results.get('ids') else []
+        distances = results['distances'][0] if results.get('distances') else []
+        documents = results['documents'][0] if results.get('documents') else []
         for i, metadata in enumerate(metadata_list):
             if metadata:
-                formatted_results.append({
-                    'id': results.get('ids', [[]])[0][i] if results.get('ids') else f"doc_{i}",
-                    'title': metadata.get('title', 'Unknown Title'),
-                    'author': metadata.get('author', 'Unknown Author'),
-                    'bookno': metadata.get('bookno', 'Unknown ID'),
-                    'language': metadata.get('language', 'Unknown Language'),
-                    'similarity_score': results.get('distances', [[]])[0][i] if results.get('distances') else None,
-                    'document_preview': self._get_document_preview(results['documents'][0][i]) if results.get('documents') else ''
-                })
+                formatted_results.append(self._format_book(
+                    ids[i] if ids else f"doc_{i}",
+                    metadata,
+                    distances[i] if distances else None,
+                    documents[i] if documents else ''
+                ))
             
         return formatted_results
 
+    def _format_book(self, doc_id:str, metadata:Dict[str,Any], distance:Optional[float], document:Optional[str]) -> Dict[str,Any]:
+
+        return {
+            'id': doc_id,
+            'title': metadata.get('title', 'Unknown Title'),
+            'author': metadata.get('author', 'Unknown Author'),
+            'bookno': metadata.get('bookno', 'Unknown ID'),
+            'language': metadata.get('language', 'Unknown Language'),
+            'similarity_score': distance,
+            'document_preview': self._get_document_preview(document)
+        }
+
     def _get_document_preview(self, document:str, max_length:int = 200) -> str:
 
         if not document:
@@ -149,24 +723,139 @@ class SearchEngine:
             logger.error(f'Error getting book detials: {e}') 
             return {}
     
-    def advanced_search(self, query:str, author:Optional[str] = None, language:Optional[str] = None, n_results:int = 5) -> List[Dict[str,Any]]:
+    def _filter_where(self, needles:Dict[str, List[str]]) -> Optional[Dict[str, Any]]:
+        """Exact-match filter for the stored values advanced_search's substring filters accept, so the
+        store can plan the filter instead of post-filtering the top k; None when nothing is known to match"""
+        index = self.suggestion_index
+        if index.snapshot_at < self.write_clock.last(index.collection_name):
+            # Values written since the index was built would be filtered out; post-filter instead
+            return None
+        clauses = []
+        for field, names in needles.items():
+            values = index.values_containing(field, names)
+            if not values:
+                # Possibly written after the suggestion index was built: keep the post-filter only
+                return None
+            clauses.append({field: values[0]} if len(values) == 1 else {field: {'$in': values}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+    def advanced_search(self, query:str, author:Optional[str] = None, language:Optional[str] = None, n_results:int = 5, diversify:bool = False, mmr_lambda:float = MMR_LAMBDA, candidate_pool:int = MMR_CANDIDATE_POOL, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None, include_documents:bool = True, use_cache:bool = True) -> List[Dict[str,Any]]:
 
         try:
             logger.info(f"Advance search:query='{query}', author={author}, language={language}")
 
-            results = self.search_books(query, n_results)
-            
-            if author:
-                results = [r for r in results if author.lower() in r['author'].lower()]
-            if language:
-                results = [r for r in results if language.lower() in r['language'].lower()]
+            # Substring filters keep matching partial names; the resolved spelling adds reordered ones
+            resolved = {field: self.resolve_name(name, field) for field, name in (('author', author), ('language', language)) if name}
+            needles = {field: sorted({name.lower(), resolved[field].lower()}) for field, name in (('author', author), ('language', language)) if name}
+            where = None if self.sharded else self._filter_where(needles)
+            results = self.search_books(query, n_results, diversify, mmr_lambda, candidate_pool, search_ef, deadline, include_documents, use_cache, resolved.get('language'), where)
+
+            for field, names in needles.items():
+                results = [r for r in results if any(name in r[field].lower() for name in names)]
             
             return results[:n_results]
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error in advance_search: {e}")
             return []
 
+    def search_with_budget(self, query:str, n_results:int = 5, tier:str = DEFAULT_QUERY_TIER, author:Optional[str] = None, language:Optional[str] = None, preview_chars:Optional[int] = None, **search_kwargs:Any) -> Dict[str, Any]:
+        """Answer within the tier's deadline: full results if they arrive in time, else a metadata-only
+        fallback, else nothing; any shortcut taken is reported through 'degraded'.
+        With preview_chars only the start of each text is read instead of the full document."""
+        settings = QUERY_TIERS[tier]
+        deadline = Deadline(settings['deadline_ms'] / 1000)
+        started = time.perf_counter()
+        # The fallback keeps the rest of the budget even when the full search overruns its share
+        primary_deadline = deadline.reserve(deadline.budget * PRIMARY_BUDGET_SHARE)
+
+        search_kwargs.setdefault('use_cache', settings.get('semantic_cache', True))
+        key = self._answer_key(query, n_results, tier, author, language, preview_chars, search_kwargs)
+        cached = self.disk_cache.get(key) if key else None
+        if cached is not None:
+            logger.info(f"Answered '{query}' from the disk cache")
+            return {
+                'results': orjson.loads(cached),
+                'tier': tier,
+                'degraded': False,
+                'degraded_reasons': [],
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+            }
+        if preview_chars is not None:
+            search_kwargs['include_documents'] = False
+        try:
+            results = self._run_within(primary_deadline, self.advanced_search, query, author, language, n_results, search_ef=settings['search_ef'], **search_kwargs)
+        except DeadlineExceeded:
+            deadline.degrade("full search missed its share of the budget; returned without document previews")
+            try:
+                results = self._run_within(deadline.reserve(deadline.remaining()), self.advanced_search, query, author, language, n_results, include_documents=False)
+            except DeadlineExceeded:
+                deadline.degrade("fallback search missed the deadline")
+                results = []
+        if preview_chars is not None and results:
+            if deadline.expired():
+                deadline.degrade("no budget left to read document previews")
+            else:
+                results = self.attach_previews(results, preview_chars)
+
+        # Partial answers are never cached, so a slow moment does not outlive its deadline
+        if key and not deadline.degraded:
+            self._store_answer(key, results)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if deadline.degraded:
+            logger.warning(f"Degraded {tier} search for '{query}' after {elapsed_ms:.0f}ms: {deadline.reasons}")
+        return {
+            'results': results,
+            'tier': tier,
+            'degraded': deadline.degraded,
+            'degraded_reasons': list(deadline.reasons),
+            'elapsed_ms': round(elapsed_ms, 1)
+        }
+
+    def attach_previews(self, results:List[Dict[str, Any]], preview_chars:int) -> List[Dict[str, Any]]:
+        """Cut previews to preview_chars, reading only the start of texts the results were fetched without"""
+        missing = [result['id'] for result in results if not result.get('document_preview')]
+        previews = dict(zip(missing, self.vector_store.read_previews(missing, preview_chars))) if missing and preview_chars else {}
+        for result in results:
+            text = previews.get(result['id']) or result.get('document_preview') or ''
+            result['document_preview'] = text[:preview_chars].strip()
+        return results
+
+    def run_with_budget(self, tier:str, fn:Callable[..., Any], *args:Any, **kwargs:Any) -> Dict[str, Any]:
+        """Run a search method under the tier's deadline; one that misses it answers [] flagged as degraded"""
+        deadline = Deadline(QUERY_TIERS[tier]['deadline_ms'] / 1000)
+        started = time.perf_counter()
+        try:
+            results = self._run_within(deadline, fn, *args, **kwargs)
+        except DeadlineExceeded:
+            deadline.degrade(f"{fn.__name__} missed the {tier} deadline")
+            results = []
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if deadline.degraded:
+            logger.warning(f"Degraded {tier} {fn.__name__} after {elapsed_ms:.0f}ms: {deadline.reasons}")
+        return {
+            'results': results,
+            'tier': tier,
+            'degraded': deadline.degraded,
+            'degraded_reasons': list(deadline.reasons),
+            'elapsed_ms': round(elapsed_ms, 1)
+        }
+
+    def _run_within(self, deadline:Deadline, fn:Callable[..., Any], *args:Any, **kwargs:Any) -> Any:
+        """fn(*args, deadline=deadline, **kwargs) on the query pool; raises DeadlineExceeded when it misses the deadline"""
+        future = self.query_executor.submit(fn, *args, deadline=deadline, **kwargs)
+        try:
+            return future.result(timeout=deadline.remaining())
+        except (FutureTimeout, DeadlineExceeded):
+            # A queued search never starts; a running one is stopped at its next deadline check
+            future.cancel()
+            deadline.cancel()
+            raise DeadlineExceeded(f"{fn.__name__} missed its deadline")
+
 if __name__ == "__main__":
     search_engine = SearchEngine()
 
@@ -0,0 +1,362 @@
+import copy
+import heapq
+import json
+import logging
+import os
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice
+from typing import List, Dict, Set, Optional, Any, Callable, Iterator
+from vector_store import VectorStore
+from deadlines import Deadline, DeadlineExceeded, check_deadline
+from language_detection import detect_language, rank_languages, language_model
+from config import SHARD_COUNT, SHARD_QUERY_WORKERS, BULK_BATCH_SIZE, ROUTE_FALLBACK_LANGUAGES
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SHARD_STRATEGIES = ('language', 'hash', 'date')
+SHARD_MANIFEST = 'manifest.json'
+
+def shard_key(metadata:Dict[str, Any], strategy:str, shard_count:int = SHARD_COUNT) -> str:
+    """Map one book's metadata to the shard it belongs to"""
+    if strategy == 'language':
+        language = str(metadata.get('language') or 'unknown').strip().lower()
+        return re.sub(r'[^a-z0-9]+', '-', language).strip('-') or 'unknown'
+    if strategy == 'hash':
+        return str(zlib.crc32(str(metadata.get('bookno')).encode()) % shard_count)
+    if strategy == 'date':
+        # Monthly partitions keep the number of shards small
+        return str(metadata.get('ingested_at') or 'undated')[:7]
+    raise ValueError(f"Unknown shard strategy: {strategy}")
+
+def shard_collection_name(collection_name:str, key:str) -> str:
+    return f"{collection_name}__{key}"
+
+def shard_db_path(db_path:str, key:str) -> str:
+    # One Chroma directory per shard so shards can be written from separate processes
+    return os.path.join(db_path, 'shards', key)
+
+def write_shard_manifest(db_path:str, manifest:Dict[str, Any]) -> None:
+    path = os.path.join(db_path, 'shards', SHARD_MANIFEST)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def read_shard_manifest(db_path:str) -> Dict[str, Any]:
+    path = os.path.join(db_path, 'shards', SHARD_MANIFEST)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def merge_query_results(results:List[Dict[str, Any]], n_results:int, by_rank:bool = False) -> Dict[str, Any]:
+    """Merge per-shard Chroma query results (each sorted by distance) into one top-k result.
+
+    Distances from different models are not comparable, so with by_rank the shards are
+    interleaved by rank, each shard's distances scaled by its own worst one to order equal ranks.
+    """
+    streams = []
+    for result in results:
+        if not result or not result.get('ids') or not result['ids'][0]:
+            continue
+        ids = result['ids'][0]
+        distances = result['distances'][0] if result.get('distances') else [0.0] * len(ids)
+        metadatas = result['metadatas'][0] if result.get('metadatas') else [None] * len(ids)
+        documents = result['documents'][0] if result.get('documents') else [None] * len(ids)
+        embeddings = result['embeddings'][0] if result.get('embeddings') is not None else [None] * len(ids)
+        if by_rank:
+            scale = max(distances) or 1.0
+            keys = [(rank, distance / scale) for rank, distance in enumerate(distances)]
+        else:
+            keys = distances
+        streams.append(zip(keys, distances, ids, metadatas, documents, embeddings))
+
+    merged = [row[1:] for row in islice(heapq.merge(*streams, key=lambda row: row[0]), n_results)]
+    has_documents = any(result and result.get('documents') for result in results)
+    has_embeddings = any(result and result.get('embeddings') is not None for result in results)
+    return {
+        'ids': [[row[1] for row in merged]],
+        'distances': [[row[0] for row in merged]],
+        'metadatas': [[row[2] for row in merged]],
+        'documents': [[row[3] for row in merged]] if has_documents else None,
+        'embeddings': [[row[4] for row in merged]] if has_embeddings else None
+    }
+
+class ShardedVectorStore:
+    """VectorStore-compatible facade that fans queries out to every shard and merges the top-k"""
+
+    def __init__(self, collection_name:str = "books_story", db_path:str = "./chroma_db", shard_keys:Optional[List[str]] = None, max_workers:int = SHARD_QUERY_WORKERS):
+        self.collection_name = collection_name
+        self.db_path = db_path
+        self.manifest = read_shard_manifest(db_path)
+        keys = shard_keys or sorted(self.manifest.get('shards', {}))
+        if not keys:
+            raise ValueError(f"No shards found under {db_path}; build them with embedding_generation.py")
+
+        self.shards = {
+            key: VectorStore(shard_collection_name(collection_name, key), shard_db_path(db_path, key))
+            for key in keys
+        }
+        self.strategy = self.manifest.get('strategy')
+        self.executor = ThreadPoolExecutor(max_workers=min(max_workers, len(self.shards)), thread_name_prefix="shard")
+        logger.info(f"Sharded store over {len(self.shards)} shards ({self.strategy})")
+
+    @property
+    def single_model(self) -> bool:
+        """Whether one query embedding is valid for every shard"""
+        return len({store.model_key for store in self.shards.values()}) == 1
+
+    @property
+    def model_key(self) -> Optional[str]:
+        """Model shared by every shard, None when language shards use different models"""
+        keys = {store.model_key for store in self.shards.values()}
+        return keys.pop() if len(keys) == 1 else None
+
+    def embed_texts(self, texts:List[str]) -> List[List[float]]:
+        return next(iter(self.shards.values())).embed_texts(texts)
+
+    def route(self, query_text:str, language:Optional[str] = None) -> Any:
+        """The store a query should search: one language shard, a few of them, or self for every shard.
+
+        An explicit language or a clearly detected one picks a single shard. When detection is
+        unsure, the likeliest languages are searched together with the largest shard, since
+        titles often keep their original language ("Les misérables") in any edition.
+        """
+        if self.strategy != 'language':
+            return self
+        sizes = self.manifest.get('shards', {})
+        if language:
+            key = shard_key({'language': language}, 'language')
+        else:
+            key = detect_language(query_text, self.shards, sizes)
+        if key in self.shards:
+            logger.info(f"Routing '{query_text}' to the {key} shard")
+            return self.shards[key]
+        likely = rank_languages(query_text, self.shards, sizes)[:ROUTE_FALLBACK_LANGUAGES]
+        if not likely:
+            return self
+        keys = set(likely) | {max(self.shards, key=lambda key: sizes.get(key, 0))}
+        if len(keys) >= len(self.shards):
+            return self
+        logger.info(f"Routing '{query_text}' to the {sorted(keys)} shards")
+        return self._subset(keys)
+
+    def _subset(self, keys:Set[str]) -> 'ShardedVectorStore':
+        """A read-only view over some shards, sharing this store's executor"""
+        view = copy.copy(self)
+        view.shards = {key: store for key, store in self.shards.items() if key in keys}
+        return view
+
+    def shard_of(self, doc_id:str) -> Optional[VectorStore]:
+        """The shard holding doc_id, None when no shard does"""
+        for store, result in zip(self.shards.values(), self._fan_out('get_documents_by_ids', [doc_id], include=["metadatas"])):
+            if result and result.get('ids'):
+                return store
+        return None
+
+    def with_model(self, model_key:str) -> 'ShardedVectorStore':
+        """A read-only view over the shards embedded with model_key, which one query vector can search"""
+        return self._subset({key for key, store in self.shards.items() if store.model_key == model_key})
+
+    def _add_language_shard(self, key:str) -> VectorStore:
+        """Create the collection for a language seen for the first time, with that language's model"""
+        store = VectorStore(shard_collection_name(self.collection_name, key), shard_db_path(self.db_path, key), language_model(key))
+        self.shards[key] = store
+        self.manifest.setdefault('shards', {})[key] = 0
+        self.manifest.setdefault('models', {})[key] = store.model_key
+        write_shard_manifest(self.db_path, self.manifest)
+        logger.info(f"Added language shard {key} ({store.model_key})")
+        return store
+
+    def _fan_out(self, method:str, *args, **kwargs) -> List[Any]:
+        futures = [
+            self.executor.submit(getattr(store, method), *args, **kwargs)
+            for store in self.shards.values()
+        ]
+        return [future.result() for future in futures]
+
+    def get_collection_info(self) -> Dict[str, Any]:
+        counts = dict(zip(self.shards, self._fan_out('get_document_count')))
+        return {
+            "collection_name": self.collection_name,
+            "document_count": sum(counts.values()),
+            "db_path": self.db_path,
+            "shard_strategy": self.manifest.get('strategy'),
+            "shards": counts
+        }
+
+    def _gather(self, futures:List[Any], deadline:Optional[Deadline]) -> List[Any]:
+        """Shard results that arrived in time; late or expired shards are dropped and recorded on the deadline"""
+        if deadline is None:
+            return [future.result() for future in futures]
+        done, pending = wait(futures, timeout=deadline.remaining())
+        results = []
+        for future in done:
+            try:
+                results.append(future.result())
+            except DeadlineExceeded:
+                pending.add(future)
+        if pending:
+            deadline.degrade(f"{len(pending)} of {len(futures)} shards missed the deadline")
+        return results
+
+    def search_by_text(self, query_text:str, n_results:int = 5, include:Optional[List[str]] = None, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None) -> Dict[str, Any]:
+
+        try:
+            # Embed the query once per distinct model instead of once per shard
+            check_deadline(deadline, "embedding the query")
+            embeddings = {}
+            for store in self.shards.values():
+                if store.model_key not in embeddings:
+                    embeddings[store.model_key] = store.embed_texts([query_text])[0]
+            futures = [
+                self.executor.submit(store.search_by_embedding, embeddings[store.model_key], n_results, include=include, search_ef=search_ef, deadline=deadline)
+                for store in self.shards.values()
+            ]
+            return merge_query_results(self._gather(futures, deadline), n_results, by_rank=len(embeddings) > 1)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error in sharded text search: {e}")
+            return {}
+
+    def search_by_embedding(self, query_embedding:List[float], n_results:int = 5, where:Optional[Dict[str, Any]] = None, include:Optional[List[str]] = None, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None) -> Dict[str, Any]:
+
+        try:
+            futures = [
+                self.executor.submit(store.search_by_embedding, query_embedding, n_results, where=where, include=include, search_ef=search_ef, deadline=deadline)
+                for store in self.shards.values()
+            ]
+            return merge_query_results(self._gather(futures, deadline), n_results)
+        except Exception as e:
+            logger.error(f"Error in sharded embedding search: {e}")
+            return {}
+
+    def search_by_metadata(self, metadata_filter:Dict[str, str], n_results:int = 5) -> Dict[str, Any]:
+
+        try:
+            # A language filter on language shards only needs the one shard that holds it
+            if self.strategy == 'language' and 'language' in metadata_filter:
+                store = self.shards.get(shard_key(metadata_filter, 'language'))
+                return store.search_by_metadata(metadata_filter, n_results) if store else {}
+            results = self._fan_out('search_by_metadata', metadata_filter, n_results)
+            return merge_query_results(results, n_results)
+        except Exception as e:
+            logger.error(f"Error in sharded metadata search: {e}")
+            return {}
+
+    def get_document_by_id(self, doc_id:str) -> Optional[Dict[str, Any]]:
+        for result in self._fan_out('get_document_by_id', doc_id):
+            if result:
+                return result
+        return None
+
+    def get_documents_by_ids(self, doc_ids:List[str], include:Optional[List[str]] = None) -> Dict[str, Any]:
+        merged = {'ids': [], 'metadatas': [], 'documents': []}
+        for result in self._fan_out('get_documents_by_ids', doc_ids, include=include):
+            if not result or not result.get('ids'):
+                continue
+            merged['ids'].extend(result['ids'])
+            merged['metadatas'].extend(result.get('metadatas') or [None] * len(result['ids']))
+            merged['documents'].extend(result.get('documents') or [None] * len(result['ids']))
+        return merged
+
+    def read_previews(self, doc_ids:List[str], length:int) -> List[Optional[str]]:
+        previews = [None] * len(doc_ids)
+        for result in self._fan_out('read_previews', doc_ids, length):
+            previews = [preview if preview is not None else found for preview, found in zip(previews, result)]
+        return previews
+
+    def get_embeddings(self, doc_ids:Optional[List[str]] = None, where:Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        merged = {'ids': [], 'embeddings': [], 'metadatas': []}
+        for result in self._fan_out('get_embeddings', doc_ids, where=where):
+            if not result or not result.get('ids'):
+                continue
+            merged['ids'].extend(result['ids'])
+            merged['embeddings'].extend(result['embeddings'])
+            merged['metadatas'].extend(result['metadatas'])
+        return merged
+
+    def get_all_documents(self, limit:Optional[int] = None, include:Optional[List[str]] = None) -> Dict[str, Any]:
+        merged = {'ids': [], 'metadatas': [], 'documents': []}
+        for result in self._fan_out('get_all_documents', limit, include):
+            if not result or not result.get('ids'):
+                continue
+            for field in merged:
+                merged[field].extend(result.get(field) or [])
+        if limit:
+            merged = {field: values[:limit] for field, values in merged.items()}
+        return merged
+
+    def iter_documents(self, batch_size:int = BULK_BATCH_SIZE, include:Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        for store in self.shards.values():
+            yield from store.iter_documents(batch_size, include)
+
+    def delete_document(self, doc_id:str) -> bool:
+        return any(self._fan_out('delete_document', doc_id))
+
+    def update_document(self, doc_id:str, document:str, metadata:Dict[str,str]) -> bool:
+        # Route by the new metadata; a changed shard key moves the document between shards
+        strategy = self.manifest.get('strategy')
+        target = shard_key(metadata, strategy, self.manifest.get('shard_count', SHARD_COUNT)) if strategy else None
+        if strategy == 'language' and target not in self.shards:
+            self._add_language_shard(target)
+        if target not in self.shards:
+            return any(self._fan_out('update_document', doc_id, document, metadata))
+        for key, store in self.shards.items():
+            if key != target:
+                store.delete_document(doc_id)
+        store = self.shards[target]
+        store.write_records([doc_id], store.embed_texts([document]), [metadata], [document])
+        logger.info(f"Updated document {doc_id} in shard {target}")
+        return True
+
+    def upsert_documents(self, doc_ids:List[str], documents:List[str], metadatas:List[Dict[str,str]], batch_size:int = BULK_BATCH_SIZE, progress_callback:Optional[Callable[[int], None]] = None) -> Dict[str, int]:
+        strategy = self.manifest.get('strategy')
+        shard_count = self.manifest.get('shard_count', SHARD_COUNT)
+        groups = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(shard_key(metadata, strategy, shard_count), []).append(i)
+
+        if strategy == 'language':
+            for key in groups:
+                if key not in self.shards:
+                    self._add_language_shard(key)
+        unknown = [key for key in groups if key not in self.shards]
+        if unknown:
+            raise ValueError(f"No shard for keys {unknown}; rebuild shards to add new partitions")
+
+        # Drop ids from shards they no longer belong to before writing them to their target shard
+        for key, store in self.shards.items():
+            moved = [doc_ids[i] for other, indices in groups.items() if other != key for i in indices]
+            if moved:
+                store.delete_documents(moved, batch_size)
+
+        stats = {"embedded": 0, "metadata_only": 0, "batches": 0}
+        done = 0
+        for key, indices in groups.items():
+            shard_stats = self.shards[key].upsert_documents(
+                [doc_ids[i] for i in indices],
+                [documents[i] for i in indices],
+                [metadatas[i] for i in indices],
+                batch_size,
+                (lambda n, base=done: progress_callback(base + n)) if progress_callback else None
+            )
+            done += len(indices)
+            for field in stats:
+                stats[field] += shard_stats[field]
+        return stats
+
+    def delete_documents(self, doc_ids:List[str], batch_size:int = BULK_BATCH_SIZE, progress_callback:Optional[Callable[[int], None]] = None) -> int:
+        self._fan_out('delete_documents', doc_ids, batch_size)
+        if progress_callback:
+            progress_callback(len(doc_ids))
+        return len(doc_ids)
+
+    def get_document_count(self) -> int:
+        return sum(self._fan_out('get_document_count'))
@@ -0,0 +1,252 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+from typing import List, Dict, Optional, Any
+from vector_store import VectorStore
+from deadlines import Deadline, DeadlineExceeded, check_deadline
+from embedding_models import read_active_collection
+from jobs import JobContext
+from config import SHARED_INDEX_DIR, SNAPSHOT_BATCH_SIZE, ACTIVE_POINTER_CHECK_INTERVAL
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+INDEX_MANIFEST = 'index.json'
+VECTORS_FILE = 'vectors.npy'
+IDS_FILE = 'ids.npy'
+METADATA_FILE = 'metadata.jsonl'
+METADATA_OFFSETS_FILE = 'metadata_offsets.npy'
+
+def last_write_path(index_dir:str) -> str:
+    # Next to the index directory, so it survives the directory swap of a rebuild
+    return f"{index_dir}.last_write"
+
+def mark_written(index_dir:str) -> None:
+    """Record that the collection changed, which makes every worker stop trusting the current index"""
+    path = last_write_path(index_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(repr(time.time()))
+    os.replace(tmp_path, path)
+
+def read_last_write(index_dir:str) -> float:
+    try:
+        with open(last_write_path(index_dir)) as f:
+            return float(f.read())
+    except (FileNotFoundError, ValueError):
+        return 0.0
+
+def build_shared_index(store:VectorStore, output_dir:str = SHARED_INDEX_DIR, batch_size:int = SNAPSHOT_BATCH_SIZE) -> Dict[str, Any]:
+    """Dump vectors, ids and metadata into flat files every worker can memory-map read-only"""
+    # Writes after this moment may be missing from the dump, so they keep the new index stale
+    snapshot_at = time.time()
+    count = store.get_document_count()
+    tmp_dir = f"{output_dir}.building-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    vectors = None
+    ids = []
+    offsets = [0]
+    written = 0
+    with open(os.path.join(tmp_dir, METADATA_FILE), 'wb') as metadata_file:
+        for batch in store.iter_documents(batch_size, ["embeddings", "metadatas"]):
+            embeddings = np.asarray(batch['embeddings'], dtype=np.float32)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(os.path.join(tmp_dir, VECTORS_FILE), mode='w+', dtype=np.float32, shape=(count, embeddings.shape[1]))
+            rows = min(len(embeddings), count - written)
+            vectors[written:written + rows] = embeddings[:rows]
+            for metadata in batch['metadatas'][:rows]:
+                line = json.dumps(metadata).encode() + b"\n"
+                metadata_file.write(line)
+                offsets.append(offsets[-1] + len(line))
+            ids.extend(batch['ids'][:rows])
+            written += rows
+            if written >= count:
+                break
+
+    if vectors is not None:
+        vectors.flush()
+        del vectors
+    np.save(os.path.join(tmp_dir, IDS_FILE), np.array(ids, dtype=str))
+    np.save(os.path.join(tmp_dir, METADATA_OFFSETS_FILE), np.array(offsets, dtype=np.int64))
+    manifest = {
+        "collection_name": store.collection_name,
+        "embedding_model": store.model_key,
+        "count": written,
+        "snapshot_at": snapshot_at,
+        "built_at": time.time()
+    }
+    with open(os.path.join(tmp_dir, INDEX_MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    # Swap directories so workers never map a half-written index
+    old_dir = f"{output_dir}.old-{os.getpid()}"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(output_dir):
+        os.replace(output_dir, old_dir)
+    os.replace(tmp_dir, output_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    logger.info(f"Shared index with {written} vectors written to {output_dir}")
+    return manifest
+
+class SharedIndexStore:
+    """Serves vector queries by brute force over memory-mapped files shared by all worker processes.
+
+    Pages of the mapped files live once in the OS page cache, however many workers map them.
+    Documents, filtered queries and writes are delegated to the wrapped VectorStore. A write in
+    any worker marks the index stale, and queries go to Chroma until the index is rebuilt.
+    """
+
+    def __init__(self, store:VectorStore, index_dir:str = SHARED_INDEX_DIR):
+        self.store = store
+        self.index_dir = index_dir
+        self._manifest_mtime = None
+        self._last_check = 0.0
+        self.stale = True
+        self._load()
+
+    def __getattr__(self, name:str) -> Any:
+        return getattr(self.store, name)
+
+    def _load(self) -> None:
+        manifest_path = os.path.join(self.index_dir, INDEX_MANIFEST)
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        if self.manifest['embedding_model'] != self.store.model_key:
+            raise ValueError(f"Shared index was built with {self.manifest['embedding_model']}, collection uses {self.store.model_key}")
+        self.vectors = np.load(os.path.join(self.index_dir, VECTORS_FILE), mmap_mode='r')
+        self.ids = np.load(os.path.join(self.index_dir, IDS_FILE), mmap_mode='r')
+        self.metadata_offsets = np.load(os.path.join(self.index_dir, METADATA_OFFSETS_FILE), mmap_mode='r')
+        self.metadata = np.memmap(os.path.join(self.index_dir, METADATA_FILE), dtype=np.uint8, mode='r') if self.metadata_offsets[-1] else None
+        self._manifest_mtime = os.path.getmtime(manifest_path)
+        self._check_stale()
+        logger.info(f"Mapped shared index: {len(self.vectors)} vectors from {self.index_dir}")
+
+    def _check_stale(self) -> None:
+        snapshot_at = self.manifest.get('snapshot_at', self.manifest['built_at'])
+        stale = self.manifest['collection_name'] != self.store.collection_name or read_last_write(self.index_dir) > snapshot_at
+        if stale and not self.stale:
+            logger.warning(f"Shared index in {self.index_dir} is out of date, searching Chroma until it is rebuilt")
+        self.stale = stale
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._last_check < ACTIVE_POINTER_CHECK_INTERVAL:
+            return
+        self._last_check = now
+        manifest_path = os.path.join(self.index_dir, INDEX_MANIFEST)
+        if os.path.exists(manifest_path) and os.path.getmtime(manifest_path) != self._manifest_mtime:
+            self._load()
+        else:
+            self._check_stale()
+
+    def _metadata_at(self, row:int) -> Dict[str, Any]:
+        start, end = self.metadata_offsets[row], self.metadata_offsets[row + 1]
+        return json.loads(bytes(self.metadata[start:end]))
+
+    def search_by_text(self, query_text:str, n_results:int = 5, include:Optional[List[str]] = None, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None) -> Dict[str, Any]:
+
+        try:
+            logger.info(f"Searching shared index for: '{query_text}'")
+            check_deadline(deadline, "embedding the query")
+            return self.search_by_embedding(self.store.embed_texts([query_text])[0], n_results, include=include, deadline=deadline)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error searching shared index by text: {e}")
+            return {}
+
+    def search_by_embedding(self, query_embedding:List[float], n_results:int = 5, where:Optional[Dict[str, Any]] = None, include:Optional[List[str]] = None, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None) -> Dict[str, Any]:
+
+        self._refresh()
+        if where or self.stale:
+            return self.store.search_by_embedding(query_embedding, n_results, where=where, include=include, search_ef=search_ef, deadline=deadline)
+        # Brute force is exact, so search_ef has nothing to widen here
+        try:
+            check_deadline(deadline, "scanning the shared index")
+            include = include or ["metadatas", "documents", "distances"]
+            query = np.asarray(query_embedding, dtype=np.float32)
+            # Squared L2 like Chroma, computed as |v|^2 - 2 v.q + |q|^2 over the mapped matrix
+            scores = self.vectors @ query
+            n_results = min(n_results, len(scores))
+            top = np.argpartition(-scores, n_results - 1)[:n_results]
+            top = top[np.argsort(-scores[top])]
+            distances = (np.einsum('ij,ij->i', self.vectors[top], self.vectors[top]) - 2 * scores[top] + query @ query).tolist()
+
+            ids = [str(doc_id) for doc_id in self.ids[top]]
+            documents = None
+            if "documents" in include:
+                check_deadline(deadline, "fetching documents")
+                fetched = self.store.get_documents_by_ids(ids, include=["documents"])
+                by_id = dict(zip(fetched.get('ids', []), fetched.get('documents') or []))
+                documents = [[by_id.get(doc_id, '') for doc_id in ids]]
+            return {
+                'ids': [ids],
+                'distances': [distances] if "distances" in include else None,
+                'metadatas': [[self._metadata_at(row) for row in top]] if "metadatas" in include else None,
+                'documents': documents,
+                'embeddings': [self.vectors[top]] if "embeddings" in include else None
+            }
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error searching shared index by embedding: {e}")
+            return {}
+
+    # Writes
+
+    def _written(self) -> None:
+        self.stale = True
+        mark_written(self.index_dir)
+
+    def write_records(self, *args:Any, **kwargs:Any) -> None:
+        self.store.write_records(*args, **kwargs)
+        self._written()
+
+    def upsert_documents(self, *args:Any, **kwargs:Any) -> Dict[str, int]:
+        stats = self.store.upsert_documents(*args, **kwargs)
+        self._written()
+        return stats
+
+    def update_document(self, *args:Any, **kwargs:Any) -> bool:
+        updated = self.store.update_document(*args, **kwargs)
+        self._written()
+        return updated
+
+    def delete_document(self, *args:Any, **kwargs:Any) -> bool:
+        deleted = self.store.delete_document(*args, **kwargs)
+        self._written()
+        return deleted
+
+    def delete_documents(self, *args:Any, **kwargs:Any) -> int:
+        deleted = self.store.delete_documents(*args, **kwargs)
+        self._written()
+        return deleted
+
+def shared_index_job(search_engine, job:JobContext) -> Dict[str, Any]:
+    """Rebuild the shared index from the active collection; workers remap it within a second"""
+    if search_engine.sharded:
+        raise ValueError("The shared index is built for unsharded collections")
+    store = search_engine.vector_store
+    if hasattr(store, 'flush'):
+        store.flush()
+    job.stage("building")
+    return build_shared_index(store)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped index used by multi-worker serving")
+    parser.add_argument("--db-path", default="./chroma_db")
+    parser.add_argument("--collection", default=None, help="defaults to the active collection")
+    parser.add_argument("--output-dir", default=SHARED_INDEX_DIR)
+    args = parser.parse_args()
+
+    collection_name = args.collection
+    if collection_name is None:
+        pointer = read_active_collection(args.db_path)
+        collection_name = pointer['collection_name'] if pointer else "books_story"
+    print(build_shared_index(VectorStore(collection_name, args.db_path), args.output_dir))
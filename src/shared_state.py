@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Iterator
+from config import SHARED_STATE_PATH, SHARED_STATE_BUSY_TIMEOUT, ACTIVE_POINTER_CHECK_INTERVAL
+
+WORKER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    pid INTEGER PRIMARY KEY,
+    seen_at REAL NOT NULL,
+    migration TEXT
+);
+"""
+
+WRITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS collection_writes (
+    collection_name TEXT PRIMARY KEY,
+    written_at REAL NOT NULL
+);
+"""
+
+def pid_alive(pid:int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class SqliteConnections:
+    """Connections to one sqlite file shared by every worker process of a host.
+
+    Each thread of each process gets its own connection, opened in WAL mode so readers never
+    wait for a writer. Call the object to get the current thread's connection.
+    """
+
+    def __init__(self, path:str, schema:Optional[str] = None, timeout:float = SHARED_STATE_BUSY_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+        if schema:
+            self().executescript(schema)
+
+    def __call__(self) -> sqlite3.Connection:
+        # A connection must not cross a fork, so it is keyed by pid as well as thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Read-modify-write under the database write lock, so two workers cannot interleave"""
+        connection = self()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+class WorkerRegistry:
+    """Which migration target each serving worker mirrors writes into, so a migration can wait for all of them"""
+
+    def __init__(self, path:str = SHARED_STATE_PATH):
+        self._connection = SqliteConnections(path, WORKER_SCHEMA)
+
+    def acknowledge(self, migration:Optional[str]) -> None:
+        """Record that every write this worker starts from now on also goes to migration (None: no mirror)"""
+        self._connection().execute(
+            "INSERT INTO workers (pid, seen_at, migration) VALUES (?, ?, ?) "
+            "ON CONFLICT (pid) DO UPDATE SET seen_at = excluded.seen_at, migration = excluded.migration",
+            (os.getpid(), time.time(), migration)
+        )
+
+    def leave(self) -> None:
+        self._connection().execute("DELETE FROM workers WHERE pid = ?", (os.getpid(),))
+
+    def pending(self, migration:str) -> List[int]:
+        """Live workers that have not acknowledged migration yet; rows of exited workers are dropped"""
+        pending = []
+        for pid, acknowledged in self._connection().execute("SELECT pid, migration FROM workers").fetchall():
+            if not pid_alive(pid):
+                self._connection().execute("DELETE FROM workers WHERE pid = ?", (pid,))
+            elif acknowledged != migration:
+                pending.append(pid)
+        return pending
+
+    def wait_for(self, migration:str, timeout:float) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            pending = self.pending(migration)
+            if not pending:
+                return
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Workers {pending} did not start mirroring writes into {migration} within {timeout:.0f}s")
+            time.sleep(ACTIVE_POINTER_CHECK_INTERVAL / 2)
+
+class WriteClock:
+    """When any worker last wrote each collection, so data derived from it can tell it is out of date"""
+
+    def __init__(self, path:str = SHARED_STATE_PATH):
+        self._connection = SqliteConnections(path, WRITE_SCHEMA)
+
+    def mark(self, collection_name:str) -> None:
+        self._connection().execute(
+            "INSERT INTO collection_writes (collection_name, written_at) VALUES (?, ?) "
+            "ON CONFLICT (collection_name) DO UPDATE SET written_at = MAX(written_at, excluded.written_at)",
+            (collection_name, time.time())
+        )
+
+    def last(self, collection_name:str) -> float:
+        row = self._connection().execute("SELECT written_at FROM collection_writes WHERE collection_name = ?", (collection_name,)).fetchone()
+        return row[0] if row else 0.0
@@ -0,0 +1,176 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import time
+import numpy as np
+from typing import Dict, Optional, Any
+from vector_store import VectorStore
+from embedding_models import set_active_collection, read_active_collection
+from config import SNAPSHOT_DIR, SNAPSHOT_BATCH_SIZE
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+VECTORS_FILE = 'vectors.npy'
+RECORDS_FILE = 'records.jsonl'
+EXPORT_ATTEMPTS = 3
+
+def _sha256(path:str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _row_digest(metadata:Optional[Dict[str, Any]]) -> str:
+    # The metadata carries the text's content_hash, so this also changes when only the text does
+    return hashlib.sha256(json.dumps(metadata, sort_keys=True).encode()).hexdigest()
+
+def _write_members(store:VectorStore, work_dir:str, batch_size:int) -> Optional[int]:
+    """Dump vectors and records; returns the row count, or None if the collection changed meanwhile.
+
+    Rows are read by a fixed id list, then every id and row digest is compared with a re-read
+    of the collection, so an update or a delete-plus-add during the dump is caught too.
+    """
+    doc_ids = store.get_ids()
+    vectors = None
+    written = {}
+    with open(os.path.join(work_dir, RECORDS_FILE), 'w') as records:
+        for start in range(0, len(doc_ids), batch_size):
+            batch = store.get_documents_by_ids(doc_ids[start:start + batch_size], include=["embeddings", "metadatas", "documents"])
+            if not batch or len(batch['ids']) != len(doc_ids[start:start + batch_size]):
+                return None
+            embeddings = np.asarray(batch['embeddings'], dtype=np.float32)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(os.path.join(work_dir, VECTORS_FILE), mode='w+', dtype=np.float32, shape=(len(doc_ids), embeddings.shape[1]))
+            vectors[start:start + len(embeddings)] = embeddings
+            for doc_id, metadata, document in zip(batch['ids'], batch['metadatas'], batch['documents']):
+                records.write(json.dumps({"id": doc_id, "metadata": metadata, "document": document}) + "\n")
+                written[doc_id] = _row_digest(metadata)
+
+    if vectors is not None:
+        vectors.flush()
+        del vectors
+    current = {}
+    for batch in store.iter_documents(batch_size, ["metadatas"]):
+        current.update((doc_id, _row_digest(metadata)) for doc_id, metadata in zip(batch['ids'], batch['metadatas']))
+    if current != written:
+        return None
+    return len(doc_ids)
+
+def export_snapshot(collection_name:Optional[str] = None, db_path:str = "./chroma_db", output_dir:str = SNAPSHOT_DIR, batch_size:int = SNAPSHOT_BATCH_SIZE) -> str:
+    """Write a versioned .tar.gz of vectors, ids, metadata and documents with a checksummed manifest"""
+    if collection_name is None:
+        pointer = read_active_collection(db_path)
+        collection_name = pointer['collection_name'] if pointer else "books_story"
+    store = VectorStore(collection_name, db_path)
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as work_dir:
+        # Chroma has no read snapshots: start over if any row was added, changed or removed during the export
+        for attempt in range(1, EXPORT_ATTEMPTS + 1):
+            count = _write_members(store, work_dir, batch_size)
+            if count is not None:
+                break
+            logger.warning(f"Collection changed during export, retrying ({attempt}/{EXPORT_ATTEMPTS})")
+        else:
+            raise RuntimeError(f"Collection {collection_name} kept changing; pause writes and retry")
+
+        manifest = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "created_at": time.time(),
+            "collection_name": collection_name,
+            "collection_metadata": store.collection.metadata or {},
+            "embedding_model": store.model_key,
+            "count": count,
+            "files": {name: _sha256(os.path.join(work_dir, name)) for name in (VECTORS_FILE, RECORDS_FILE) if os.path.exists(os.path.join(work_dir, name))}
+        }
+        with open(os.path.join(work_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        archive_path = os.path.join(output_dir, f"snapshot-{collection_name}-{time.strftime('%Y%m%d-%H%M%S')}.tar.gz")
+        with tarfile.open(f"{archive_path}.tmp", 'w:gz') as archive:
+            for name in [MANIFEST_FILE, *manifest['files']]:
+                archive.add(os.path.join(work_dir, name), arcname=name)
+        os.replace(f"{archive_path}.tmp", archive_path)
+
+    logger.info(f"Exported {count} documents to {archive_path} in {time.perf_counter() - started:.1f}s")
+    return archive_path
+
+def import_snapshot(archive_path:str, db_path:str = "./chroma_db", collection_name:Optional[str] = None, activate:bool = True, batch_size:Optional[int] = None) -> Dict[str, Any]:
+    """Verify a snapshot and bulk-load it into a fresh collection without re-embedding anything"""
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as work_dir:
+        with tarfile.open(archive_path, 'r:gz') as archive:
+            for member in archive.getmembers():
+                if not member.isfile() or os.path.basename(member.name) != member.name:
+                    raise ValueError(f"Unexpected archive member: {member.name}")
+            archive.extractall(work_dir)
+
+        with open(os.path.join(work_dir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format {manifest.get('format_version')}")
+        for name, checksum in manifest['files'].items():
+            if _sha256(os.path.join(work_dir, name)) != checksum:
+                raise ValueError(f"Checksum mismatch for {name}")
+
+        collection_name = collection_name or manifest['collection_name']
+        # HNSW parameters are fixed when a collection is created, so it is created with the exported ones
+        metadata = manifest.get('collection_metadata') or None
+        store = VectorStore(collection_name, db_path, model_key=manifest['embedding_model'], metadata=metadata)
+        if store.get_document_count():
+            raise ValueError(f"Collection {collection_name} in {db_path} is not empty")
+        if metadata and (store.collection.metadata or {}) != metadata:
+            store.drop_collection(collection_name)
+            store = VectorStore(collection_name, db_path, model_key=manifest['embedding_model'], metadata=metadata)
+
+        count = manifest['count']
+        if count:
+            vectors = np.load(os.path.join(work_dir, VECTORS_FILE), mmap_mode='r')
+            batch_size = batch_size or store.client.get_max_batch_size()
+            with open(os.path.join(work_dir, RECORDS_FILE)) as records:
+                loaded = 0
+                while loaded < count:
+                    rows = [json.loads(next(records)) for _ in range(min(batch_size, count - loaded))]
+                    store.write_records(
+                        [row['id'] for row in rows],
+                        vectors[loaded:loaded + len(rows)].tolist(),
+                        [row['metadata'] for row in rows],
+                        [row['document'] for row in rows],
+                        method="add"
+                    )
+                    loaded += len(rows)
+                    logger.info(f"Loaded {loaded}/{count} documents")
+
+    if activate:
+        set_active_collection(db_path, collection_name, manifest['embedding_model'])
+    elapsed = time.perf_counter() - started
+    logger.info(f"Imported {count} documents into {collection_name} in {elapsed:.1f}s")
+    return {"collection_name": collection_name, "count": count, "seconds": round(elapsed, 2)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or import a vector store snapshot")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("--collection", default=None, help="defaults to the active collection")
+    export_parser.add_argument("--db-path", default="./chroma_db")
+    export_parser.add_argument("--output-dir", default=SNAPSHOT_DIR)
+    import_parser = subparsers.add_parser("import")
+    import_parser.add_argument("archive")
+    import_parser.add_argument("--db-path", default="./chroma_db")
+    import_parser.add_argument("--collection", default=None)
+    import_parser.add_argument("--no-activate", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(export_snapshot(args.collection, args.db_path, args.output_dir))
+    else:
+        print(import_snapshot(args.archive, args.db_path, args.collection, activate=not args.no_activate))
@@ -1,11 +1,12 @@
 # Streamlit Frontend Demo
 import streamlit as st
-import requests
 import json
-from typing import List, Dict, Any, Optional
+import math
+import time
+from typing import List, Dict, Any, Optional, Callable
 import pandas as pd
+from api_client import make_api_request
 from config import (
-    API_BASE_URL,
     Streamlit_page_title,
     Streamlit_page_icon,
     Streamlit_layout,
@@ -13,6 +14,8 @@ from config import (
     DEFAULT_RESULTS_COUNT,
     MAX_RESULTS_COUNT,
     MIN_RESULTS_COUNT,
+    UI_PAGE_SIZE,
+    UI_PREVIEW_CHARS,
     Card_columns_ratio,
     Display_settings
 )
@@ -25,21 +28,6 @@ st.set_page_config(
     initial_sidebar_state=Streamlit_initial_sidebar_state
 )
 
-def make_api_request(endpoint: str, method: str = "GET", data: Optional[Dict] = None) -> Optional[Dict]:
-    """Make API request to FastAPI backend"""
-    try:
-        url = f"{API_BASE_URL}{endpoint}"
-        if method == "GET":
-            response = requests.get(url)
-        elif method == "POST":
-            response = requests.post(url, json=data)
-        
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"API Error: {str(e)}")
-        return None
-
 def display_book_card(book: Dict[str, Any], index: int):
     """Display a book in a card format"""
     with st.container():
@@ -56,12 +44,57 @@ def display_book_card(book: Dict[str, Any], index: int):
             if Display_settings["show_similarity_score"] and book.get('similarity_score'):
                 st.markdown(f"**Similarity Score:** {book.get('similarity_score'):.4f}")
             
-            if Display_settings["show_preview_expander"] and book.get('document_preview'):
-                with st.expander("Full Content"):
-                    st.text_area("Book Content", book.get('document_preview', ''), height=300)
+            if book.get('document_preview'):
+                st.caption(f"{book['document_preview']}…")
+            
+            # Searches only carry a preview; the full text is fetched once the card is opened
+            if Display_settings["show_preview_expander"] and st.toggle("Full Content", key=f"open_{index}_{book.get('id')}"):
+                with st.spinner("Loading book..."):
+                    details = make_api_request(f"/book/{book.get('id')}")
+                if details:
+                    st.text_area("Book Content", details.get('document_preview', ''), height=300, key=f"text_{index}_{book.get('id')}")
             
             st.divider()
 
+def run_search(endpoint: str, summary: Callable[[Dict[str, Any]], str], method: str = "GET", data: Optional[Dict] = None):
+    """Fetch preview-only results and keep them in session state, so paging does not search again"""
+    started = time.perf_counter()
+    response = make_api_request(endpoint, method=method, data=data)
+    if response:
+        st.session_state.search = {
+            "response": response,
+            "summary": summary(response),
+            "payload_kb": len(json.dumps(response, ensure_ascii=False).encode()) / 1024,
+            "request_ms": (time.perf_counter() - started) * 1000
+        }
+        st.session_state.page = 0
+
+def turn_page(step: int):
+    st.session_state.page += step
+
+def display_results():
+    """Render one page of result cards from the last search"""
+    search = st.session_state.get("search")
+    if not search:
+        return
+    started = time.perf_counter()
+    results = search["response"].get('results', [])
+    pages = max(1, math.ceil(len(results) / UI_PAGE_SIZE))
+    page = min(st.session_state.get("page", 0), pages - 1)
+    st.success(search["summary"])
+    
+    for i in range(page * UI_PAGE_SIZE, min(len(results), (page + 1) * UI_PAGE_SIZE)):
+        display_book_card(results[i], i)
+    
+    if pages > 1:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        col1.button("← Previous", disabled=page == 0, on_click=turn_page, args=(-1,))
+        col2.markdown(f"Page {page + 1} of {pages}")
+        col3.button("Next →", disabled=page == pages - 1, on_click=turn_page, args=(1,))
+    
+    if Display_settings["show_render_stats"]:
+        st.caption(f"Response {search['payload_kb']:.1f} KB in {search['request_ms']:.0f} ms · page rendered in {(time.perf_counter() - started) * 1000:.0f} ms")
+
 def main():
     # Header
     st.title("📚 Vector Store Book Search")
@@ -99,16 +132,12 @@ def main():
             
             if submitted and query:
                 with st.spinner("Searching..."):
-                    response = make_api_request("/search", method="POST", data={
-                        "query": query,
-                        "n_results": n_results
-                    })
-                    
-                    if response:
-                        st.success(f"Found {response.get('total_found', 0)} results for '{query}'")
-                        
-                        for i, book in enumerate(response.get('results', [])):
-                            display_book_card(book, i)
+                    run_search(
+                        "/search",
+                        lambda response: f"Found {response.get('total_found', 0)} results for '{query}'",
+                        method="POST",
+                        data={"query": query, "n_results": n_results, "preview_chars": UI_PREVIEW_CHARS}
+                    )
     
     elif search_type == "Author Search":
         st.header("👤 Author Search")
@@ -119,13 +148,11 @@ def main():
             
             if submitted and author:
                 with st.spinner("Searching..."):
-                    response = make_api_request(f"/search/author/{author}?n_results={n_results}")
-                    
-                    if response:
-                        st.success(f"Found {response.get('total_found', 0)} books by '{author}'")
-                        
-                        for i, book in enumerate(response.get('results', [])):
-                            display_book_card(book, i)
+                    # The API matches the stored spelling, which may differ from what was typed
+                    run_search(
+                        f"/search/author/{author}?n_results={n_results}&preview_chars={UI_PREVIEW_CHARS}",
+                        lambda response: f"Found {response.get('total_found', 0)} books by '{response.get('query', '').split(':', 1)[-1] or author}'"
+                    )
     
     elif search_type == "Language Search":
         st.header("🌍 Language Search")
@@ -136,13 +163,10 @@ def main():
             
             if submitted and language:
                 with st.spinner("Searching..."):
-                    response = make_api_request(f"/search/language/{language}?n_results={n_results}")
-                    
-                    if response:
-                        st.success(f"Found {response.get('total_found', 0)} books in '{language}'")
-                        
-                        for i, book in enumerate(response.get('results', [])):
-                            display_book_card(book, i)
+                    run_search(
+                        f"/search/language/{language}?n_results={n_results}&preview_chars={UI_PREVIEW_CHARS}",
+                        lambda response: f"Found {response.get('total_found', 0)} books in '{response.get('query', '').split(':', 1)[-1] or language}'"
+                    )
     
     elif search_type == "Advanced Search":
         st.header("⚙️ Advanced Search")
@@ -161,18 +185,20 @@ def main():
             
             if submitted and query:
                 with st.spinner("Searching..."):
-                    response = make_api_request("/search", method="POST", data={
-                        "query": query,
-                        "n_results": n_results,
-                        "author": author if author else None,
-                        "language": language if language else None
-                    })
-                    
-                    if response:
-                        st.success(f"Found {response.get('total_found', 0)} results")
-                        
-                        for i, book in enumerate(response.get('results', [])):
-                            display_book_card(book, i)
+                    run_search(
+                        "/search",
+                        lambda response: f"Found {response.get('total_found', 0)} results",
+                        method="POST",
+                        data={
+                            "query": query,
+                            "n_results": n_results,
+                            "author": author if author else None,
+                            "language": language if language else None,
+                            "preview_chars": UI_PREVIEW_CHARS
+                        }
+                    )
+    
+    display_results()
     
     # Book details section
     st.header("📖 Book Details")
@@ -208,7 +234,7 @@ def main():
         ```python
         # Search for books
         response = requests.post("http://localhost:8000/search", 
-                               json={"query": "adventure", "n_results": 5})
+                               json={"query": "adventure", "n_results": 5, "preview_chars": 300})
         
         # Get book details
         book = requests.get("http://localhost:8000/book/doc_0")
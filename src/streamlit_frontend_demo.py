@@ -1,11 +1,10 @@
 # Streamlit Frontend Demo
 import streamlit as st
-import requests
 import json
 from typing import List, Dict, Any, Optional
 import pandas as pd
+from api_client import make_api_request
 from config import (
-    API_BASE_URL,
     Streamlit_page_title,
     Streamlit_page_icon,
     Streamlit_layout,
@@ -25,21 +24,6 @@ st.set_page_config(
     initial_sidebar_state=Streamlit_initial_sidebar_state
 )
 
-def make_api_request(endpoint: str, method: str = "GET", data: Optional[Dict] = None) -> Optional[Dict]:
-    """Make API request to FastAPI backend"""
-    try:
-        url = f"{API_BASE_URL}{endpoint}"
-        if method == "GET":
-            response = requests.get(url)
-        elif method == "POST":
-            response = requests.post(url, json=data)
-        
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"API Error: {str(e)}")
-        return None
-
 def display_book_card(book: Dict[str, Any], index: int):
     """Display a book in a card format"""
     with st.container():
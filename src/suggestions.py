@@ -0,0 +1,238 @@
+import bisect
+import heapq
+import logging
+import re
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from typing import List, Dict, Optional, Any, Tuple
+from config import (
+    SUGGEST_FIELDS,
+    SUGGEST_LIMIT,
+    MAX_SUGGEST_LIMIT,
+    SUGGEST_MIN_SIMILARITY,
+    SUGGEST_RESOLVE_MIN_SIMILARITY,
+    SUGGEST_FUZZY_CANDIDATES,
+    SUGGEST_PRECOMPUTED_PREFIX,
+    BULK_BATCH_SIZE
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_non_word = re.compile(r'[^a-z0-9]+')
+
+def normalize_name(value:str) -> str:
+    """Lowercase, strip accents and punctuation so 'Brontë, Charlotte' matches 'bronte charlotte'"""
+    value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore').decode()
+    return _non_word.sub(' ', value.lower()).strip()
+
+def trigrams(value:str, pad_end:bool = True) -> set:
+    # Queries are still being typed, so only names get an end marker
+    padded = f"  {value} " if pad_end else f"  {value}"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def edit_distance(a:str, b:str) -> int:
+    """Levenshtein distance that also counts a swap of adjacent characters as one edit"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+def similarity(a:str, b:str) -> float:
+    return 1.0 - edit_distance(a, b) / max(len(a), len(b), 1)
+
+def _words_match(tokens:List[str], words:List[str], whole_words:bool) -> bool:
+    """Whether every token starts (or with whole_words, equals) a different one of words"""
+    if not tokens:
+        return True
+    token, rest = tokens[0], tokens[1:]
+    for i, word in enumerate(words):
+        if (word == token if whole_words else word.startswith(token)) and _words_match(rest, words[:i] + words[i + 1:], whole_words):
+            return True
+    return False
+
+class SuggestionIndex:
+    """In-memory autocomplete over the distinct titles, authors and languages of a collection.
+
+    Prefix lookups bisect a sorted key list (a flattened trie) with ready top lists for short
+    prefixes; typos fall back to a trigram inverted index re-ranked by edit distance.
+    Every name is keyed by its full form and by each word-start suffix, so 'twain' finds
+    'Twain, Mark' and 'mark' finds it too.
+    """
+
+    def __init__(self, counts:Dict[Tuple[str, str], int], collection_name:Optional[str] = None, snapshot_at:Optional[float] = None):
+        self.collection_name = collection_name
+        self.built_at = time.monotonic()
+        # Wall-clock time the counted metadata was read, to compare with the collection's last write
+        self.snapshot_at = time.time() if snapshot_at is None else snapshot_at
+        # Most frequent names first, so entry ids double as a popularity ranking
+        self.entries = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        self.normalized = [normalize_name(value) for (_, value), _ in self.entries]
+        self.exact:Dict[Tuple[str, str], int] = {}
+        keys = []
+        postings = defaultdict(list)
+        for entry_id, ((field, _), _) in enumerate(self.entries):
+            name = self.normalized[entry_id]
+            if not name:
+                continue
+            self.exact.setdefault((field, name), entry_id)
+            keys.extend((key, entry_id) for key in self._keys_of(entry_id))
+            for gram in trigrams(name):
+                postings[gram].append(entry_id)
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.key_entries = [entry_id for _, entry_id in keys]
+        self.postings = dict(postings)
+
+        # Short prefixes match most of the key list, so their best names are ranked once here
+        top = defaultdict(set)
+        for key, entry_id in keys:
+            field = self.entries[entry_id][0][0]
+            for length in range(1, min(SUGGEST_PRECOMPUTED_PREFIX, len(key)) + 1):
+                top[(None, key[:length])].add(entry_id)
+                top[(field, key[:length])].add(entry_id)
+        self.top_prefixes = {prefix: heapq.nsmallest(MAX_SUGGEST_LIMIT, ids) for prefix, ids in top.items()}
+        logger.info(f"Suggestion index built: {len(self.entries)} names, {len(self.keys)} keys")
+
+    @classmethod
+    def from_store(cls, store:Any, fields:List[str] = SUGGEST_FIELDS, batch_size:int = BULK_BATCH_SIZE) -> "SuggestionIndex":
+        """Count distinct field values over the collection's metadata only"""
+        snapshot_at = time.time()
+        counts = Counter()
+        for batch in store.iter_documents(batch_size, ["metadatas"]):
+            for metadata in batch.get('metadatas') or []:
+                for field in fields:
+                    value = (metadata or {}).get(field)
+                    if value and str(value).strip():
+                        counts[(field, str(value).strip())] += 1
+        return cls(counts, getattr(store, 'collection_name', None), snapshot_at)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _suggestion(self, entry_id:int, match:str, score:float) -> Dict[str, Any]:
+        (field, value), count = self.entries[entry_id]
+        return {"value": value, "field": field, "count": count, "match": match, "score": round(score, 3)}
+
+    def _prefix_ids(self, prefix:str, field:Optional[str], limit:int) -> List[int]:
+        if len(prefix) <= SUGGEST_PRECOMPUTED_PREFIX:
+            return self.top_prefixes.get((field, prefix), [])[:limit]
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + '\x7f', start)
+        candidates = {
+            entry_id for entry_id in self.key_entries[start:end]
+            if field is None or self.entries[entry_id][0][0] == field
+        }
+        return heapq.nsmallest(limit, candidates)
+
+    def _fuzzy_ids(self, query:str, field:Optional[str], limit:int, complete:bool) -> List[Tuple[int, float]]:
+        lists = sorted((self.postings.get(gram, ()) for gram in trigrams(query, pad_end=complete)), key=len)
+        # Trigrams shared by a tenth of all names barely narrow the candidates but dominate the cost
+        common = max(len(self.entries) // 10, SUGGEST_FUZZY_CANDIDATES)
+        shared = Counter()
+        for posting in lists:
+            if len(posting) > common and shared:
+                break
+            shared.update(posting)
+        scored = []
+        for entry_id, _ in shared.most_common(SUGGEST_FUZZY_CANDIDATES):
+            if field is not None and self.entries[entry_id][0][0] != field:
+                continue
+            # Compare against each word-start suffix, cut to the query's length while it is still being
+            # typed, or to its word count once complete so 'shakspeare' still reaches 'shakespeare william'
+            if complete:
+                words = len(query.split(' '))
+                score = max(similarity(query, ' '.join(key.split(' ')[:words])) for key in self._keys_of(entry_id))
+                # Word order differs between 'Mark Twain' and 'Twain, Mark'
+                score = max(score, similarity(' '.join(sorted(query.split(' '))), ' '.join(sorted(self.normalized[entry_id].split(' ')))))
+            else:
+                score = max(similarity(query, key[:len(query)]) for key in self._keys_of(entry_id))
+            if score >= SUGGEST_MIN_SIMILARITY:
+                scored.append((entry_id, score))
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored[:limit]
+
+    def _reordered_ids(self, query:str, field:Optional[str], limit:int, whole_words:bool = False) -> List[int]:
+        """Names holding each typed word as the start of a different word of theirs, in any order,
+        so 'mark tw' finds 'Twain, Mark'; with whole_words every typed word must be a full word"""
+        tokens = query.split(' ')
+        if len(tokens) < 2:
+            return []
+        # The longest word narrows the key range most
+        anchor = max(tokens, key=len)
+        start = bisect.bisect_left(self.keys, anchor)
+        end = bisect.bisect_left(self.keys, anchor + '\x7f', start)
+        matched = []
+        for entry_id in sorted(set(self.key_entries[start:end])):
+            if field is not None and self.entries[entry_id][0][0] != field:
+                continue
+            if _words_match(tokens, self.normalized[entry_id].split(' '), whole_words):
+                matched.append(entry_id)
+                if len(matched) == limit:
+                    break
+        return matched
+
+    def suggest(self, prefix:str, field:Optional[str] = None, limit:int = SUGGEST_LIMIT) -> List[Dict[str, Any]]:
+        """Prefix matches ranked by how many books carry the name, then names with the typed words in
+        another order; typo matches when neither finds anything"""
+        query = normalize_name(prefix)
+        if not query:
+            return []
+        prefix_ids = self._prefix_ids(query, field, limit)
+        suggestions = [self._suggestion(entry_id, "prefix", 1.0) for entry_id in prefix_ids]
+        if len(suggestions) < limit:
+            for entry_id in self._reordered_ids(query, field, limit):
+                if entry_id not in prefix_ids and len(suggestions) < limit:
+                    suggestions.append(self._suggestion(entry_id, "reordered", 1.0))
+        if not suggestions and len(query) >= 3:
+            scores = dict(self._fuzzy_ids(query, field, limit, complete=False))
+            if ' ' in query:
+                # 'mark twian' only lines up with 'twain mark' once both are compared word by word in sorted order
+                for entry_id, score in self._fuzzy_ids(query, field, limit, complete=True):
+                    scores[entry_id] = max(score, scores.get(entry_id, 0.0))
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+            suggestions = [self._suggestion(entry_id, "fuzzy", score) for entry_id, score in ranked]
+        return suggestions
+
+    def resolve(self, name:str, field:str) -> Optional[str]:
+        """Canonical stored value for a user-typed name: exact, then whole words in the name's order or
+        another, then a typo of the whole name scoring at least SUGGEST_RESOLVE_MIN_SIMILARITY.
+
+        Partial words are never rewritten, since 'mar' or 'mark tw' may mean many names;
+        suggest() still offers them.
+        """
+        query = normalize_name(name)
+        if not query:
+            return None
+        if (field, query) in self.exact:
+            return self.entries[self.exact[(field, query)]][0][1]
+        for entry_id in self._prefix_ids(query, field, MAX_SUGGEST_LIMIT):
+            # 'shakespeare' may stand for 'Shakespeare, William' but 'shakes' may not
+            if any(key == query or key.startswith(query + ' ') for key in self._keys_of(entry_id)):
+                return self.entries[entry_id][0][1]
+        reordered = self._reordered_ids(query, field, 1, whole_words=True)
+        if reordered:
+            return self.entries[reordered[0]][0][1]
+        fuzzy = self._fuzzy_ids(query, field, 1, complete=True)
+        if fuzzy and fuzzy[0][1] >= SUGGEST_RESOLVE_MIN_SIMILARITY:
+            return self.entries[fuzzy[0][0]][0][1]
+        return None
+
+    def values_containing(self, field:str, needles:List[str]) -> List[str]:
+        """Stored values of a field containing any of the needles, case-insensitively"""
+        needles = [needle.lower() for needle in needles if needle]
+        return [value for (entry_field, value), _ in self.entries if entry_field == field and any(needle in value.lower() for needle in needles)]
+
+    def _keys_of(self, entry_id:int) -> List[str]:
+        words = self.normalized[entry_id].split(' ')
+        return [' '.join(words[w:]) for w in range(len(words))]
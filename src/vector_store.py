@@ -2,16 +2,22 @@ from webbrowser import get
 import chromadb
 import logging 
 import numpy as np 
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Callable, Iterator
+from embedding_models import collection_metadata, encode_texts
+from deadlines import Deadline, DeadlineExceeded, check_deadline
+from document_store import open_document_store, content_hash, text_key
+from config import BULK_BATCH_SIZE, ACTIVE_EMBEDDING_MODEL, LEGACY_EMBEDDING_MODEL, DOCUMENT_STORE_ENABLED
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class VectorStore:
 
-    def __init__(self, collection_name:str = "books_story", db_path:str = "./chroma_db"):
+    def __init__(self, collection_name:str = "books_story", db_path:str = "./chroma_db", model_key:Optional[str] = None, text_namespace:Optional[str] = None, metadata:Optional[Dict[str, Any]] = None):
         self.db_path = db_path
         self.collection_name = collection_name
+        # Texts are keyed by collection, so rebuilding one never changes what another returns
+        self.text_namespace = text_namespace or collection_name
     
         logger.info(f"Initializing ChromDB client at {db_path}")
         self.client = chromadb.PersistentClient(path=db_path)
@@ -20,44 +26,143 @@ class VectorStore:
             self.collection = self.client.get_collection(collection_name)
             logger.info(f"Using exisiting collection: {collection_name}")
         except: 
-            self.collection = self.client.create_collection(collection_name)
+            # metadata overrides the defaults, e.g. to restore a snapshot's HNSW parameters
+            self.collection = self.client.create_collection(
+                collection_name,
+                metadata=metadata or collection_metadata(model_key or ACTIVE_EMBEDDING_MODEL)
+            )
             logger.info(f"Created new collection:{collection_name}")
 
+        # Queries are always embedded with the model the collection was built with
+        stored_key = (self.collection.metadata or {}).get('embedding_model', LEGACY_EMBEDDING_MODEL)
+        if model_key and model_key != stored_key:
+            raise ValueError(f"Collection {collection_name} was built with {stored_key}, not {model_key}")
+        self.model_key = stored_key
+        # Full texts live in a compressed store shared by the collections of this db_path
+        self.documents = open_document_store(db_path) if DOCUMENT_STORE_ENABLED else None
+
+    def _chroma_include(self, include:List[str]) -> List[str]:
+        return [field for field in include if field != "documents"] if self.documents is not None else include
+
+    def _text_keys(self, doc_ids:List[str]) -> List[str]:
+        return [text_key(self.text_namespace, doc_id) for doc_id in doc_ids]
+
+    def _read_texts(self, doc_ids:List[str], length:Optional[int] = None) -> List[Optional[str]]:
+        """Texts from the document store; ids stored before keys were namespaced are read under their bare id"""
+        read = (lambda key: self.documents.get(key)) if length is None else (lambda key: self.documents.read_passage(key, 0, length))
+        texts = [read(key) for key in self._text_keys(doc_ids)]
+        return [read(doc_id) if text is None else text for doc_id, text in zip(doc_ids, texts)]
+
+    def _attach_documents(self, results:Dict[str, Any], include:List[str], nested:bool = False) -> Dict[str, Any]:
+        """Fill 'documents' from the document store, falling back to Chroma for rows written before it existed"""
+        if self.documents is None or "documents" not in include or not results or results.get('ids') is None:
+            return results
+        filled = []
+        for ids in (results['ids'] if nested else [results['ids']]):
+            texts = self._read_texts(ids)
+            missing = [doc_id for doc_id, text in zip(ids, texts) if text is None]
+            if missing:
+                legacy = self.collection.get(ids=missing, include=["documents"])
+                by_id = dict(zip(legacy['ids'], legacy['documents']))
+                texts = [by_id.get(doc_id) or '' if text is None else text for doc_id, text in zip(ids, texts)]
+            filled.append(texts)
+        results['documents'] = filled if nested else filled[0]
+        return results
+
+    def write_records(self, doc_ids:List[str], embeddings:Any, metadatas:List[Dict[str, Any]], documents:List[str], method:str = "upsert") -> None:
+        """Write rows whose vectors are already computed; Chroma keeps only vectors, metadata and a content hash"""
+        metadatas = [dict(metadata, content_hash=content_hash(document or '')) for metadata, document in zip(metadatas, documents)]
+        if self.documents is not None:
+            self.documents.put_many(self._text_keys(doc_ids), documents)
+            documents = None
+        getattr(self.collection, method)(
+            ids=doc_ids,
+            embeddings=embeddings,
+            metadatas=metadatas,
+            documents=documents
+        )
+
+    def embed_texts(self, texts:List[str]) -> List[List[float]]:
+        return encode_texts(self.model_key, texts).tolist()
+
     def get_collection_info(self) -> Dict[str, Any]:
         try:
             count = self.collection.count()
             return{
             "collection_name": self.collection_name,
             "document_count": count,
-            "db_path": self.db_path        
+            "db_path": self.db_path,
+            "embedding_model": self.model_key
             }
         except Exception as e:
             logger.error(f"Error getting collection info: {e}")
             return {}
 
-    def search_by_text(self, query_text:str, n_results:int = 5) -> Dict[str, Any]:
+    def search_by_text(self, query_text:str, n_results:int = 5, include:Optional[List[str]] = None, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None) -> Dict[str, Any]:
 
         try:
             logger.info(f"Searching for: '{query_text}'")
-            results = self.collection.query(
-                query_texts=[query_text],
-                n_results=n_results
-            )
-            return results
+            check_deadline(deadline, "embedding the query")
+            return self.search_by_embedding(self.embed_texts([query_text])[0], n_results, include=include, search_ef=search_ef, deadline=deadline)
+        except DeadlineExceeded:
+            raise
         except Exception as e: 
             logger.error(f"Error searching by text: {e}")
             return {}
 
+    def search_by_embedding(self, query_embedding:List[float], n_results:int = 5, where:Optional[Dict[str, Any]] = None, include:Optional[List[str]] = None, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None) -> Dict[str, Any]:
+
+        try:
+            include = include or ["metadatas", "documents", "distances"]
+            check_deadline(deadline, "querying the index")
+            if not search_ef or search_ef <= n_results:
+                results = self.collection.query(
+                    query_embeddings=[list(query_embedding)],
+                    n_results=n_results,
+                    where=where,
+                    include=self._chroma_include(include)
+                )
+                check_deadline(deadline, "fetching documents")
+                return self._attach_documents(results, include, nested=True)
+
+            # hnswlib searches with ef = max(hnsw:search_ef, k), so asking for search_ef
+            # neighbours widens the beam for this query only; documents are fetched for the kept rows
+            wide = self.collection.query(
+                query_embeddings=[list(query_embedding)],
+                n_results=search_ef,
+                where=where,
+                include=[field for field in include if field != "documents"]
+            )
+            results = {
+                key: [wide[key][0][:n_results]] if wide.get(key) is not None else None
+                for key in ('ids', 'distances', 'metadatas', 'embeddings')
+            }
+            if "documents" in include:
+                check_deadline(deadline, "fetching documents")
+                if self.documents is not None:
+                    return self._attach_documents(results, include, nested=True)
+                fetched = self.collection.get(ids=results['ids'][0], include=["documents"])
+                by_id = dict(zip(fetched['ids'], fetched['documents']))
+                results['documents'] = [[by_id.get(doc_id, '') for doc_id in results['ids'][0]]]
+            return results
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error searching by embedding: {e}")
+            return {}
+
     def search_by_metadata(self, metadata_filter:Dict[str, str], n_results:int = 5) -> Dict[str, Any]:
 
         try:
             logger.info(f"Searching with metadata filter: {metadata_filter}")
+            include = ["metadatas", "documents", "distances"]
             results = self.collection.query(
-                query_texts=[""],
+                query_embeddings=self.embed_texts([""]),
                 n_results=n_results,
-                where=metadata_filter
+                where=metadata_filter,
+                include=self._chroma_include(include)
             )
-            return results
+            return self._attach_documents(results, include, nested=True)
         except Exception as e:
             logger.error(f"Error searching by metadata: {e}")
             return {}
@@ -65,7 +170,8 @@ class VectorStore:
     def get_document_by_id(self, doc_id:str) -> Optional[Dict[str, Any]]:
         
         try:
-            results = self.collection.get(ids=[doc_id])
+            include = ["metadatas", "documents"]
+            results = self._attach_documents(self.collection.get(ids=[doc_id], include=self._chroma_include(include)), include)
             if results['ids']:
                 return{
                     'id': results['ids'][0],
@@ -77,22 +183,80 @@ class VectorStore:
             logger.error(f"Error getting document by ID:{e}")
             return None
 
-    def get_all_documents(self, limit:Optional[int] = None) -> Dict[str, Any]:
+    def get_documents_by_ids(self, doc_ids:List[str], include:Optional[List[str]] = None) -> Dict[str, Any]:
 
         try:
-            if limit:
-                results = self.collection.get(limit=limit)
-            else:
-                results = self.collection.get()
+            include = include or ["metadatas", "documents"]
+            results = self.collection.get(
+                ids=doc_ids,
+                include=self._chroma_include(include)
+            )
+            return self._attach_documents(results, include)
+        except Exception as e:
+            logger.error(f"Error getting documents by IDs:{e}")
+            return {}
+
+    def read_previews(self, doc_ids:List[str], length:int) -> List[Optional[str]]:
+        """First length characters of each text, None for ids this collection does not hold"""
+        try:
+            previews = [None] * len(doc_ids)
+            if self.documents is not None:
+                # Only the first block of each text is decompressed
+                previews = self._read_texts(doc_ids, length)
+            missing = [doc_id for doc_id, preview in zip(doc_ids, previews) if preview is None]
+            if missing:
+                legacy = self.collection.get(ids=missing, include=["documents"])
+                by_id = {doc_id: (text or '')[:length] for doc_id, text in zip(legacy['ids'], legacy['documents'])}
+                previews = [by_id.get(doc_id) if preview is None else preview for doc_id, preview in zip(doc_ids, previews)]
+            return previews
+        except Exception as e:
+            logger.error(f"Error reading previews:{e}")
+            return [None] * len(doc_ids)
+
+    def get_ids(self) -> List[str]:
+        """Every id in the collection, e.g. to copy a fixed set of rows while writes go on"""
+        return self.collection.get(include=[])['ids']
+
+    def get_embeddings(self, doc_ids:Optional[List[str]] = None, where:Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+
+        try:
+            results = self.collection.get(
+                ids=doc_ids,
+                where=where,
+                include=["embeddings", "metadatas"]
+            )
             return results
+        except Exception as e:
+            logger.error(f"Error getting embeddings:{e}")
+            return {}
+
+    def get_all_documents(self, limit:Optional[int] = None, include:Optional[List[str]] = None) -> Dict[str, Any]:
+        """Metadata of every row by default; use iter_documents to walk texts or vectors in constant memory"""
+        try:
+            include = include or ["metadatas"]
+            results = self.collection.get(limit=limit, include=self._chroma_include(include))
+            return self._attach_documents(results, include)
         except Exception as e:
             logger.error(f"Error getting all documents:{e}")
             return {}
     
+    def iter_documents(self, batch_size:int = BULK_BATCH_SIZE, include:Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """Page through the collection with offset/limit, yielding one Chroma-shaped batch at a time"""
+        include = include or ["metadatas", "documents"]
+        offset = 0
+        while True:
+            batch = self.collection.get(offset=offset, limit=batch_size, include=self._chroma_include(include))
+            if not batch['ids']:
+                break
+            yield self._attach_documents(batch, include)
+            offset += len(batch['ids'])
+    
     def delete_document(self, doc_id:str) -> bool:
 
         try:
             self.collection.delete(ids=[doc_id])
+            if self.documents is not None:
+                self.documents.delete_many(self._text_keys([doc_id]))
             logger.info(f"Deleted document: {doc_id}")
             return True
         except Exception as e:
@@ -102,17 +266,74 @@ class VectorStore:
     def update_document(self, doc_id:str, document:str, metadata:Dict[str,str]) -> bool:
 
         try:
-            self.collection.update(
-                ids=[doc_id],
-                documents=[document],
-                metadatas=[metadata]
-            )
+            self.write_records([doc_id], self.embed_texts([document]), [metadata], [document], method="update")
             logger.info(f"Updated document: {doc_id}")
             return True
         except Exception as e:
             logger.error(f"Error updating document:{e}")
             return False
 
+    def upsert_documents(self, doc_ids:List[str], documents:List[str], metadatas:List[Dict[str,str]], batch_size:int = BULK_BATCH_SIZE, progress_callback:Optional[Callable[[int], None]] = None) -> Dict[str, int]:
+
+        stats = {"embedded": 0, "metadata_only": 0, "batches": 0}
+        for start in range(0, len(doc_ids), batch_size):
+            batch_ids = doc_ids[start:start + batch_size]
+            batch_documents = documents[start:start + batch_size]
+            batch_metadatas = metadatas[start:start + batch_size]
+
+            # Only rows whose text changed (or are new) need a fresh embedding. The hash is per
+            # collection, so a mirror with its own texts still re-embeds its own rows
+            batch_hashes = [content_hash(document or '') for document in batch_documents]
+            existing = self.collection.get(ids=batch_ids, include=["metadatas", "documents"])
+            current_hash = {
+                doc_id: (metadata or {}).get('content_hash') or (content_hash(document) if document else None)
+                for doc_id, metadata, document in zip(existing['ids'], existing['metadatas'], existing['documents'])
+            }
+            changed = [i for i, doc_id in enumerate(batch_ids) if current_hash.get(doc_id) != batch_hashes[i]]
+            unchanged = [i for i, doc_id in enumerate(batch_ids) if current_hash.get(doc_id) == batch_hashes[i]]
+
+            if changed:
+                # The whole batch is embedded in a single encoder pass
+                changed_documents = [batch_documents[i] for i in changed]
+                self.write_records(
+                    [batch_ids[i] for i in changed],
+                    self.embed_texts(changed_documents),
+                    [batch_metadatas[i] for i in changed],
+                    changed_documents
+                )
+            if unchanged:
+                self.collection.update(
+                    ids=[batch_ids[i] for i in unchanged],
+                    metadatas=[dict(batch_metadatas[i], content_hash=batch_hashes[i]) for i in unchanged]
+                )
+
+            stats["embedded"] += len(changed)
+            stats["metadata_only"] += len(unchanged)
+            stats["batches"] += 1
+            if progress_callback:
+                progress_callback(start + len(batch_ids))
+
+        logger.info(f"Upserted {len(doc_ids)} documents in {stats['batches']} batches ({stats['embedded']} re-embedded)")
+        return stats
+
+    def delete_documents(self, doc_ids:List[str], batch_size:int = BULK_BATCH_SIZE, progress_callback:Optional[Callable[[int], None]] = None) -> int:
+
+        for start in range(0, len(doc_ids), batch_size):
+            batch_ids = doc_ids[start:start + batch_size]
+            self.collection.delete(ids=batch_ids)
+            if self.documents is not None:
+                self.documents.delete_many(self._text_keys(batch_ids))
+            if progress_callback:
+                progress_callback(start + len(batch_ids))
+        logger.info(f"Deleted {len(doc_ids)} documents")
+        return len(doc_ids)
+
+    def drop_collection(self, collection_name:str) -> None:
+        """Drop a collection of this database together with its texts"""
+        self.client.delete_collection(collection_name)
+        if self.documents is not None:
+            self.documents.delete_namespace(collection_name)
+
     def get_document_count(self) -> int:
 
         try:
@@ -0,0 +1,488 @@
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+import numpy as np
+from typing import List, Dict, Optional, Any, Iterator, Callable
+from deadlines import Deadline, DeadlineExceeded, check_deadline
+from sharding import merge_query_results
+from shared_state import pid_alive
+from config import (
+    WRITE_BUFFER_DIRNAME,
+    WRITE_BUFFER_FLUSH_INTERVAL,
+    WRITE_BUFFER_MAX_SIZE,
+    WRITE_BUFFER_OVERFETCH,
+    BULK_BATCH_SIZE
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_segment_name = re.compile(r'segment-(\d+)-(\d+)\.jsonl$')
+
+_OPERATORS = {
+    '$eq': lambda value, operand: value == operand,
+    '$ne': lambda value, operand: value != operand,
+    '$in': lambda value, operand: value in operand,
+    '$nin': lambda value, operand: value not in operand,
+    '$gt': lambda value, operand: value is not None and value > operand,
+    '$gte': lambda value, operand: value is not None and value >= operand,
+    '$lt': lambda value, operand: value is not None and value < operand,
+    '$lte': lambda value, operand: value is not None and value <= operand,
+}
+
+def matches_where(metadata:Optional[Dict[str, Any]], where:Optional[Dict[str, Any]]) -> bool:
+    """Evaluate a Chroma where filter against one metadata dict, for rows Chroma has not seen yet"""
+    if not where:
+        return True
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator not in _OPERATORS:
+                    raise ValueError(f"Unsupported where operator {operator}")
+                if not _OPERATORS[operator](metadata.get(key), operand):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+class BufferedVectorStore:
+    """Absorbs single-document writes in an in-memory delta that is searched next to the main index.
+
+    Each write is appended to a write-ahead log segment, then kept in the delta. A background thread
+    merges the delta into Chroma in batches every flush interval (or once it grows to max_size), so
+    HNSW and sqlite are mutated in a few large writes instead of one per request. Reads merge the
+    delta's brute-force top-k with the main index's, dropping main rows the delta overrides.
+    Bulk writes flush first and hold off single writes until they land, so neither overwrites newer data.
+    """
+
+    def __init__(self, store:Any, flush_interval:float = WRITE_BUFFER_FLUSH_INTERVAL, max_size:int = WRITE_BUFFER_MAX_SIZE, on_flush:Optional[Callable[[str], None]] = None):
+        self.store = store
+        # Called with the collection name once merged rows are visible to every reader of Chroma
+        self.on_flush = on_flush
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        # Set while a migration copies this collection: single writes then go straight to Chroma
+        self.write_through = False
+        self.wal_dir = os.path.join(store.db_path, WRITE_BUFFER_DIRNAME, store.collection_name)
+        os.makedirs(self.wal_dir, exist_ok=True)
+        self.counters = {"buffered_writes": 0, "flushes": 0, "flushed_rows": 0, "failed_flushes": 0, "replayed": 0}
+        self.last_flush = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Held by bulk writes from their flush until Chroma has the rows; single writes wait on it
+        self._bulk_lock = threading.Lock()
+        self._pending:Dict[str, Dict[str, Any]] = {}
+        self._flushing:Dict[str, Dict[str, Any]] = {}
+        self._version = 0
+        self._view_cache = None
+        self._wal = None
+        self._sequence = 0
+        self._segments = self._replay()
+        self._segments.append(self._open_segment())
+
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"flush-{store.collection_name}", daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name:str) -> Any:
+        return getattr(self.store, name)
+
+    # Write-ahead log
+
+    def _open_segment(self) -> str:
+        if self._wal is not None:
+            self._wal.close()
+        self._sequence += 1
+        path = os.path.join(self.wal_dir, f"segment-{os.getpid()}-{self._sequence:06d}.jsonl")
+        self._wal = open(path, 'a')
+        return path
+
+    def _replay(self) -> List[str]:
+        """Load segments of this process and of dead ones (a crashed worker) into the delta"""
+        claimed = []
+        for path in sorted(glob.glob(os.path.join(self.wal_dir, 'segment-*.jsonl')), key=os.path.getmtime):
+            match = _segment_name.search(path)
+            if not match or (int(match.group(1)) != os.getpid() and pid_alive(int(match.group(1)))):
+                continue
+            # Rename before reading so two new workers cannot both replay an orphaned segment
+            self._sequence += 1
+            own_path = os.path.join(self.wal_dir, f"segment-{os.getpid()}-{self._sequence:06d}.jsonl")
+            try:
+                os.rename(path, own_path)
+            except FileNotFoundError:
+                continue
+            with open(own_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # torn last line of a crash
+                    self._pending[record['id']] = self._entry(record)
+                    self.counters["replayed"] += 1
+            claimed.append(own_path)
+        if claimed:
+            logger.info(f"Replayed {self.counters['replayed']} buffered writes from {len(claimed)} log segments")
+        return claimed
+
+    def _entry(self, record:Dict[str, Any]) -> Dict[str, Any]:
+        embedding = record.get('embedding')
+        return dict(record, embedding=np.asarray(embedding, dtype=np.float32) if embedding is not None else None)
+
+    def _in_main(self, doc_id:str) -> bool:
+        """Whether Chroma holds the id, which is what the document count adjusts against"""
+        entry = self._view()['entries'].get(doc_id)
+        if entry is not None:
+            return entry['existed']
+        result = self.store.get_documents_by_ids([doc_id], include=["metadatas"])
+        return bool(result and result.get('ids'))
+
+    def _buffer(self, record:Dict[str, Any], existed:bool) -> None:
+        record = dict(record, existed=existed, buffered_at=time.time())
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            # Flushed to the OS, not fsynced: survives a worker crash, not a power loss
+            self._wal.write(line)
+            self._wal.flush()
+            self._pending[record['id']] = self._entry(record)
+            self._version += 1
+            self.counters["buffered_writes"] += 1
+            full = len(self._pending) >= self.max_size
+        if full:
+            self._wake.set()
+
+    # Writes
+
+    def update_document(self, doc_id:str, document:str, metadata:Dict[str, str]) -> bool:
+
+        if self.write_through:
+            with self._bulk_lock:
+                self.flush()
+                return self.store.update_document(doc_id, document, metadata)
+        try:
+            embedding = self.store.embed_texts([document])[0]
+            with self._bulk_lock:
+                # Same contract as VectorStore.update_document: ids that do not exist are not created
+                entry = self._view()['entries'].get(doc_id)
+                in_main = self._in_main(doc_id)
+                if not (entry['op'] == 'upsert' if entry is not None else in_main):
+                    logger.error(f"Error updating document: {doc_id} does not exist")
+                    return False
+                self._buffer({"op": "upsert", "id": doc_id, "metadata": metadata, "document": document, "embedding": list(embedding)}, in_main)
+            return True
+        except Exception as e:
+            logger.error(f"Error buffering document update: {e}")
+            return False
+
+    def delete_document(self, doc_id:str) -> bool:
+
+        if self.write_through:
+            with self._bulk_lock:
+                self.flush()
+                return self.store.delete_document(doc_id)
+        try:
+            with self._bulk_lock:
+                self._buffer({"op": "delete", "id": doc_id, "metadata": None, "document": None, "embedding": None}, self._in_main(doc_id))
+            return True
+        except Exception as e:
+            logger.error(f"Error buffering document delete: {e}")
+            return False
+
+    def upsert_documents(self, *args:Any, **kwargs:Any) -> Dict[str, int]:
+        with self._bulk_lock:
+            self.flush()
+            return self.store.upsert_documents(*args, **kwargs)
+
+    def delete_documents(self, *args:Any, **kwargs:Any) -> int:
+        with self._bulk_lock:
+            self.flush()
+            return self.store.delete_documents(*args, **kwargs)
+
+    def write_records(self, *args:Any, **kwargs:Any) -> None:
+        with self._bulk_lock:
+            self.flush()
+            return self.store.write_records(*args, **kwargs)
+
+    # Compaction
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> Dict[str, Any]:
+        """Merge the buffered writes into Chroma in batches and drop their log segments"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return {"flushed": 0}
+                frozen, self._pending = self._pending, {}
+                # Readers keep seeing the rows being merged until Chroma has them
+                self._flushing = frozen
+                segments, self._segments = self._segments, [self._open_segment()]
+                self._version += 1
+
+            started = time.perf_counter()
+            upserts = [entry for entry in frozen.values() if entry['op'] == 'upsert']
+            deletes = [entry['id'] for entry in frozen.values() if entry['op'] == 'delete']
+            try:
+                for start in range(0, len(upserts), BULK_BATCH_SIZE):
+                    batch = upserts[start:start + BULK_BATCH_SIZE]
+                    self.store.write_records(
+                        [entry['id'] for entry in batch],
+                        np.stack([entry['embedding'] for entry in batch]).tolist(),
+                        [entry['metadata'] for entry in batch],
+                        [entry['document'] for entry in batch]
+                    )
+                if deletes:
+                    self.store.delete_documents(deletes)
+            except Exception as e:
+                with self._lock:
+                    # Newer writes made during the merge win over the ones being put back
+                    self._pending = {**frozen, **self._pending}
+                    self._flushing = {}
+                    self._segments = segments + self._segments
+                    self._version += 1
+                    self.counters["failed_flushes"] += 1
+                logger.error(f"Error merging write buffer into {self.store.collection_name}: {e}")
+                return {"flushed": 0, "error": str(e)}
+
+            for segment in segments:
+                if os.path.exists(segment):
+                    os.remove(segment)
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._flushing = {}
+                for doc_id, entry in self._pending.items():
+                    if doc_id in frozen:
+                        entry['existed'] = frozen[doc_id]['op'] == 'upsert'
+                self._version += 1
+                self.counters["flushes"] += 1
+                self.counters["flushed_rows"] += len(frozen)
+                self.last_flush = {"at": time.time(), "rows": len(frozen), "upserted": len(upserts), "deleted": len(deletes), "seconds": round(elapsed, 3)}
+            logger.info(f"Merged {len(frozen)} buffered writes into {self.store.collection_name} in {elapsed:.2f}s")
+            if self.on_flush is not None:
+                self.on_flush(self.store.collection_name)
+            return {"flushed": len(frozen), "upserted": len(upserts), "deleted": len(deletes), "seconds": round(elapsed, 3)}
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+        with self._lock:
+            self._wal.close()
+
+    @property
+    def pending(self) -> bool:
+        """Whether this process holds writes other processes cannot see yet"""
+        return bool(self._pending or self._flushing)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = list(self._pending.values())
+            flushing = len(self._flushing)
+            counters = dict(self.counters)
+            segments = list(self._segments)
+        oldest = min((entry['buffered_at'] for entry in pending), default=None)
+        return {
+            "enabled": True,
+            "collection_name": self.store.collection_name,
+            "pending": len(pending),
+            "pending_deletes": sum(entry['op'] == 'delete' for entry in pending),
+            "flushing": flushing,
+            "oldest_pending_seconds": round(time.time() - oldest, 2) if oldest else None,
+            "wal_segments": len(segments),
+            "wal_bytes": sum(os.path.getsize(path) for path in segments if os.path.exists(path)),
+            "flush_interval": self.flush_interval,
+            "max_size": self.max_size,
+            "last_flush": self.last_flush,
+            **counters
+        }
+
+    # Reads
+
+    def _view(self) -> Dict[str, Any]:
+        """Delta rows as arrays for brute-force search, cached until the next write or merge"""
+        with self._lock:
+            if self._view_cache is not None and self._view_cache[0] == self._version:
+                return self._view_cache[1]
+            entries = {**self._flushing, **self._pending}
+            version = self._version
+        upserts = [entry for entry in entries.values() if entry['op'] == 'upsert']
+        view = {
+            'entries': entries,
+            'ids': [entry['id'] for entry in upserts],
+            'embeddings': np.stack([entry['embedding'] for entry in upserts]) if upserts else None,
+            'metadatas': [entry['metadata'] for entry in upserts],
+            'documents': [entry['document'] for entry in upserts]
+        }
+        with self._lock:
+            if self._version == version:
+                self._view_cache = (version, view)
+        return view
+
+    def _search_delta(self, view:Dict[str, Any], query_embedding:List[float], n_results:int, where:Optional[Dict[str, Any]], include:List[str]) -> Dict[str, Any]:
+        rows = [i for i, metadata in enumerate(view['metadatas']) if matches_where(metadata, where)]
+        if not rows:
+            return {}
+        query = np.asarray(query_embedding, dtype=np.float32)
+        # Squared L2 like Chroma, so delta and main distances merge on one scale
+        distances = np.sum((view['embeddings'][rows] - query) ** 2, axis=1)
+        order = np.argsort(distances)[:n_results]
+        picked = [rows[i] for i in order]
+        return {
+            'ids': [[view['ids'][i] for i in picked]],
+            'distances': [distances[order].tolist()],
+            'metadatas': [[view['metadatas'][i] for i in picked]],
+            'documents': [[view['documents'][i] for i in picked]] if "documents" in include else None,
+            'embeddings': [view['embeddings'][picked]] if "embeddings" in include else None
+        }
+
+    def _drop_shadowed(self, result:Dict[str, Any], entries:Dict[str, Any], nested:bool = True) -> Dict[str, Any]:
+        """Remove main-index rows the delta updates or deletes"""
+        if not result or not result.get('ids'):
+            return result
+        ids = result['ids'][0] if nested else result['ids']
+        keep = [i for i, doc_id in enumerate(ids) if doc_id not in entries]
+        if len(keep) == len(ids):
+            return result
+        trimmed = dict(result)
+        for field in ('ids', 'distances', 'metadatas', 'documents', 'embeddings'):
+            values = result.get(field)
+            if values is None:
+                continue
+            rows = values[0] if nested else values
+            kept = [rows[i] for i in keep]
+            trimmed[field] = [kept] if nested else kept
+        return trimmed
+
+    def search_by_text(self, query_text:str, n_results:int = 5, include:Optional[List[str]] = None, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None) -> Dict[str, Any]:
+
+        try:
+            logger.info(f"Searching for: '{query_text}'")
+            check_deadline(deadline, "embedding the query")
+            return self.search_by_embedding(self.store.embed_texts([query_text])[0], n_results, include=include, search_ef=search_ef, deadline=deadline)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error searching buffered store by text: {e}")
+            return {}
+
+    def search_by_embedding(self, query_embedding:List[float], n_results:int = 5, where:Optional[Dict[str, Any]] = None, include:Optional[List[str]] = None, search_ef:Optional[int] = None, deadline:Optional[Deadline] = None) -> Dict[str, Any]:
+
+        view = self._view()
+        if not view['entries']:
+            return self.store.search_by_embedding(query_embedding, n_results, where=where, include=include, search_ef=search_ef, deadline=deadline)
+        include = include or ["metadatas", "documents", "distances"]
+        # Ask for a few extra rows so the ones the delta shadows can be dropped without coming up short
+        overfetch = min(len(view['entries']), WRITE_BUFFER_OVERFETCH)
+        main = self.store.search_by_embedding(
+            query_embedding,
+            n_results + overfetch,
+            where=where,
+            include=list(dict.fromkeys(include + ["distances"])),
+            search_ef=search_ef,
+            deadline=deadline
+        )
+        main = self._drop_shadowed(main, view['entries'])
+        return merge_query_results([main, self._search_delta(view, query_embedding, n_results, where, include)], n_results)
+
+    def search_by_metadata(self, metadata_filter:Dict[str, str], n_results:int = 5) -> Dict[str, Any]:
+
+        if not self._view()['entries']:
+            return self.store.search_by_metadata(metadata_filter, n_results)
+        try:
+            return self.search_by_embedding(self.store.embed_texts([""])[0], n_results, where=metadata_filter)
+        except Exception as e:
+            logger.error(f"Error searching buffered store by metadata: {e}")
+            return {}
+
+    def get_document_by_id(self, doc_id:str) -> Optional[Dict[str, Any]]:
+        entry = self._view()['entries'].get(doc_id)
+        if entry is None:
+            return self.store.get_document_by_id(doc_id)
+        if entry['op'] == 'delete':
+            return None
+        return {'id': doc_id, 'document': entry['document'], 'metadata': entry['metadata']}
+
+    def _overlay_flat(self, result:Dict[str, Any], entries:Dict[str, Any], buffered:List[Dict[str, Any]], include:List[str]) -> Dict[str, Any]:
+        result = self._drop_shadowed(result or {'ids': []}, entries, nested=False)
+        merged = {'ids': list(result.get('ids') or []) + [entry['id'] for entry in buffered]}
+        for field, key in (('metadatas', 'metadata'), ('documents', 'document'), ('embeddings', 'embedding')):
+            if field in include:
+                existing = result.get(field)
+                existing = list(existing) if existing is not None else [None] * (len(merged['ids']) - len(buffered))
+                merged[field] = existing + [entry[key] for entry in buffered]
+        return merged
+
+    def get_documents_by_ids(self, doc_ids:List[str], include:Optional[List[str]] = None) -> Dict[str, Any]:
+        entries = self._view()['entries']
+        if not any(doc_id in entries for doc_id in doc_ids):
+            return self.store.get_documents_by_ids(doc_ids, include=include)
+        include = include or ["metadatas", "documents"]
+        rest = [doc_id for doc_id in doc_ids if doc_id not in entries]
+        result = self.store.get_documents_by_ids(rest, include=include) if rest else {'ids': []}
+        buffered = [entries[doc_id] for doc_id in doc_ids if doc_id in entries and entries[doc_id]['op'] == 'upsert']
+        return self._overlay_flat(result, entries, buffered, include)
+
+    def read_previews(self, doc_ids:List[str], length:int) -> List[Optional[str]]:
+        entries = self._view()['entries']
+        rest = [doc_id for doc_id in doc_ids if doc_id not in entries]
+        # The document store still holds the old text of a buffered update
+        stored = dict(zip(rest, self.store.read_previews(rest, length))) if rest else {}
+        return [
+            stored.get(doc_id) if doc_id not in entries
+            else entries[doc_id]['document'][:length] if entries[doc_id]['op'] == 'upsert' else None
+            for doc_id in doc_ids
+        ]
+
+    def get_embeddings(self, doc_ids:Optional[List[str]] = None, where:Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        entries = self._view()['entries']
+        if not entries:
+            return self.store.get_embeddings(doc_ids, where=where)
+        rest = [doc_id for doc_id in doc_ids if doc_id not in entries] if doc_ids is not None else None
+        result = self.store.get_embeddings(rest, where=where) if rest is None or rest else {'ids': []}
+        buffered = [
+            entry for entry in entries.values()
+            if entry['op'] == 'upsert' and (doc_ids is None or entry['id'] in doc_ids) and matches_where(entry['metadata'], where)
+        ]
+        return self._overlay_flat(result, entries, buffered, ["embeddings", "metadatas"])
+
+    def get_all_documents(self, limit:Optional[int] = None, include:Optional[List[str]] = None) -> Dict[str, Any]:
+        entries = self._view()['entries']
+        result = self.store.get_all_documents(limit, include)
+        if not entries:
+            return result
+        buffered = [entry for entry in entries.values() if entry['op'] == 'upsert']
+        merged = self._overlay_flat(result, entries, buffered, include or ["metadatas"])
+        return {field: values[:limit] for field, values in merged.items()} if limit else merged
+
+    def iter_documents(self, batch_size:int = BULK_BATCH_SIZE, include:Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        include = include or ["metadatas", "documents"]
+        entries = self._view()['entries']
+        for batch in self.store.iter_documents(batch_size, include):
+            batch = self._drop_shadowed(batch, entries, nested=False) if entries else batch
+            if batch['ids']:
+                yield batch
+        buffered = [entry for entry in entries.values() if entry['op'] == 'upsert']
+        for start in range(0, len(buffered), batch_size):
+            yield self._overlay_flat({'ids': []}, {}, buffered[start:start + batch_size], include)
+
+    def get_document_count(self) -> int:
+        entries = self._view()['entries'].values()
+        added = sum(entry['op'] == 'upsert' and not entry['existed'] for entry in entries)
+        removed = sum(entry['op'] == 'delete' and entry['existed'] for entry in entries)
+        return self.store.get_document_count() + added - removed
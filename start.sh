@@ -17,8 +17,16 @@ source .venv/bin/activate
 echo "📥 Installing dependencies..."
 pip install -r requirements.txt
 
+# Bootstrap a replica from a snapshot instead of re-embedding
+if [ -n "$SNAPSHOT_ARCHIVE" ] && [ ! -d "src/chroma_db" ]; then
+    echo "📦 Importing snapshot $SNAPSHOT_ARCHIVE..."
+    cd src
+    python snapshot.py import "$SNAPSHOT_ARCHIVE"
+    cd ..
+fi
+
 # Check if embeddings exist
-if [ ! -f "src/embeddings.npy" ]; then
+if [ ! -f "src/embeddings.npy" ] && [ ! -d "src/chroma_db" ]; then
     echo "🧠 Generating embeddings (this may take a few minutes)..."
     cd src
     python embedding_generation.py